@@ -1,9 +1,11 @@
 #!/usr/bin/python
-"""treebank conversion script; expects no arguments, uses stdin & stdout.
+"""treebank conversion script; reads a file given as argument (converted in
+parallel) or stdin, writes to stdout.
 input is VISL horizontal tree format
 see: http://beta.visl.sdu.dk/treebanks.html#The_source_format
 output: s-expression, ie., tree in bracket notation.
-TODO: turn this into a nltk.Corpus reader
+VISLCorpusReader reads single sentences, ranges and samples from a treebank
+file lazily, using an index of byte offsets.
 """
 
 example = """X:np
@@ -42,24 +44,41 @@ example3 = """STA:par
 ====H:prp("pri")        pri
 ====DP:n("monopolismo" S NOM)   monopolismo"""
 
+example4 = """<s_id=812>
+SOURCE: id=812
+ID=812 Necesus adapti la metodon por iuj alilandaj klavaroj.
+A1
+STA:fcl
+=P:v-fin("necesi" <*> <mv> COND VFIN)	Necesus
+=S:icl
+==P:v-inf("adapti" <mv>)	adapti
+==Od:np
+===DN:art("la")	la
+===H:n("metodo" <ac> S ACC)	metodon
+===DN:pp
+====H:prp("por" <aquant>)	por
+====DP:np
+=====DN:pron("iu" <quant> DET P NOM)	iuj
+=====DN:adj("alilanda" P NOM)	alilandaj
+=====H:n("klavaro" <cc-h> <tool-mus> P NOM)	klavaroj
+.
+
+</s>
+"""
+
 from nltk import Tree
 from nltk.tokenize import word_tokenize, wordpunct_tokenize
-from sys import stdin, stdout, stderr
-import re
+from sys import stdin, stdout, stderr, argv
+from multiprocessing import Pool, cpu_count
+from getopt import getopt
+import re, os, random
 from itertools import chain
+from transform import transform
 
 def forcepos(tree):
 	""" make sure all terminals have POS tags; 
 	invent one if necessary ("parent_word") """
-	result = tree.copy(True)
-	for a in tree.treepositions('leaves'):
-		if len(tree[a[:-1]]) != 1:
-			result[a] = Tree("%s_%s" % (tree[a[:-1]].node, tree[a]), [tree[a]])
-	for a in tree.treepositions():
-		if isinstance(tree[a], Tree) and len(tree[a]) == 0:
-			tree[a] += tree[a].node
-			# = Tree("%s_%s" % (tree[a[:-1]].node, tree[a]), [tree[a]])
-	return result
+	return transform(tree, forcepos=True, node=Tree)
 
 def leaves(xx):
 	"""include "non-terminals" if they have no children"""
@@ -177,97 +196,261 @@ def reparse(tree):
 		stack.pop()
 	return ' '.join(result)
 
-def main():
-	"""take a treebank from stdin in horizontal tree format, and output it
-	in s-expression format (ie., bracket notation, WSJ format). Checks
-	whether original sentence and leaves of the tree match, and discards
-	the tree if they don't. Also removes trees marked problematic with the
-	tag "CAVE" in the comments.  Example input:
-	<s_id=812>
-	SOURCE: id=812
-	ID=812 Necesus adapti la metodon por iuj alilandaj klavaroj.
-	A1
-	STA:fcl
-	=P:v-fin("necesi" <*> <mv> COND VFIN)   Necesus
-	=S:icl
-	==P:v-inf("adapti" <mv>)        adapti
-	==Od:np
-	===DN:art("la") la
-	===H:n("metodo" <ac> S ACC)     metodon
-	===DN:pp
-	====H:prp("por" <aquant>)       por
-	====DP:np
-	=====DN:pron("iu" <quant> DET P NOM)    iuj
-	=====DN:adj("alilanda" P NOM)   alilandaj
-	=====H:n("klavaro" <cc-h> <tool-mus> P NOM)     klavaroj
-	.
-
-	</s>
+def blocks(lines):
+	""" group the lines of a treebank in VISL format into sentence blocks,
+	from an <s_id=...> line up to and including the next </s> line. Lines
+	outside of blocks are skipped, as is an unterminated last block.
+
+	>>> [len(a) for a in blocks(example4.splitlines(True) * 2)]
+	[20, 20]
 	"""
-	correct = n = cave = mismatch = failed = 0
-	s = False
-	for a in stdin:
-		if s and a[:4] == "</s>":
-			s = 0
-			if tree[-2].strip() == '.':
-				tree = tree[:-2] #+ ['']
-				period = ' .'
-			else: period = ''
-			x = "(TOP %s%s)" % (reparse(tree).replace('()',''), period)
-
-			try:
-				xx = forcepos(Tree(x))
-			except ValueError:
-				# this only happens when our output failes to parse (malformed s-expression -- eg. unbalanced parens):
-				stderr.write("""failed to parse:
-input:  %s
-output: %s
-""" % ("".join(tree), str(x)))
-				failed += 1
-				continue
-			if sent == leaves(xx):
-				# this tree is fine
-				stdout.write("%s\n" % x)
-				#stdout.write("%s\n" % str(xx).replace('\n',''))
-				correct += 1
-			else:
-				# this happens when the leaves do not agree with the original sentence in the comment line above the tree
-				stderr.write("""sentence-leaves mismatch!
-expected: %s
-got:      %s
-tree:
-%s
-""" % (repr(sent), repr(leaves(xx)), str(x)))
-				mismatch += 1
-		elif s and a[:2] == "ID":
+	block = None
+	for a in lines:
+		if block is None:
+			if a[:2] == "<s": block = [a]
+		else:
+			block.append(a)
+			if a[:4] == "</s>":
+				yield block
+				block = None
+
+def convert(block):
+	""" convert a sentence block in VISL format to an s-expression (ie.,
+	bracket notation, WSJ format). Checks whether original sentence and
+	leaves of the tree match. Returns a tuple (status, s-expression,
+	message), where status is 'ok', 'cave' (the tree is marked
+	problematic with the tag CAVE in the comments), 'mismatch' (the leaves
+	do not agree with the original sentence) or 'failed' (malformed
+	s-expression); message describes the problem.
+
+	>>> convert(list(blocks(example4.splitlines(True)))[0])[:2]
+	('ok', '(TOP (STA:fcl (P:v-fin Necesus) (S:icl (P:v-inf adapti) (Od:np (DN:art la) (H:n metodon) (DN:pp (H:prp por) (DP:np (DN:pron iuj) (DN:adj alilandaj) (H:n klavaroj)))))) .)')
+	"""
+	s = 1
+	tree, sent = [], None
+	for a in block[1:]:
+		if a[:4] == "</s>":
+			break
+		elif a[:2] == "ID":
 			# "ID=123 the sentence." => ['the', 'sentence', '.']
-			# we need this monstrosity because word_tokenize does
-			# not tokenize "word.)" into three tokens like it
-			# should
-			# sent = wordpunct_tokenize(" ".join(word_tokenize(a[a.index(' ')+1:].replace('(','{').replace(')','}'))))
-			def mytokenize(a):
-				pass
 			sent = word_tokenize(a.split(' ', 1)[1].replace('(','{').replace(')','}'))
-		elif s and "CAVE" in a:
+		elif "CAVE" in a:
 			# skip trees with errors (a cave circularity is 
 			# a circular dependency link, which is illegal)
-			cave += 1
-			s = 0
-		elif s:
-			s += 1
-		
+			return 'cave', None, None
+		else: s += 1
 		if a[0] == "#": 
 			continue
-
 		if s >= 4:
 			tree.append(a)
+	if tree[-2].strip() == '.':
+		tree = tree[:-2] #+ ['']
+		period = ' .'
+	else: period = ''
+	x = "(TOP %s%s)" % (reparse(tree).replace('()',''), period)
+	try:
+		xx = forcepos(Tree(x))
+	except ValueError:
+		# this only happens when our output failes to parse (malformed s-expression -- eg. unbalanced parens):
+		return 'failed', x, """failed to parse:
+input:  %s
+output: %s
+""" % ("".join(tree), str(x))
+	if sent != leaves(xx):
+		# this happens when the leaves do not agree with the original sentence in the comment line above the tree
+		return 'mismatch', x, """sentence-leaves mismatch!
+expected: %s
+got:      %s
+tree:
+%s
+""" % (repr(sent), repr(leaves(xx)), str(x))
+	return 'ok', x, None
+
+resid = re.compile(r'<s_id=([^>\s]*)')
+
+def buildindex(filename):
+	""" scan a treebank in VISL format and return a list with the id, byte
+	offset and length of each sentence block. """
+	index = []
+	offset, start = 0, None
+	for a in open(filename, 'rb'):
+		if start is None:
+			if a[:2] == "<s":
+				start = offset
+				match = resid.match(a)
+				sid = match.group(1) if match else str(len(index))
+		elif a[:4] == "</s>":
+			index.append((sid, start, offset + len(a) - start))
+			start = None
+		offset += len(a)
+	return index
+
+def readindex(filename):
+	""" the index of a treebank, read from filename + '.idx', or built and
+	saved there when that file is missing or older than the treebank. """
+	idx = filename + '.idx'
+	if os.path.exists(idx) and os.path.getmtime(idx) >= os.path.getmtime(filename):
+		return [(sid, int(offset), int(length)) for sid, offset, length in
+			(a.split('\t') for a in open(idx))]
+	index = buildindex(filename)
+	try: open(idx, 'w').writelines("%s\t%d\t%d\n" % a for a in index)
+	except IOError: stderr.write("could not write index %s\n" % idx)
+	return index
+
+class VISLCorpusReader:
+	def __init__(self, filename):
+		""" a lazy reader for a treebank in VISL format. Sentences are read
+		on demand using an index of byte offsets, which is built on first
+		use (cf. readindex), so single sentences, ranges and samples can be
+		read without scanning the file. Sentences are addressed by their
+		position in the file; use position() to look up a sentence id.
+		Trees which fail to convert (cf. convert) are left out of the
+		results of sexprs() and parsed_sents(). """
+		self.filename = filename
+		self.index = readindex(filename)
+		self.positions = dict((sid, n) for n, (sid, _, _) in enumerate(self.index))
+		self.file = open(filename, 'rb')
+	def __len__(self):
+		return len(self.index)
+	def ids(self):
+		return [sid for sid, _, _ in self.index]
+	def position(self, sid):
+		""" the position of the sentence with id sid """
+		return self.positions[sid]
+	def blocks(self, start=0, end=None):
+		""" the blocks of the sentences in positions start up to end, read
+		with a single seek. """
+		index = self.index[start:end]
+		if not index: return []
+		offset = index[0][1]
+		self.file.seek(offset)
+		data = self.file.read(index[-1][1] + index[-1][2] - offset)
+		return [data[a - offset:a - offset + b].splitlines(True)
+			for _, a, b in index]
+	def block(self, n):
+		""" the lines of the sentence block in position n """
+		return self.blocks(n, n + 1)[0]
+	def sexpr(self, n):
+		""" the s-expression of the sentence in position n, or None if it
+		could not be converted. """
+		status, x, message = convert(self.block(n))
+		if status == 'ok': return x
+	def sexprs(self, start=0, end=None):
+		return [x for status, x, message in
+			map(convert, self.blocks(start, end)) if status == 'ok']
+	def parsed_sent(self, n):
+		x = self.sexpr(n)
+		if x is not None: return Tree(x)
+	def parsed_sents(self, start=0, end=None):
+		return map(Tree, self.sexprs(start, end))
+	def sample(self, k):
+		""" the trees of a random sample of k sentences (read in the order of
+		the file) """
+		return filter(None, map(self.parsed_sent,
+			sorted(random.sample(range(len(self)), k))))
+	def __iter__(self):
+		for block in blocks(open(self.filename, 'rb')):
+			status, x, message = convert(block)
+			if status == 'ok': yield Tree(x)
+
+STATUS = ('ok', 'cave', 'mismatch', 'failed')
 
-		if not s and a[:2] == "<s":
-			s = 1
-			n += 1
-			tree = []
-	stderr.write("converted %d of %d trees in input\n" % (correct, n))
-	stderr.write("cave circularities: %d, sentence-leaves mismatches: %d\nmalformed s-expression output: %d\n" % (cave, mismatch, failed))
+def convertlines(lines):
+	""" convert the sentence blocks in a sequence of lines. Returns the
+	s-expressions of the converted trees, the messages about the rejected
+	trees, a dictionary with the number of trees per status (cf. convert)
+	and the total number of trees. """
+	out, messages = [], []
+	count = dict.fromkeys(STATUS, 0)
+	n = 0
+	for block in blocks(lines):
+		n += 1
+		status, x, message = convert(block)
+		count[status] += 1
+		if status == 'ok': out.append(x)
+		elif message: messages.append(message)
+	return out, messages, count, n
+
+def convertstream(lines, out=stdout, err=stderr):
+	""" convert the sentence blocks in a sequence of lines serially,
+	writing each tree or message as soon as its block is converted, so
+	that the input need not fit in memory. Returns the dictionary of
+	counters and the total number of trees (cf. convertfile). """
+	count = dict.fromkeys(STATUS, 0)
+	n = 0
+	for block in blocks(lines):
+		n += 1
+		status, x, message = convert(block)
+		count[status] += 1
+		if status == 'ok': out.write("%s\n" % x)
+		elif message: err.write(message)
+	return count, n
+
+def shards(filename, n):
+	""" split a treebank file into at most n byte ranges of roughly equal
+	size, each ending right after a </s> line (or at the end of the file),
+	so that no sentence block straddles two ranges. """
+	size = os.path.getsize(filename)
+	f = open(filename, 'rb')
+	boundaries = [0]
+	for a in range(1, n):
+		if size * a / n <= boundaries[-1]: continue
+		# go to the start of the first line at or after the target offset
+		f.seek(size * a / n - 1)
+		f.readline()
+		line = f.readline()
+		while line and line[:4] != "</s>": line = f.readline()
+		if f.tell() > boundaries[-1]: boundaries.append(f.tell())
+	f.close()
+	if boundaries[-1] < size: boundaries.append(size)
+	return zip(boundaries, boundaries[1:])
+
+def convertshard(args):
+	""" convert the sentence blocks in a byte range of a file """
+	filename, start, end = args
+	f = open(filename, 'rb')
+	f.seek(start)
+	lines = f.read(end - start).splitlines(True)
+	f.close()
+	return convertlines(lines)
+
+def convertfile(filename, workers=None, out=stdout, err=stderr):
+	""" convert a treebank file on a pool of worker processes, splitting it
+	into several shards per worker. The results of the shards are written
+	in the order of the file, and their counters are merged. Returns the
+	dictionary of counters and the total number of trees. """
+	if workers is None: workers = cpu_count()
+	pool = Pool(workers)
+	count = dict.fromkeys(STATUS, 0)
+	total = 0
+	for sexprs, messages, shardcount, n in pool.imap(convertshard,
+			[(filename, a, b) for a, b in shards(filename, 4 * workers)]):
+		out.writelines("%s\n" % x for x in sexprs)
+		err.writelines(messages)
+		for a in STATUS: count[a] += shardcount[a]
+		total += n
+	pool.close()
+	pool.join()
+	return count, total
+
+def main():
+	"""take a treebank from stdin (or a file) in horizontal tree format, and output it
+	in s-expression format (ie., bracket notation, WSJ format). Checks
+	whether original sentence and leaves of the tree match, and discards
+	the tree if they don't. Also removes trees marked problematic with the
+	tag "CAVE" in the comments. Example input: see example4.
+	A file is converted in parallel (cf. convertfile), stdin serially
+	as it is read (cf. convertstream).
+	usage: python arbobanko.py [-j workers] [treebank] > output
+	"""
+	opts, args = getopt(argv[1:], "j:")
+	opts = dict(opts)
+	if args:
+		count, n = convertfile(args[0], int(opts['-j']) if '-j' in opts else None)
+	else:
+		count, n = convertstream(stdin)
+	stderr.write("converted %d of %d trees in input\n" % (count['ok'], n))
+	stderr.write("cave circularities: %d, sentence-leaves mismatches: %d\nmalformed s-expression output: %d\n" % (count['cave'], count['mismatch'], count['failed']))
 
 
 if __name__ == '__main__':
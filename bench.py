@@ -0,0 +1,324 @@
+#!/usr/bin/python
+""" Benchmarks of the DOP pipeline: grammar extraction (with the time of
+each stage, cf. metrics.py), writing the grammar in bitpar's format and
+compiling it for the CKY parser, loading it, the latency of parsing a
+sentence by sentence length, and the throughput of batch parsing.
+
+The treebanks are the trees of corpus.py, the morphology corpus
+(morph.corp.txt, as in morph.morphmodel()), and synthetic treebanks of
+increasing size generated with a fixed seed, with a given maximal depth
+and branching factor (cf. synthetictreebank()), which show how the
+pipeline scales. The sentences of the synthetic treebanks are parsed with
+a grammar of a treebank generated with another seed, so some of them have
+no parse; the sentences of the other treebanks are their own. With -l,
+the sentences of a slow log (cf. metrics.starttrace) are parsed with the
+DOP model of prefix.train (cf. morph.readtrain), optionally only those
+recorded for one model.
+
+The results are written as JSON. When a baseline (the results of an
+earlier run) is given, the timings are compared with it, and a slowdown
+of more than the tolerance (default 20%) is reported as a regression, in
+which case the exit status is 1.
+
+usage: python bench.py [-s sizes] [-d depth] [-b branching] [-n sents]
+	[-p cky|bitpar] [-r seed] [-o results] [-c baseline] [-t tolerance]
+	[-l slowlog [-f prefix] [-m model]] [synthetic] [corpus] [morphology]
+	sizes is a comma separated list of numbers of trees (default
+	100,200,400); by default all treebanks are used, and the results are
+	written to bench.json.
+"""
+from random import Random
+from time import time
+from getopt import getopt
+from sys import argv, stdout
+import os, tempfile
+import metrics
+
+# upper bounds of the sentence lengths of each latency bucket
+LENGTHS = (5, 10, 20, 40)
+# the stages of grammar extraction (cf. GoodmanDOP.__init__)
+STAGES = ("decorate_with_ids", "nodefreq", "goodman", "frequencies")
+PHRASES = ("NP", "VP", "PP", "AP", "S")
+TAGS = ("DT", "NN", "VB", "JJ", "IN", "RB")
+
+def synthetictreebank(n, depth=4, branching=3, seed=1, vocabulary=10):
+	""" n random trees in bracket notation. Each phrase has one to
+	branching children; a child of a phrase above the given depth is
+	again a phrase with probability 1/2, else a POS tag with one of
+	vocabulary words.
+
+	>>> synthetictreebank(2, depth=2, branching=2)
+	['(S (IN in2))', '(S (AP (DT dt0) (RB rb4)))']
+	"""
+	rng = Random(seed)
+	def phrase(label, level):
+		children = []
+		for _ in range(rng.randint(1, branching)):
+			if level < depth and rng.random() < 0.5:
+				children.append(phrase(rng.choice(PHRASES), level + 1))
+			else:
+				tag = rng.choice(TAGS)
+				children.append("(%s %s%d)" % (tag, tag.lower(),
+					rng.randrange(vocabulary)))
+		return "(%s %s)" % (label, " ".join(children))
+	return [phrase("S", 1) for _ in range(n)]
+
+def lengthbucket(n):
+	""" the name of the latency bucket of a sentence of n words
+
+	>>> lengthbucket(3), lengthbucket(12), lengthbucket(41)
+	('1-5', '11-20', '41-')
+	"""
+	low = 1
+	for high in LENGTHS:
+		if n <= high: return "%d-%d" % (low, high)
+		low = high + 1
+	return "%d-" % low
+
+def percentile(seq, q):
+	""" the q-th quantile of a sorted sequence (nearest rank) """
+	return seq[int(round(q * (len(seq) - 1)))]
+
+def benchmark(trees, sents, rootsymbol='S', wrap=False, parser='cky',
+		unknownwords=None):
+	""" time extraction, writing, loading and parsing with the DOP model
+	of a list of trees in bracket notation; sents are the sentences to
+	parse. Returns a dictionary with the results. """
+	from nltk import Tree
+	from dopg import GoodmanDOP
+	from cky import CKYParser, Grammar, CompiledGrammar, compilegrammar
+	from bitpar import writegrammar
+	result = dict(trees=len(trees), sentences=len(sents), seconds={})
+	seconds = result['seconds']
+	trees = [Tree(a) for a in trees]
+	# the stages are timed by the instrumentation of dopg
+	enabled = metrics.enabled
+	metrics.enable()
+	before = dict((a, metrics.histograms[a].sum) for a in STAGES
+		if a in metrics.histograms)
+	begin = time()
+	d = GoodmanDOP(trees, rootsymbol=rootsymbol, wrap=wrap,
+		parser=CKYParser, unknownwords=unknownwords)
+	seconds['build'] = time() - begin
+	for a in STAGES:
+		if a in metrics.histograms:
+			seconds[a] = metrics.histograms[a].sum - before.get(a, 0.0)
+	seconds['extract'] = sum(seconds.get(a, 0.0) for a in STAGES)
+	if not enabled: metrics.disable()
+	result['rules'] = len(d.fcfg)
+
+	directory = tempfile.mkdtemp()
+	name = "bench%d" % os.getpid()
+	pcfgfile = os.path.join(directory, "g%s.pcfg" % name)
+	lexfile = os.path.join(directory, "g%s.lex" % name)
+	compiled = os.path.join(directory, "g%s.cky" % name)
+	begin = time()
+	result['bytes'] = writegrammar(d.fcfg, d.lexicon, pcfgfile, lexfile)
+	seconds['write'] = time() - begin
+	begin = time()
+	compilegrammar(d.parser.grammar, compiled)
+	seconds['compile'] = time() - begin
+	result['compiledbytes'] = os.path.getsize(compiled)
+	begin = time()
+	grammar = Grammar(d.fcfg, d.lexicon, rootsymbol, unknownwords)
+	seconds['load'] = time() - begin
+	begin = time()
+	CompiledGrammar(compiled).close()
+	seconds['loadcompiled'] = time() - begin
+	if parser == 'bitpar':
+		from bitpar import BitParChartParser
+		begin = time()
+		p = BitParChartParser(rootsymbol=rootsymbol, unknownwords=unknownwords,
+			name=name, directory=directory, cleanup=False)
+		seconds['loadbitpar'] = time() - begin
+	else: p = CKYParser(grammar)
+
+	latencies = {}
+	for n, sent in enumerate(sents):
+		bucket = latencies.setdefault(lengthbucket(len(sent)), ([], [0]))
+		begin = time()
+		try: p.parse(sent)
+		except (ValueError, StopIteration): bucket[1][0] += 1
+		bucket[0].append(time() - begin)
+		stdout.write("\r%d / %d" % (n + 1, len(sents)))
+		stdout.flush()
+	stdout.write("\r")
+	result['latency'] = dict((a, dict(sentences=len(times), noparse=noparse,
+			mean=sum(times) / len(times), p50=percentile(sorted(times), 0.5),
+			p90=percentile(sorted(times), 0.9)))
+		for a, (times, [noparse]) in latencies.items())
+	begin = time()
+	p.batch_parse(sents)
+	elapsed = time() - begin
+	result['throughput'] = len(sents) / elapsed if elapsed else 0.0
+	if parser == 'bitpar': p.stop()
+	for a in os.listdir(directory): os.remove(os.path.join(directory, a))
+	os.rmdir(directory)
+	return result
+
+def synthetic(sizes, depth=4, branching=3, nsents=100, seed=1,
+		parser='cky'):
+	""" benchmark the synthetic treebanks of the given sizes """
+	test = synthetictreebank(nsents, depth, branching, seed + 1)
+	sents = [leaves(a) for a in test]
+	return [("synthetic-%d" % n, benchmark(synthetictreebank(n, depth,
+		branching, seed), sents, parser=parser)) for n in sizes]
+
+def corpustrees(nsents=100, parser='cky'):
+	""" benchmark the trees of corpus.py, as in morph.syntaxmodel() """
+	from corpus import corpus
+	from morph import malchapelitoj
+	trees = [malchapelitoj(a) for a in corpus if a.strip()]
+	return benchmark(trees, [leaves(a) for a in trees[:nsents]],
+		parser=parser)
+
+def morphology(nsents=100, parser='cky'):
+	""" benchmark the morphology corpus, as in morph.morphmodel() """
+	from nltk import Tree
+	from morph import malchapelitoj, forcepos
+	mcorpus = [forcepos(Tree(malchapelitoj(a))) for a in
+		open("morph.corp.txt") if a.strip()]
+	trees = [a._pprint_flat('', '()', '') for a in mcorpus]
+	return benchmark(trees, [a.leaves() for a in mcorpus[:nsents]], 'W',
+		wrap=True, parser=parser, unknownwords='unknownmorph')
+
+def slowsentences(slowlog, prefix="arbobanko", model=None, parser='cky'):
+	""" benchmark the sentences of a slow log with the DOP model of
+	prefix.train """
+	from morph import readtrain
+	sents = [[a.encode('utf-8') for a in record['sentence']]
+		for record in metrics.readtrace(slowlog, model)]
+	trees = [a._pprint_flat('', '()', '') for a in readtrain(prefix)]
+	return benchmark(trees, sents, 'top', parser=parser,
+		unknownwords='unknownwordsm')
+
+def leaves(tree):
+	""" the words of a tree in bracket notation, without building it
+
+	>>> leaves("(S (NP (DT the) (NN dog)) (VB walks) )")
+	['the', 'dog', 'walks']
+	"""
+	return [a.rstrip(")") for a in tree.split()
+		if not a.startswith("(") and a.rstrip(")")]
+
+def flatten(results, path=""):
+	""" (path, value) pairs of the numbers in nested dictionaries
+
+	>>> flatten({'a': {'b': 1, 'c': {'d': 2.5}}, 'e': 'x'})
+	[('a/b', 1), ('a/c/d', 2.5)]
+	"""
+	pairs = []
+	for key in sorted(results):
+		value = results[key]
+		name = "%s/%s" % (path, key) if path else key
+		if isinstance(value, dict): pairs.extend(flatten(value, name))
+		elif isinstance(value, (int, long, float)): pairs.append((name, value))
+	return pairs
+
+def compare(baseline, current, tolerance=0.2, mintime=0.01):
+	""" compare two sets of results; returns a list of (name, baseline,
+	current, relative change, status) tuples, where status is
+	"regression" or "improvement" for timings (which are lower is better,
+	except for throughput) that changed by more than tolerance and
+	mintime seconds, and "changed" for other numbers that differ, such as
+	the number of rules.
+
+	>>> old = {'x': {'rules': 10, 'seconds': {'build': 1.0, 'write': 0.001},
+	... 'throughput': 50.0}}
+	>>> new = {'x': {'rules': 12, 'seconds': {'build': 1.5, 'write': 0.003},
+	... 'throughput': 80.0}}
+	>>> for a in compare(old, new): print a
+	('x/rules', 10, 12, 0.2, 'changed')
+	('x/seconds/build', 1.0, 1.5, 0.5, 'regression')
+	('x/seconds/write', 0.001, 0.003, 2.0, '')
+	('x/throughput', 50.0, 80.0, 0.6, 'improvement')
+	"""
+	old = dict(flatten(baseline))
+	result = []
+	for name, new in flatten(current):
+		if name not in old: continue
+		change = (new - old[name]) / float(old[name]) if old[name] else 0.0
+		status = ""
+		last = name.rsplit("/", 1)[-1]
+		if last == 'throughput':
+			if change > tolerance: status = "improvement"
+			elif change < -tolerance: status = "regression"
+		elif '/seconds/' in name or last in ('mean', 'p50', 'p90'):
+			if abs(new - old[name]) > mintime:
+				if change > tolerance: status = "regression"
+				elif change < -tolerance: status = "improvement"
+		elif new != old[name]: status = "changed"
+		result.append((name, old[name], new, change, status))
+	return result
+
+def environment():
+	""" the python version, platform and git revision of this run """
+	from platform import platform, python_version
+	from subprocess import Popen, PIPE
+	try:
+		revision = Popen(["git", "rev-parse", "HEAD"], stdout=PIPE,
+			stderr=PIPE).communicate()[0].strip()
+	except OSError: revision = ""
+	return dict(python=python_version(), platform=platform(),
+		revision=revision, time=time())
+
+def main():
+	from json import dump, load
+	opts, args = getopt(argv[1:], "s:d:b:n:p:r:o:c:t:l:f:m:")
+	opts = dict(opts)
+	if set(args) - set(("synthetic", "corpus", "morphology")):
+		print __doc__
+		return
+	if not args and '-l' not in opts:
+		args = ("synthetic", "corpus", "morphology")
+	sizes = [int(a) for a in opts.get('-s', '100,200,400').split(',')]
+	depth, branching = int(opts.get('-d', 4)), int(opts.get('-b', 3))
+	nsents, seed = int(opts.get('-n', 100)), int(opts.get('-r', 1))
+	parser = opts.get('-p', 'cky')
+	params = dict(sizes=sizes, depth=depth, branching=branching,
+		sentences=nsents, seed=seed, parser=parser, slowlog=opts.get('-l'))
+	results = []
+	if "synthetic" in args:
+		results.extend(synthetic(sizes, depth, branching, nsents, seed, parser))
+	if "corpus" in args: results.append(("corpus", corpustrees(nsents, parser)))
+	if "morphology" in args:
+		results.append(("morphology", morphology(nsents, parser)))
+	if '-l' in opts:
+		results.append(("slowlog", slowsentences(opts['-l'],
+			opts.get('-f', "arbobanko"), opts.get('-m'), parser)))
+	for name, a in results:
+		print "%s: %d trees, %d rules, extract %.2f s, write %.2f s, %.1f sents/s" % (
+			name, a['trees'], a['rules'], a['seconds']['extract'],
+			a['seconds']['write'], a['throughput'])
+		for bucket in sorted(a['latency'], key=lambda b: int(b.split('-')[0])):
+			b = a['latency'][bucket]
+			print "\t%s words: %d sents, %d no parse, mean %.4f s, p90 %.4f s" % (
+				bucket, b['sentences'], b['noparse'], b['mean'], b['p90'])
+	out = opts.get('-o', 'bench.json')
+	results = dict(results)
+	dump(dict(environment=environment(), params=params, results=results),
+		open(out, "w"), indent=1, sort_keys=True)
+	print "results written to", out
+	if '-c' in opts:
+		baseline = load(open(opts['-c']))
+		if baseline['params'] != params:
+			print "warning: the parameters of the baseline differ:", baseline['params']
+		regressions = 0
+		for name, old, new, change, status in compare(baseline['results'],
+				results, float(opts.get('-t', 0.2))):
+			if status:
+				print "%-40s %12.4g %12.4g %+7.1f%% %s" % (name, old, new,
+					100 * change, status)
+			regressions += status == "regression"
+		print "%d regressions" % regressions
+		if regressions: raise SystemExit(1)
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	main()
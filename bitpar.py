@@ -6,16 +6,21 @@ Todo:
  - yield n best parses with probabilites (parameter)
  - parse chart output"""
 from collections import defaultdict
+from itertools import izip
 from subprocess import Popen, PIPE
-from pexpect import spawn
+from pexpect import spawn, TIMEOUT, EOF
 from commands import getoutput
-from time import sleep
+from time import sleep, time
 from uuid import uuid1
 from nltk import Tree, ProbabilisticTree, FreqDist, InsideChartParser
+from sexpr import readsexpr, unescape, ParseTree
+from pipes import quote
 import threading, fcntl, os, re
+import metrics
+from deadline import DeadlineExceeded
 
 class BitParChartParser:
-	def __init__(self, weightedrules=None, lexicon=None, rootsymbol=None, unknownwords=None, openclassdfsa=None, cleanup=True, n=10, name=''):
+	def __init__(self, weightedrules=None, lexicon=None, rootsymbol=None, unknownwords=None, openclassdfsa=None, cleanup=True, n=10, name='', directory='/tmp'):
 		""" Interface to bitpar chart parser. Expects a list of weighted
 		productions with frequencies (not probabilities).
 		
@@ -38,6 +43,8 @@ class BitParChartParser:
 		@param name: filename of grammar files in case you want to export it,
 			if not given will default to a unique identifier
 		@param n: the n best parse trees will be requested
+		@param directory: where to write the grammar files; the files
+			are named g<name>.pcfg and g<name>.lex
 		>>> wrules = (	("S\\tNP\\tVP", 1), \
 				("NP\\tmary", 1), \
 				("VP\\twalks", 1) )
@@ -74,6 +81,11 @@ class BitParChartParser:
 		ProbabilisticTree('S', [Tree('NP', ['mary']), Tree('VP@2', ['walks'])]) (p=0.25), 
 		ProbabilisticTree('S', [Tree('NP@1', ['mary']), Tree('VP', ['walks'])]) (p=0.25), 
 		ProbabilisticTree('S', [Tree('NP@1', ['mary']), Tree('VP@2', ['walks'])]) (p=0.25)]]
+		>>> [len(a) for a in d.parser.batch_parse(["mary walks".split()] * 2,
+		... deadline=time() + 30)]
+		[4, 4]
+		>>> list(d.parser.batch_parse(["mary walks".split()], deadline=time() - 1))
+		[[]]
 
 		TODO: parse bitpar's chart output / parse forest
 		"""
@@ -88,15 +100,17 @@ class BitParChartParser:
 		self.n = n
 		self.unknownwords = unknownwords
 		self.openclassdfsa = openclassdfsa
+		self.pcfgfile = os.path.join(directory, 'g%s.pcfg' % self.id)
+		self.lexfile = os.path.join(directory, 'g%s.lex' % self.id)
 		if weightedrules and lexicon:
-			self.writegrammar('/tmp/g%s.pcfg' % self.id, '/tmp/g%s.lex' % self.id)
+			self.writegrammar(self.pcfgfile, self.lexfile)
 		elif not name:
 			raise ValueError("need grammar or file name")
 		self.start()
 
 	def __del__(self):
-		cmd = "rm /tmp/g%s.pcfg /tmp/g%s.lex" % (self.id, self.id)
-		if self.cleanup or not self.name: Popen(cmd.split())
+		if self.cleanup or not self.name:
+			Popen(["rm", self.pcfgfile, self.lexfile])
 		self.stop()
 
 	def start(self):
@@ -107,24 +121,29 @@ class BitParChartParser:
 		if self.rootsymbol: self.cmd += "-s %s " % self.rootsymbol
 		if self.unknownwords: self.cmd += "-u %s " % self.unknownwords
 		if self.openclassdfsa: self.cmd += "-w %s " % self.openclassdfsa
-		if self.name:
-			# TODO ??
-			self.cmd += "/tmp/g%s.pcfg /tmp/g%s.lex" % (self.id, self.id)
-		else:
-			self.cmd += "/tmp/g%s.pcfg /tmp/g%s.lex" % (self.id, self.id)
+		self.cmd += "%s %s" % (self.pcfgfile, self.lexfile)
 		#if self.debug: print self.cmd.split()
 		#self.bitpar = Popen(self.cmd.split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-		self.bitpar = spawn(self.cmd)
-		self.bitpar.setecho(False)
-		# allow bitpar to initialize; just to be sure
-		sleep(1)
-		try: self.bitpar.read_nonblocking(size=1024, timeout=0)
-		except: pass
+		with metrics.timer("bitpar.start"):
+			self.bitpar = spawn(self.cmd)
+			self.bitpar.setecho(False)
+			# allow bitpar to initialize; just to be sure
+			sleep(1)
+			try: self.bitpar.read_nonblocking(size=1024, timeout=0)
+			except: pass
 	def stop(self):
 		if not self.bitpar.terminated: self.bitpar.terminate()
+	def reload(self, weightedrules, lexicon):
+		""" replace the grammar: the grammar files are rewritten and bitpar
+		is restarted. """
+		self.grammar, self.lexicon = weightedrules, lexicon
+		self.writegrammar(self.pcfgfile, self.lexfile)
+		self.stop()
+		self.start()
 
-	def parse(self, sent):
-		return self.nbest_parse(sent).next()
+	def parse(self, sent, deadline=None):
+		for tree in self.nbest_parse(sent, deadline=deadline): return tree
+		raise ValueError("no parse")
 		"""
 		if self.bitpar.terminated: self.start()
 		try:
@@ -144,83 +163,324 @@ class BitParChartParser:
 		return ProbabilisticTree(tree.node, tree, prob=prob)
 		"""
 
-	def nbest_parse(self, sent, n_will_be_ignored=None):
+	def nbest_parse(self, sent, n_will_be_ignored=None, deadline=None):
 		""" n has to be specified in the constructor because it is specified
 		as a command line parameter to bitpar, allowing it here would require
-		potentially expensive restarts of bitpar. """
-		"""f = "/tmp/%s" % uuid1()
-		open(f, "w").write("%s\n\n" % "\n".join(sent))
-		bitpar = Popen((self.cmd + " " + f).split(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
-		output = bitpar.stdout.read().splitlines() """
+		potentially expensive restarts of bitpar.
+		When the deadline (a time) passes before bitpar is done, it is
+		killed, since it would send the output for this sentence later, and
+		DeadlineExceeded is raised; it is started again for the next
+		sentence. """
+		return (tree.totree(prob) for prob, tree in self.nbest(sent,
+			deadline=deadline))
+
+	def nbest(self, sent, n_will_be_ignored=None, deadline=None):
+		""" the derivations of a sentence as (probability, ParseTree)
+		tuples, which are cheaper to build and to hash than nltk Trees;
+		cf. nbest_parse. """
 		if self.bitpar.terminated: self.start()
-		self.bitpar.send("\n".join(sent) + "\n\n")
+		begin, first = time(), None
+		with metrics.timer("bitpar.send"):
+			self.bitpar.send("\n".join(sent) + "\n\n")
 		output = ""
-		while not output.endswith("\r\n\r\n"):
-			output += self.bitpar.read_nonblocking(size=32767, timeout=30)
-		# remove bitpar's escaping (why does it do that?), strip trailing blank line
-		results = re.sub(r"\\([/{}\[\]<>'\$])", r"\1", output).splitlines()[:-1]
-		probs = (float(a.split("=")[1]) for a in results[::2] if "=" in a)
-		trees = (Tree(a) for a in results[1::2])
-		#Popen(("rm %s" % f).split())
-		return (ProbabilisticTree(b.node, b, prob=a) for a, b in zip(probs, trees))
-
-	def batch_parse(self, sents, n=1):
+		with metrics.timer("bitpar.receive"):
+			try:
+				while not output.endswith("\r\n\r\n"):
+					timeout = 30
+					if deadline is not None:
+						timeout = max(0, min(timeout, deadline - time()))
+					output += self.bitpar.read_nonblocking(size=32767,
+						timeout=timeout)
+					if first is None: first = time()
+			except TIMEOUT:
+				metrics.incr("timeout")
+				if metrics.tracing:
+					metrics.trace(self.name or "bitpar", sent, "timeout", begin,
+						first, unknown=self.countunknown(sent))
+				if deadline is not None and time() >= deadline:
+					self.bitpar.terminate(force=True)
+					raise DeadlineExceeded("deadline exceeded")
+				raise
+		if metrics.tracing:
+			# a probability and a tree for each derivation
+			nbest = sum(1 for a in output.splitlines()[::2] if "=" in a)
+			metrics.trace(self.name or "bitpar", sent,
+				"parse" if nbest else "noparse", begin, first, nbest,
+				self.countunknown(sent))
+		if not metrics.enabled:
+			# remove bitpar's escaping (why does it do that?), strip trailing blank line
+			results = unescape(output).splitlines()[:-1]
+			probs = [float(a.split("=")[1]) for a in results[::2] if "=" in a]
+			trees = (readsexpr(a, ParseTree) for a in results[1::2])
+			#Popen(("rm %s" % f).split())
+			return izip(probs, trees)
+		# decode all trees now, so that decoding is timed separately
+		with metrics.timer("bitpar.decode"):
+			results = unescape(output).splitlines()[:-1]
+			probs = [float(a.split("=")[1]) for a in results[::2] if "=" in a]
+			trees = zip(probs, (readsexpr(a, ParseTree) for a in results[1::2]))
+		metrics.observe("parse", time() - begin)
+		metrics.incr("sentences")
+		metrics.incr("derivations", len(trees))
+		if not trees: metrics.incr("noparse")
+		return iter(trees)
+
+	def nbest_many(self, sents, n=None, deadline=None):
+		""" the derivations of a few sentences (eg. the words of a sentence,
+		with the morphology model), as lists of (probability, ParseTree)
+		tuples, parsed by the running bitpar process, so that the grammar
+		is not loaded again as with batch_nbest. The sentences are sent in
+		one write, from a thread so that bitpar does not block on its
+		output while they are being sent, and a block of output is read
+		back for each of them. At most n derivations are kept for each
+		sentence (bitpar produces the n given to the constructor). When the
+		deadline (a time) passes, bitpar is killed, and the sentences it did
+		not finish get an empty list. """
+		sents = list(sents)
+		if not sents: return []
+		if self.bitpar.terminated: self.start()
+		def send():
+			# fails when bitpar is killed before it has read everything
+			try: self.bitpar.send("".join("%s\n\n" % "\n".join(sent)
+				for sent in sents))
+			except (OSError, IOError): pass
+		writer = threading.Thread(target=send)
+		writer.start()
+		output, result = "", []
+		with metrics.timer("bitpar.many"):
+			try:
+				while len(result) < len(sents):
+					while "\r\n\r\n" not in output:
+						timeout = 30
+						if deadline is not None:
+							timeout = max(0, min(timeout, deadline - time()))
+						output += self.bitpar.read_nonblocking(size=32767,
+							timeout=timeout)
+					block, output = output.split("\r\n\r\n", 1)
+					result.append(readderivations(block)[:n])
+			except TIMEOUT:
+				metrics.incr("timeout", len(sents) - len(result))
+				self.bitpar.terminate(force=True)
+				writer.join()
+				if deadline is None or time() < deadline: raise
+				result.extend([] for sent in sents[len(result):])
+		writer.join()
+		metrics.incr("sentences", len(sents))
+		metrics.incr("derivations", sum(map(len, result)))
+		metrics.incr("noparse", sum(1 for a in result if not a))
+		return result
+
+	def batch_parse(self, sents, n=1, deadline=None):
 		"""Batch parse a series of sentences. Expects a lists of
 		sentences in the form of lists of words.  Returns a list of lists, each being
 		up to n resulting trees.
 		Caveat: if you haven't supplied an unknown words file, bitpar
 		will stop parsing after the first unknown word; if a sentence cannot
-		be parsed for another reason, bitpar will continue. """
+		be parsed for another reason, bitpar will continue.
+		When tracing (cf. metrics.starttrace), the sentences are parsed one
+		by one with nbest_parse, so that each of them is timed.
+		When a deadline (a time) for the whole batch is given, bitpar is
+		killed when it passes, and the sentences it did not finish get an
+		empty list. """
+		return ([tree.totree(prob) for prob, tree in derivations]
+			for derivations in self.batch_nbest(sents, n, deadline))
+
+	def batch_nbest(self, sents, n=1, deadline=None):
+		""" as batch_parse, but the derivations of each sentence are
+		(probability, ParseTree) tuples (cf. nbest) """
+		sents = list(sents)
+		if deadline is not None and time() >= deadline:
+			metrics.incr("timeout", len(sents))
+			return ([] for sent in sents)
+		if metrics.tracing:
+			def parseall():
+				for sent in sents:
+					try: yield list(self.nbest(sent, deadline=deadline))
+					except DeadlineExceeded: yield []
+			return parseall()
 		f = "/tmp/%s" % uuid1()
 		open(f, "w").writelines("%s\n\n" % "\n".join(sent) for sent in sents)
-		bitpar = Popen((self.cmd + " " + f).split(), stdout=PIPE, stderr=PIPE)
-		output = bitpar.stdout.read()
-		output = re.sub(r"\\([/{}\[\]<>'\$])", r"\1", output).split("\n\n")[:-1]
+		with metrics.timer("bitpar.batch"):
+			bitpar = Popen((self.cmd + " " + f).split(), stdout=PIPE, stderr=PIPE)
+			if deadline is not None:
+				killer = threading.Timer(max(0, deadline - time()), bitpar.kill)
+				killer.start()
+			output = bitpar.stdout.read()
+			if deadline is not None: killer.cancel()
+		output = unescape(output).split("\n\n")[:-1]
 		result = []
 		for a in output:
 			results = a.splitlines()
+			metrics.incr("sentences")
 			if "No parse" in results[0]:
+				metrics.incr("noparse")
 				result.append(( (), () ))
 				continue
 			probs = (float(a.split("=")[1]) for a in results[::2] if "=" in a)
-			trees = (Tree(a) for a in results[1::2])
+			trees = (readsexpr(a, ParseTree) for a in results[1::2])
 			result.append((probs, trees))
+		if len(result) < len(sents):
+			metrics.incr("timeout", len(sents) - len(result))
+			result.extend([((), ())] * (len(sents) - len(result)))
 		Popen(("rm %s" % f).split())
-		return ([ProbabilisticTree(b.node, b, prob=a) for a, b in zip(probs, trees)] for probs, trees in result)
+		return (zip(probs, trees) for probs, trees in result)
 		
+	def countunknown(self, sent):
+		""" the number of words of a sentence which are not in the lexicon
+		(which is read from the lexicon file if it was not given) """
+		if self.lexicon is None:
+			self.lexicon = set(line.split('\t', 1)[0]
+				for line in open(self.lexfile))
+		return sum(1 for a in sent if a not in self.lexicon)
+
 	def writegrammar(self, f, l):
-		""" write a grammar to files f and l in a format that bitpar 
-		understands. f will contain the grammar rules, l the lexicon 
-		with pos tags. """
-		f, l = open(f, 'w'), open(l, 'w')
-		lex = defaultdict(FreqDist)
-		def process():
-			for rule, freq in self.grammar:
-				lhs, rhs = rule.split('\t',1)[0], rule.split('\t')[1:]
-				#if len(rhs) == 1 and not isinstance(rhs[0], Nonterminal):
-				if len(rhs) == 1 and rhs[0] in self.lexicon:
-					#lex[rhs[0]].append(" ".join(map(repr, (lhs, freq))))
-					lex[rhs[0]].inc(lhs, count=freq)
-				# this should NOT happen: (drop it like it's hot)
-				elif len(rhs) == 0 or '' in (str(a).strip() for a in rhs):
-					print 'empty', rule, freq 
-					raise ValueError
-					continue 
-				else:
-					# prob^Wfrequency	lhs	rhs1	rhs2
-					#print "%s\t%s" % (repr(freq), rule)
-					yield u"%s\t%s\n" % (repr(freq), rule)
-					#yield "%s\t%s\t%s\n" % (repr(freq), str(lhs), 
-					#			"\t".join(str(x) for x in rhs))
-		def proc(lex):
-			for word, tags in lex.items():
-				# word	POS1 prob^Wfrequency1	POS2 freq2 ...
-				#print "%s\t%s" % (word, "\t".join(' '.join(map(str, a)) for a in tags.items()))
-				yield u"%s\t%s\n" % (word, "\t".join(' '.join(map(str, a)) for a in tags.items() if a[0].strip()))
+		""" write the grammar of this parser to files f and l (cf.
+		writegrammar()) """
+		writegrammar(self.grammar, self.lexicon, f, l)
+
+def readderivations(output):
+	""" the (probability, ParseTree) tuples in the output of bitpar for a
+	sentence; an empty list for "No parse for: ..."
+
+	>>> readderivations("vitprob=0.5\\r\\n(S (NP mary) (VP walks))\\r\\n")
+	[(0.5, ParseTree('S', (ParseTree('NP', ('mary',)), ParseTree('VP', ('walks',)))))]
+	>>> readderivations('No parse for: "mary walks"')
+	[]
+	"""
+	results = unescape(output).splitlines()
+	probs = [float(a.split("=")[1]) for a in results[::2] if "=" in a]
+	return zip(probs, (readsexpr(a, ParseTree) for a in results[1::2] if a))
+
+def writegrammar(grammar, lexicon, f, l):
+	""" write a grammar to files f and l in a format that bitpar 
+	understands. f will contain the grammar rules, l the lexicon 
+	with pos tags. Returns the number of bytes written.
+
+		@param grammar: a sequence of (rule, frequency) tuples (cf.
+			BitParChartParser)
+		@param lexicon: the set of terminals """
+	f, l = open(f, 'w'), open(l, 'w')
+	lex = defaultdict(FreqDist)
+	def process():
+		n = 0
+		for n, (rule, freq) in enumerate(grammar, 1):
+			lhs, rhs = rule.split('\t',1)[0], rule.split('\t')[1:]
+			#if len(rhs) == 1 and not isinstance(rhs[0], Nonterminal):
+			if len(rhs) == 1 and rhs[0] in lexicon:
+				#lex[rhs[0]].append(" ".join(map(repr, (lhs, freq))))
+				lex[rhs[0]].inc(lhs, count=freq)
+			# this should NOT happen: (drop it like it's hot)
+			elif len(rhs) == 0 or '' in (str(a).strip() for a in rhs):
+				print 'empty', rule, freq 
+				raise ValueError
+				continue 
+			else:
+				# prob^Wfrequency	lhs	rhs1	rhs2
+				#print "%s\t%s" % (repr(freq), rule)
+				yield u"%s\t%s\n" % (repr(freq), rule)
+				#yield "%s\t%s\t%s\n" % (repr(freq), str(lhs), 
+				#			"\t".join(str(x) for x in rhs))
+		# counted here, as grammar may be a generator
+		metrics.incr("writegrammar.rules", n)
+	def proc(lex):
+		for word, tags in lex.items():
+			# word	POS1 prob^Wfrequency1	POS2 freq2 ...
+			#print "%s\t%s" % (word, "\t".join(' '.join(map(str, a)) for a in tags.items()))
+			yield u"%s\t%s\n" % (word, "\t".join(' '.join(map(str, a)) for a in tags.items() if a[0].strip()))
+	with metrics.timer("writegrammar"):
 		f.writelines(process())
 		l.writelines(proc(lex))
-		f.close()
-		l.close()
+	size = f.tell() + l.tell()
+	metrics.incr("writegrammar.bytes", size)
+	f.close()
+	l.close()
+	return size
+
+class TracedJob:
+	def __init__(self, model, cmd, timeout=None, loadtime=None):
+		""" run a bitpar command line, as made by morph.parsejobs(), in a
+		thread, while tracing each sentence (cf. metrics.starttrace()).
+		The last three arguments of the command line are the lexicon, the
+		test file and the file for the results; instead of the latter,
+		bitpar writes to a pseudo terminal, so that its output arrives
+		line by line, and it is copied to the results file with the time
+		each sentence took. bitpar's messages on stderr, which would be
+		mixed with its output on the pseudo terminal, are written to the
+		results file with .stderr appended. Has a wait() method, as Popen.
+
+		@param timeout: the number of seconds bitpar may take for a
+			sentence; when it takes longer, it is killed, "No parse" is
+			written for the sentence (so that morph.getbest() falls
+			back), and bitpar is started again on the remaining
+			sentences. The first sentence after starting bitpar also
+			gets the time to load the grammar.
+		@param loadtime: the number of seconds bitpar may take to load the
+			grammar. By default, the first sentence is not limited, and
+			the time until its output arrives is used for restarts. """
+		self.model, self.cmd, self.timeout = model, cmd, timeout
+		self.loadtime = loadtime
+		self.returncode = None
+		self.thread = threading.Thread(target=self.run)
+		self.thread.start()
+
+	def run(self):
+		lexfile, test, results = self.cmd[-3:]
+		lexicon = set(line.split('\t', 1)[0] for line in open(lexfile))
+		sents = [a.splitlines() for a in open(test).read().split("\n\n")
+			if a.strip()]
+		rest = results + ".rest"
+		out = open(results, "w")
+		done = 0
+		while done < len(sents):
+			if done:
+				# start again with the sentences after the one that timed out
+				open(rest, "w").writelines("%s\n\n" % "\n".join(a)
+					for a in sents[done:])
+				test = rest
+			proc = spawn("/bin/sh", ["-c", "exec %s 2>>%s" % (" ".join(
+				map(quote, self.cmd[:-2] + [test])), quote(results + ".stderr"))],
+				timeout=None)
+			started = time()
+			for n, sent in enumerate(sents[done:]):
+				begin, first, lines = time(), None, []
+				deadline = None
+				if self.timeout is not None:
+					deadline = begin + self.timeout
+					if n == 0:
+						# the first sentence has to wait for the grammar
+						if self.loadtime is None: deadline = None
+						else: deadline += self.loadtime
+				try:
+					while proc.expect(["\r\n", EOF], timeout=None
+							if deadline is None else max(0, deadline - time())) == 0:
+						if first is None: first = time()
+						if not proc.before: break
+						lines.append(proc.before)
+				except TIMEOUT:
+					proc.terminate(force=True)
+					out.write('No parse for: "%s" (timeout)\n\n' % " ".join(sent))
+					metrics.incr("timeout")
+					metrics.trace(self.model, sent, "timeout", begin, first, 0,
+						sum(1 for a in sent if a not in lexicon))
+					done += 1
+					break
+				if n == 0 and self.loadtime is None:
+					self.loadtime = (first or time()) - started
+				out.write("%s\n\n" % "\n".join(lines))
+				out.flush()
+				nbest = sum(1 for a in lines[::2] if "=" in a)
+				metrics.trace(self.model, sent, "parse" if nbest else "noparse",
+					begin, first, nbest, sum(1 for a in sent if a not in lexicon))
+				done += 1
+			else:
+				proc.close()
+				self.returncode = proc.exitstatus
+		out.close()
+		if os.path.exists(rest): os.remove(rest)
+
+	def wait(self):
+		self.thread.join()
+		return self.returncode
 
 if __name__ == '__main__':
 	import doctest
@@ -0,0 +1,938 @@
+#!/usr/bin/python
+""" An in-process CKY parser for the binarized PCFGs of this project (the
+plain treebank PCFG and the Goodman reduction of a DOP model), with
+coarse-to-fine pruning.
+
+With pruning, a sentence is first parsed with a coarse grammar, the plain
+treebank PCFG, which is much smaller than the Goodman reduction (roughly 8
+rules for each rule of the treebank). The inside and outside probabilities
+of the coarse chart give the posterior probability of each labeled span;
+the fine grammar is then only allowed to build a node X or X@n over a span
+if X has a posterior above a threshold for that span in the coarse chart.
+This requires both grammars to use the same labels (apart from the IDs of
+the Goodman reduction) and the same binarization, as is the case for the
+PCFG and the DOP model trained on the .train files written by split.py.
+
+A Grammar can be compiled to a binary file (compilegrammar), which a
+CompiledGrammar reads through mmap without building Python objects for its
+rules, so that worker processes parsing with the same grammar share one
+copy of it in memory (cf. parallelparse). Rules are decoded when they are
+accessed, and kept in a cache of bounded size in each process.
+
+File layout (integers are 32 bits, floats 64 bits, little endian):
+	header: magic, root symbol, number of rules, offsets of the sections
+	sections: the labels and the words, each as the number of strings, the
+	offset of each string, the indices of the strings in sorted order,
+	and the strings; then the lexical rules (indexed by word), unary rules
+	(by child), binary rules (by left child, sorted by right child),
+	unary and binary rules by lhs, and the tags of unknown words, each as
+	the number of keys, the index of the first record of each key, and
+	the records.
+
+usage: python cky.py [-t threshold] [-n maxlen] [prefix]
+	parse the sentences of prefix.gold of at most maxlen words (default 40)
+	with the DOP model of prefix.train (default: arbobanko), exhaustively
+	and with coarse-to-fine pruning, and compare parsing times and scores.
+"""
+from math import log, exp
+from heapq import heapify, heappush, heappop
+from itertools import count
+from struct import Struct
+from mmap import mmap, ACCESS_READ
+from bisect import bisect_left
+from time import time
+from getopt import getopt
+from sys import argv, stdout
+import metrics
+from deadline import DeadlineExceeded, check
+from sexpr import ParseTree
+
+# the maximum length of a chain of unary rules in inside-outside
+MAXUNARY = 4
+MAGIC = "CKY1"
+HEADER = Struct("<4siI8I")
+# the records of the rule tables of a compiled grammar
+RULE = Struct("<idd")			# lhs (or child), logprob, prob
+BINARYRULE = Struct("<iidd")	# right child, lhs, logprob, prob
+BINARYPARENT = Struct("<iid")	# left child, right child, logprob
+
+def base(label):
+	""" the label of a node without the ID of the Goodman reduction """
+	if '@' in label: return label.rsplit('@', 1)[0]
+	return label
+
+class Grammar:
+	def __init__(self, weightedrules, lexicon=None, rootsymbol=None,
+			unknownwords=None):
+		""" a binarized PCFG in the form used by the CKY parser.
+
+		@param weightedrules: a sequence of (rule, frequency) tuples, where
+			a rule is a string with the lhs and rhs separated by tabs, as
+			produced by dopg.frequencies (cf. BitParChartParser).
+		@param lexicon: the set of terminals; by default a symbol is a
+			terminal if it does not occur as the lhs of a rule.
+		@param rootsymbol: the start symbol, by default the lhs of the
+			first rule.
+		@param unknownwords: a file with open class POS tags and
+			frequencies, as for bitpar's -u option. Unknown words get these
+			tags, as if they were a single word with these frequencies.
+
+		>>> g = Grammar([("S\\tNP\\tVP", 1), ("NP\\tmary", 1),
+		... ("VP\\twalks", 2), ("VP\\tV", 2), ("V\\twalks", 1)])
+		>>> g.binary[g.index['NP']]
+		{2: [(0, 0.0, 1.0)]}
+		>>> g.labels[:3]
+		['S', 'NP', 'VP']
+		>>> g.unary[g.index['V']]
+		[(2, -0.693..., 0.5)]
+		"""
+		rules = []
+		total = {}
+		for rule, freq in weightedrules:
+			rule = rule.split('\t')
+			if len(rule) > 3 or len(rule) < 2:
+				raise ValueError("not a binarized rule: %r" % "\t".join(rule))
+			rules.append((rule, freq))
+			total[rule[0]] = total.get(rule[0], 0.0) + freq
+		unknown = []
+		if unknownwords:
+			for line in open(unknownwords):
+				if not line.strip(): continue
+				tag, freq = line.split()
+				if tag in total:
+					unknown.append((tag, float(freq)))
+					total[tag] += float(freq)
+		if lexicon is None:
+			lexicon = set(rule[1] for rule, _ in rules
+				if len(rule) == 2 and rule[1] not in total)
+		self.lexicon = lexicon
+		self.labels = []
+		self.index = {}
+		for rule, _ in rules:
+			for a in rule if len(rule) == 3 or rule[1] not in lexicon else rule[:1]:
+				if a not in self.index:
+					self.index[a] = len(self.labels)
+					self.labels.append(a)
+		self.base = map(base, self.labels)
+		if rootsymbol is None: rootsymbol = rules[0][0][0]
+		self.root = self.index.get(rootsymbol, -1)
+		# the rules, as (lhs, log probability, probability) tuples, indexed
+		# by the child; binary rules by the left and then the right child,
+		# lexical rules by word.
+		self.lexical, self.unary, self.binary = {}, {}, {}
+		# and indexed by lhs, for k-best extraction and outside probabilities
+		self.unaryparents, self.binaryparents = {}, {}
+		for rule, freq in rules:
+			prob = freq / total[rule[0]]
+			if prob <= 0.0: continue
+			lhs, logprob = self.index[rule[0]], log(prob)
+			if len(rule) == 3:
+				l, r = self.index[rule[1]], self.index[rule[2]]
+				self.binary.setdefault(l, {}).setdefault(r, []).append(
+					(lhs, logprob, prob))
+				self.binaryparents.setdefault(lhs, []).append((l, r, logprob))
+			elif rule[1] in lexicon:
+				self.lexical.setdefault(rule[1], []).append(
+					(lhs, logprob, prob))
+			else:
+				child = self.index[rule[1]]
+				self.unary.setdefault(child, []).append((lhs, logprob, prob))
+				self.unaryparents.setdefault(lhs, []).append(
+					(child, logprob, prob))
+		self.unknown = [(self.index[tag], log(freq / total[tag]),
+			freq / total[tag]) for tag, freq in unknown if freq > 0]
+	def __len__(self):
+		return (sum(map(len, self.lexical.values()))
+			+ sum(map(len, self.unary.values()))
+			+ sum(len(a) for b in self.binary.values() for a in b.values()))
+	def tags(self, word):
+		""" the lexical rules for a word, as (tag, log probability,
+		probability) tuples. """
+		return self.lexical.get(word, self.unknown)
+
+def compilegrammar(grammar, filename):
+	""" write a Grammar to a file in the binary format read by
+	CompiledGrammar. """
+	def strings(seq):
+		seq = [a.encode('utf-8') if isinstance(a, unicode) else a for a in seq]
+		offsets = [0]
+		for a in seq: offsets.append(offsets[-1] + len(a))
+		order = sorted(range(len(seq)), key=seq.__getitem__)
+		return "".join((Struct("<I").pack(len(seq)),
+			Struct("<%dI" % len(offsets)).pack(*offsets),
+			Struct("<%dI" % len(order)).pack(*order), "".join(seq)))
+	def table(keys, get, record):
+		offsets, records = [0], []
+		for key in keys:
+			rules = get(key)
+			records.extend(record.pack(*a) for a in rules)
+			offsets.append(len(records))
+		return "".join((Struct("<I").pack(len(keys)),
+			Struct("<%dI" % len(offsets)).pack(*offsets), "".join(records)))
+	nlabels = len(grammar.labels)
+	words = sorted(grammar.lexical)
+	binary = lambda l: [(r, ) + a for r, rules
+		in sorted(grammar.binary.get(l, {}).items()) for a in rules]
+	sections = [strings(grammar.labels), strings(words),
+		table(words, grammar.lexical.get, RULE),
+		table(range(nlabels), lambda a: grammar.unary.get(a, ()), RULE),
+		table(range(nlabels), binary, BINARYRULE),
+		table(range(nlabels), lambda a: grammar.unaryparents.get(a, ()), RULE),
+		table(range(nlabels), lambda a: grammar.binaryparents.get(a, ()),
+			BINARYPARENT),
+		table([0], lambda a: grammar.unknown, RULE)]
+	offsets = [HEADER.size]
+	for a in sections[:-1]: offsets.append(offsets[-1] + len(a))
+	out = open(filename, "wb")
+	out.write(HEADER.pack(MAGIC, grammar.root, len(grammar), *offsets))
+	for a in sections: out.write(a)
+	out.close()
+
+class Strings:
+	def __init__(self, map, offset):
+		""" a read-only list of strings in a memory map, with lookup of
+		the index of a string by binary search (cf. compilegrammar). """
+		self.map = map
+		self.n, = Struct("<I").unpack_from(map, offset)
+		self.offsets = offset + 4
+		self.order = self.offsets + 4 * (self.n + 1)
+		self.data = self.order + 4 * self.n
+	def __len__(self):
+		return self.n
+	def __getitem__(self, n):
+		if isinstance(n, slice):
+			return [self[a] for a in xrange(*n.indices(self.n))]
+		if n < 0: n += self.n
+		if not 0 <= n < self.n: raise IndexError(n)
+		start, end = Struct("<II").unpack_from(self.map, self.offsets + 4 * n)
+		return self.map[self.data + start:self.data + end]
+	def __iter__(self):
+		for n in xrange(self.n): yield self[n]
+	def find(self, a):
+		""" the index of string a, or -1 """
+		if isinstance(a, unicode): a = a.encode('utf-8')
+		low, high = 0, self.n
+		while low < high:
+			mid = (low + high) // 2
+			if self[self.sorted(mid)] < a: low = mid + 1
+			else: high = mid
+		if low < self.n and self[self.sorted(low)] == a: return self.sorted(low)
+		return -1
+	def sorted(self, n):
+		""" the index of the nth string in sorted order """
+		return Struct("<I").unpack_from(self.map, self.order + 4 * n)[0]
+
+class Index:
+	def __init__(self, strings):
+		""" a read-only dictionary mapping strings to their indices """
+		self.strings = strings
+	def __len__(self):
+		return len(self.strings)
+	def __contains__(self, a):
+		return self.strings.find(a) != -1
+	def __getitem__(self, a):
+		n = self.strings.find(a)
+		if n == -1: raise KeyError(a)
+		return n
+	def get(self, a, default=None):
+		n = self.strings.find(a)
+		if n == -1: return default
+		return n
+
+class Labels:
+	def __init__(self, labels, function):
+		""" a read-only list with a function applied to each label """
+		self.labels, self.function = labels, function
+	def __len__(self):
+		return len(self.labels)
+	def __getitem__(self, n):
+		if isinstance(n, slice): return map(self.function, self.labels[n])
+		return self.function(self.labels[n])
+
+class Table:
+	def __init__(self, map, offset, record, key=None, group=None,
+			cachesize=1 << 14):
+		""" a read-only dictionary mapping keys to lists of records in a
+		memory map, which are decoded when they are accessed (cf.
+		compilegrammar). Decoded entries are cached; the cache is emptied
+		when it has more than cachesize entries.
+
+		@param key: a function mapping a key to its index, or -1.
+		@param group: a function converting a list of records to the
+			value of a key. """
+		self.map, self.record = map, record
+		self.key, self.group = key, group
+		self.nkeys, = Struct("<I").unpack_from(map, offset)
+		self.offsets = offset + 4
+		self.data = self.offsets + 4 * (self.nkeys + 1)
+		self.cache, self.cachesize = {}, cachesize
+	def get(self, key, default=None):
+		if key in self.cache: return self.cache[key]
+		n = key if self.key is None else self.key(key)
+		if not 0 <= n < self.nkeys: return default
+		start, end = Struct("<II").unpack_from(self.map, self.offsets + 4 * n)
+		if start == end: return default
+		size = self.record.size
+		result = [self.record.unpack_from(self.map, self.data + size * a)
+			for a in xrange(start, end)]
+		if self.group is not None: result = self.group(result)
+		if len(self.cache) >= self.cachesize: self.cache.clear()
+		self.cache[key] = result
+		return result
+	def __getitem__(self, key):
+		result = self.get(key)
+		if result is None: raise KeyError(key)
+		return result
+	def __contains__(self, key):
+		return self.get(key) is not None
+
+def groupright(records):
+	""" the binary rules of a left child as a dictionary mapping right
+	children to lists of (lhs, logprob, prob) tuples """
+	result = {}
+	for r, lhs, logprob, prob in records:
+		result.setdefault(r, []).append((lhs, logprob, prob))
+	return result
+
+class CompiledGrammar:
+	def __init__(self, filename, cachesize=1 << 14):
+		""" a Grammar written by compilegrammar(), read through mmap. It has
+		the same interface as a Grammar, except that the rule tables only
+		support lookup, and there is no lexicon.
+
+		>>> g = Grammar([("S\\tNP\\tVP", 1), ("NP\\tmary", 1),
+		... ("VP\\twalks", 2), ("VP\\tV", 2), ("V\\twalks", 1)])
+		>>> import os, tempfile
+		>>> filename = tempfile.mktemp()
+		>>> compilegrammar(g, filename)
+		>>> c = CompiledGrammar(filename)
+		>>> c.binary[c.index['NP']], c.labels[:3], c.unary[c.index['V']]
+		({2: [(0, 0.0, 1.0)]}, ['S', 'NP', 'VP'], [(2, -0.693..., 0.5)])
+		>>> len(c), c.tags('walks') == g.tags('walks')
+		(5, True)
+		>>> c.close(); os.remove(filename)
+		"""
+		self.filename = filename
+		self.file = open(filename, "rb")
+		self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+		header = HEADER.unpack_from(self.map, 0)
+		if header[0] != MAGIC:
+			raise ValueError("%s: not a compiled grammar" % filename)
+		self.root, self.nrules = header[1:3]
+		offsets = header[3:]
+		self.labels = Strings(self.map, offsets[0])
+		self.words = Strings(self.map, offsets[1])
+		self.index = Index(self.labels)
+		self.base = Labels(self.labels, base)
+		self.lexical = Table(self.map, offsets[2], RULE, self.words.find,
+			cachesize=cachesize)
+		self.unary = Table(self.map, offsets[3], RULE, cachesize=cachesize)
+		self.binary = Table(self.map, offsets[4], BINARYRULE,
+			group=groupright, cachesize=cachesize)
+		self.unaryparents = Table(self.map, offsets[5], RULE,
+			cachesize=cachesize)
+		self.binaryparents = Table(self.map, offsets[6], BINARYPARENT,
+			cachesize=cachesize)
+		self.unknown = Table(self.map, offsets[7], RULE).get(0, [])
+	def __len__(self):
+		return self.nrules
+	def tags(self, word):
+		""" the lexical rules for a word, as (tag, log probability,
+		probability) tuples. """
+		return self.lexical.get(word, self.unknown)
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+def viterbi(sent, grammar, allowed=None, deadline=None):
+	""" CKY parsing with the Viterbi criterion. Returns the chart, a
+	dictionary with a dictionary for each span (i, j) mapping symbols to
+	their best log probability and a backpointer: None for a tag, (child, )
+	for a unary rule, (split, left, right) for a binary rule.
+
+	@param allowed: if given, a dictionary mapping spans to the set of
+		labels that may be built over them, disregarding IDs (cf. prune).
+	@param deadline: raise DeadlineExceeded when this time has passed
+		(checked for each span length, cf. deadline.py)
+	"""
+	n = len(sent)
+	chart = {}
+	for i, word in enumerate(sent):
+		cell = chart[i, i + 1] = {}
+		labels = allowed.get((i, i + 1), ()) if allowed is not None else None
+		for tag, logprob, _ in grammar.tags(word):
+			if labels is None or grammar.base[tag] in labels:
+				cell[tag] = (logprob, None)
+		unaryviterbi(cell, grammar, labels)
+	for length in range(2, n + 1):
+		check(deadline)
+		for i in range(n - length + 1):
+			j = i + length
+			cell = chart[i, j] = {}
+			if allowed is not None:
+				labels = allowed.get((i, j))
+				if not labels: continue
+			else: labels = None
+			for k in range(i + 1, j):
+				left, right = chart[i, k], chart[k, j]
+				if not left or not right: continue
+				for l, (lp, _) in left.iteritems():
+					for r, rules in matching(grammar.binary.get(l), right):
+						lp1 = lp + right[r][0]
+						for lhs, logprob, _ in rules:
+							if labels is not None and grammar.base[lhs] not in labels:
+								continue
+							x = lp1 + logprob
+							if lhs not in cell or x > cell[lhs][0]:
+								cell[lhs] = (x, (k, l, r))
+			unaryviterbi(cell, grammar, labels)
+	return chart
+
+def matching(rules, right):
+	""" the (right child, rules) pairs of the binary rules for a left child
+	whose right child is in a cell; iterates over the smaller of the two. """
+	if not rules: return ()
+	if len(right) < len(rules):
+		return [(r, rules[r]) for r in right if r in rules]
+	return [(r, a) for r, a in rules.iteritems() if r in right]
+
+def unaryviterbi(cell, grammar, labels=None):
+	""" apply chains of up to MAXUNARY unary rules to the symbols of a
+	cell, keeping the best log probability of each symbol. """
+	agenda = list(cell)
+	for _ in range(MAXUNARY):
+		new = {}
+		for child in agenda:
+			lp = cell[child][0]
+			for lhs, logprob, _ in grammar.unary.get(child, ()):
+				if labels is not None and grammar.base[lhs] not in labels:
+					continue
+				x = lp + logprob
+				if ((lhs not in cell or x > cell[lhs][0])
+						and (lhs not in new or x > new[lhs][0])):
+					new[lhs] = (x, (child, ))
+		if not new: break
+		cell.update(new)
+		agenda = list(new)
+
+def besttree(chart, sent, grammar, node, i=0, j=None, symbol=None):
+	""" the tree with the best derivation of symbol over the span (i, j) in
+	a Viterbi chart; by default the root over the whole sentence.
+
+	@param node: a function constructing a node from a label and a list of
+		children, eg. nltk.Tree. """
+	if j is None: j = len(sent)
+	if symbol is None: symbol = grammar.root
+	_, backpointer = chart[i, j][symbol]
+	label = grammar.labels[symbol]
+	if backpointer is None: return node(label, [sent[i]])
+	if len(backpointer) == 1:
+		return node(label, [besttree(chart, sent, grammar, node, i, j,
+			backpointer[0])])
+	k, l, r = backpointer
+	return node(label, [besttree(chart, sent, grammar, node, i, k, l),
+		besttree(chart, sent, grammar, node, k, j, r)])
+
+def inside(sent, grammar):
+	""" the inside probabilities of all spans, as a dictionary with a
+	dictionary mapping symbols to probabilities for each span (i, j), and a
+	dictionary with the scale of each span. To avoid underflow on long
+	sentences, the probabilities of each cell are divided by the largest
+	one, and the log of the factor is kept as the scale of the span: the
+	inside probability of a symbol over a span is
+	chart[span][symbol] * exp(scale[span]). Raises ValueError for a word
+	without tags.
+
+	The inside probability of this sentence is about 1e-340, below the
+	smallest float:
+	>>> g = Grammar([("S\\tS\\tS", 1), ("S\\ta", 9999)])
+	>>> chart, scale = inside(["a"] * 100, g)
+	>>> chart[0, 100], scale[0, 100]
+	({0: 1.0}, -782.066...)
+	"""
+	n = len(sent)
+	chart, scale = {}, {}
+	for i, word in enumerate(sent):
+		tags = grammar.tags(word)
+		if not tags: raise ValueError("unknown word: %s" % word)
+		cell = chart[i, i + 1] = {}
+		for tag, _, prob in tags:
+			cell[tag] = cell.get(tag, 0.0) + prob
+		unaryinside(cell, grammar)
+		scale[i, i + 1] = rescale(cell)
+	for length in range(2, n + 1):
+		for i in range(n - length + 1):
+			j = i + length
+			cell = chart[i, j] = {}
+			splits = [k for k in range(i + 1, j) if chart[i, k] and chart[k, j]]
+			if not splits:
+				scale[i, j] = 0.0
+				continue
+			# the products of the splits are brought to a common scale
+			common = max(scale[i, k] + scale[k, j] for k in splits)
+			for k in splits:
+				left, right = chart[i, k], chart[k, j]
+				factor = exp(scale[i, k] + scale[k, j] - common)
+				for l, lp in left.iteritems():
+					for r, rules in matching(grammar.binary.get(l), right):
+						lp1 = lp * right[r] * factor
+						for lhs, _, prob in rules:
+							cell[lhs] = cell.get(lhs, 0.0) + lp1 * prob
+			unaryinside(cell, grammar)
+			scale[i, j] = common + rescale(cell)
+	return chart, scale
+
+def rescale(cell):
+	""" divide the probabilities of a cell by the largest one; returns the
+	log of that factor, or 0.0 for an empty cell. """
+	m = max(cell.itervalues()) if cell else 0.0
+	if not m: return 0.0
+	for a in cell: cell[a] /= m
+	return log(m)
+
+def unaryinside(cell, grammar):
+	""" add the inside probabilities of unary chains of up to MAXUNARY
+	rules to a cell """
+	delta = cell
+	for _ in range(MAXUNARY):
+		new = {}
+		for child, p in delta.iteritems():
+			for lhs, _, prob in grammar.unary.get(child, ()):
+				new[lhs] = new.get(lhs, 0.0) + p * prob
+		if not new: break
+		for a, p in new.iteritems(): cell[a] = cell.get(a, 0.0) + p
+		delta = new
+
+def outside(sent, grammar, insidechart, insidescale):
+	""" the outside probabilities of all spans given an inside chart and
+	its scales, in the same format as inside(). The outside probabilities
+	of a span are collected from the spans of which it is a child, which
+	are complete at that point, so that each cell can be rescaled. """
+	n = len(sent)
+	chart = dict((a, {}) for a in insidechart)
+	scale = dict.fromkeys(insidechart, 0.0)
+	if grammar.root not in insidechart[0, n]: return chart, scale
+	chart[0, n][grammar.root] = 1.0
+	for length in range(n, 0, -1):
+		for i in range(n - length + 1):
+			j = i + length
+			cell, insidecell = chart[i, j], insidechart[i, j]
+			if not insidecell: continue
+			# (parent, sibling, whether this span is the left child)
+			parents = [((i, k), (j, k), True) for k in range(j + 1, n + 1)]
+			parents.extend(((h, j), (h, i), False) for h in range(i))
+			parents = [(p, s, isleft) for p, s, isleft in parents
+				if chart[p] and insidechart[s]]
+			if parents:
+				common = max(scale[p] + insidescale[s] for p, s, _ in parents)
+				for p, s, isleft in parents:
+					factor = exp(scale[p] + insidescale[s] - common)
+					parent, sibling = chart[p], insidechart[s]
+					left, right = ((insidecell, sibling) if isleft
+						else (sibling, insidecell))
+					for l, lp in left.iteritems():
+						for r, rules in matching(grammar.binary.get(l), right):
+							x = sum(parent[lhs] * prob for lhs, _, prob in rules
+								if lhs in parent)
+							if not x: continue
+							if isleft:
+								cell[l] = cell.get(l, 0.0) + x * right[r] * factor
+							else:
+								cell[r] = cell.get(r, 0.0) + x * lp * factor
+				scale[i, j] = common
+			if not cell: continue
+			unaryoutside(cell, insidecell, grammar)
+			scale[i, j] += rescale(cell)
+	return chart, scale
+
+def unaryoutside(cell, insidecell, grammar):
+	""" the outside counterpart of unaryinside """
+	delta = dict(cell)
+	for _ in range(MAXUNARY):
+		new = {}
+		for lhs, p in delta.iteritems():
+			for child, _, prob in grammar.unaryparents.get(lhs, ()):
+				if child in insidecell:
+					new[child] = new.get(child, 0.0) + p * prob
+		if not new: break
+		for a, p in new.iteritems(): cell[a] = cell.get(a, 0.0) + p
+		delta = new
+
+def posteriors(sent, grammar):
+	""" the posterior probability of each labeled span of a sentence,
+	as a dictionary mapping spans to dictionaries of labels and
+	probabilities. Raises ValueError when the sentence has no parse.
+
+	>>> g = Grammar([("S\\tNP\\tVP", 1), ("NP\\tmary", 1),
+	... ("VP\\twalks", 2), ("VP\\tV", 2), ("V\\twalks", 1), ("NP\\twalks", 1)])
+	>>> p = posteriors("mary walks".split(), g)
+	>>> sorted(p[1, 2].items())
+	[('V', 0.5), ('VP', 1.0)]
+	>>> g = Grammar([("S\\tS\\tS", 1), ("S\\ta", 9999)])
+	>>> p = posteriors(["a"] * 100, g)
+	>>> p[0, 100], p[0, 99]
+	({'S': 1.0}, {'S': 0.2538...})
+	"""
+	insidechart, insidescale = inside(sent, grammar)
+	total = insidechart[0, len(sent)].get(grammar.root)
+	if not total: raise ValueError("no parse")
+	outsidechart, outsidescale = outside(sent, grammar, insidechart,
+		insidescale)
+	logtotal = log(total) + insidescale[0, len(sent)]
+	result = {}
+	for span, cell in outsidechart.iteritems():
+		insidecell = insidechart[span]
+		factor = outsidescale[span] + insidescale[span] - logtotal
+		result[span] = dict((grammar.labels[a],
+			exp(log(p * insidecell[a]) + factor))
+			for a, p in cell.iteritems()
+			if a in insidecell and p * insidecell[a] > 0.0)
+	return result
+
+def prune(sent, coarse, threshold=1e-5):
+	""" the labels allowed over each span of a sentence: those with a
+	posterior probability of at least threshold in the coarse grammar.
+	Returns a dictionary mapping spans to sets of labels. """
+	return dict((span, set(a for a, p in cell.iteritems() if p >= threshold))
+		for span, cell in posteriors(sent, coarse).iteritems())
+
+class KBest:
+	def __init__(self, chart, sent, grammar):
+		""" lazy k-best extraction from a Viterbi chart (Huang & Chiang
+		2005, algorithm 3). Derivations are only computed when they are
+		asked for: the k-th best derivation of an item requires at most the
+		k-th best derivations of its children. Iterating yields the
+		derivations of the root as (log probability, tree) tuples, best
+		first, with the trees as ParseTrees (cf. sexpr.py).
+
+		The items are (i, j, symbol, m), for the derivations of symbol over
+		the span (i, j) that start with a chain of at most m unary rules.
+		This makes the unary rules of a cell acyclic; as in viterbi(),
+		chains are limited to MAXUNARY rules.
+
+		>>> g = Grammar([("S\\tNP\\tVP", 1), ("NP\\tmary", 2), ("NP\\tN", 1),
+		... ("N\\tmary", 1), ("VP\\twalks", 1)])
+		>>> sent = "mary walks".split()
+		>>> for a, b in KBest(viterbi(sent, g), sent, g): print round(exp(a), 6), b
+		0.666667 (S (NP mary) (VP walks))
+		0.333333 (S (NP (N mary)) (VP walks))
+		"""
+		self.chart, self.sent, self.grammar = chart, sent, grammar
+		# for each item: the incoming edges as (log probability, children,
+		# unary) tuples, the derivations found so far as (log probability,
+		# edge, ranks of the children) tuples, a heap with candidates and
+		# the set of candidates seen.
+		self.edges, self.derivations, self.candidates = {}, {}, {}
+		self.seen = {}
+
+	def getedges(self, item):
+		i, j, symbol, m = item
+		cell = self.chart[i, j]
+		if m:
+			# the derivations without a unary rule at the top, and those
+			# with a unary rule followed by a shorter chain.
+			return [(0.0, ((i, j, symbol, 0), ), False)] + [(logprob,
+				((i, j, child, m - 1), ), True) for child, logprob, _
+				in self.grammar.unaryparents.get(symbol, ()) if child in cell]
+		edges = []
+		if j == i + 1:
+			edges.extend((logprob, (), True) for tag, logprob, _
+				in self.grammar.tags(self.sent[i]) if tag == symbol)
+		for l, r, logprob in self.grammar.binaryparents.get(symbol, ()):
+			for k in range(i + 1, j):
+				if l in self.chart[i, k] and r in self.chart[k, j]:
+					edges.append((logprob, ((i, k, l, MAXUNARY),
+						(k, j, r, MAXUNARY)), True))
+		return edges
+
+	def score(self, edge, ranks):
+		""" the log probability of a derivation given an edge and the ranks
+		of the derivations of the children; None if one of them does not
+		exist. """
+		logprob = edge[0]
+		for child, rank in zip(edge[1], ranks):
+			if rank == 0 and child[3] == MAXUNARY:
+				# the best derivation of a symbol over a span is in the chart
+				logprob += self.chart[child[:2]][child[2]][0]
+				continue
+			derivation = self.kthbest(child, rank)
+			if derivation is None: return None
+			logprob += derivation[0]
+		return logprob
+
+	def kthbest(self, item, k):
+		""" the k-th best derivation (counting from 0) of an item, or None
+		if it has fewer derivations. """
+		if item not in self.edges:
+			edges = self.edges[item] = self.getedges(item)
+			self.derivations[item] = []
+			self.seen[item] = set()
+			self.candidates[item] = []
+			for n, edge in enumerate(edges):
+				ranks = (0, ) * len(edge[1])
+				self.seen[item].add((n, ranks))
+				logprob = self.score(edge, ranks)
+				if logprob is not None:
+					self.candidates[item].append((-logprob, n, ranks))
+			heapify(self.candidates[item])
+		derivations = self.derivations[item]
+		candidates = self.candidates[item]
+		while len(derivations) <= k:
+			if derivations: self.successors(item, *derivations[-1])
+			if not candidates: return None
+			score, n, ranks = heappop(candidates)
+			derivations.append((-score, n, ranks))
+		return derivations[k]
+
+	def successors(self, item, score, n, ranks):
+		""" push the neighbours of a derivation onto the heap, ie., the
+		derivations with the same edge and the next derivation of one of
+		the children. """
+		edge = self.edges[item][n]
+		for m in range(len(ranks)):
+			new = ranks[:m] + (ranks[m] + 1, ) + ranks[m + 1:]
+			if (n, new) in self.seen[item]: continue
+			self.seen[item].add((n, new))
+			logprob = self.score(edge, new)
+			if logprob is not None:
+				heappush(self.candidates[item], (-logprob, n, new))
+
+	def tree(self, item, k, node):
+		""" the tree of the k-th best derivation of an item """
+		i, j, symbol, m = item
+		_, n, ranks = self.kthbest(item, k)
+		_, children, rule = self.edges[item][n]
+		if not rule: return self.tree(children[0], ranks[0], node)
+		if not children:
+			return node(self.grammar.labels[symbol], [self.sent[i]])
+		return node(self.grammar.labels[symbol], [self.tree(a, b, node)
+			for a, b in zip(children, ranks)])
+
+	def __iter__(self):
+		root = (0, len(self.sent), self.grammar.root, MAXUNARY)
+		if not self.sent or self.grammar.root not in self.chart[root[:2]]:
+			return
+		for k in count():
+			derivation = self.kthbest(root, k)
+			if derivation is None: return
+			yield derivation[0], self.tree(root, k, ParseTree)
+
+class CKYParser:
+	def __init__(self, weightedrules, lexicon=None, rootsymbol=None,
+			unknownwords=None, coarse=None, threshold=1e-5, name="cky"):
+		""" A CKY parser for a binarized PCFG, optionally with coarse-to-fine
+		pruning. Accepts the same grammar format as BitParChartParser, or
+		a Grammar or CompiledGrammar as weightedrules.
+
+		@param coarse: a (compiled) Grammar with the same labels as this
+			one without
+			the IDs of the Goodman reduction, eg. the treebank PCFG. When
+			given, a sentence is parsed with the coarse grammar first, and
+			only the spans and labels with a posterior probability of at
+			least threshold are considered with this grammar. When the
+			pruned chart contains no parse, the sentence is parsed again
+			without pruning.
+		@param name: the name of the model in traces (cf.
+			metrics.starttrace)
+
+		>>> rules = [("S\\tNP\\tVP", 1), ("NP\\tmary", 1), ("VP\\twalks", 1)]
+		>>> p = CKYParser(rules, set(["mary", "walks"]), "S")
+		>>> print p.parse("mary walks".split())
+		(S (NP mary) (VP walks)) (p=1.0)
+		"""
+		self.rootsymbol, self.unknownwords = rootsymbol, unknownwords
+		if isinstance(weightedrules, (Grammar, CompiledGrammar)):
+			self.grammar = weightedrules
+		else:
+			self.grammar = Grammar(weightedrules, lexicon, rootsymbol,
+				unknownwords)
+		self.coarse = coarse
+		self.threshold = threshold
+		self.name = name
+		# the k-best derivations of the last sentence
+		self.last = None, None
+
+	def reload(self, weightedrules, lexicon=None):
+		""" replace the grammar (cf. GoodmanDOP.add_trees) """
+		self.grammar = Grammar(weightedrules, lexicon, self.rootsymbol,
+			self.unknownwords)
+		self.last = None, None
+
+	def chart(self, sent, deadline=None):
+		""" the Viterbi chart of a sentence, pruned if a coarse grammar
+		was given. """
+		allowed = None
+		if self.coarse is not None:
+			try: allowed = prune(sent, self.coarse, self.threshold)
+			except ValueError: pass
+			check(deadline)
+		chart = viterbi(sent, self.grammar, allowed, deadline)
+		if allowed is not None and self.grammar.root not in chart[0, len(sent)]:
+			chart = viterbi(sent, self.grammar, deadline=deadline)
+		return chart
+
+	def parse(self, sent, deadline=None):
+		""" the most probable derivation of a sentence, as a
+		ProbabilisticTree. Raises ValueError when there is no parse, and
+		DeadlineExceeded when the deadline (a time) passes first. """
+		from nltk import Tree, ProbabilisticTree
+		begin = time()
+		metrics.incr("sentences")
+		with metrics.timer("parse"):
+			try: chart = self.chart(sent, deadline)
+			except DeadlineExceeded:
+				metrics.incr("timeout")
+				if metrics.tracing:
+					metrics.trace(self.name, sent, "timeout", begin,
+						unknown=self.countunknown(sent))
+				raise
+			if not sent or self.grammar.root not in chart[0, len(sent)]:
+				metrics.incr("noparse")
+				if metrics.tracing:
+					metrics.trace(self.name, sent, "noparse", begin,
+						unknown=self.countunknown(sent))
+				raise ValueError("no parse")
+			tree = besttree(chart, sent, self.grammar, Tree)
+		if metrics.tracing:
+			metrics.trace(self.name, sent, "parse", begin, time(), 1,
+				self.countunknown(sent))
+		return ProbabilisticTree(tree.node, tree,
+			prob=exp(chart[0, len(sent)][self.grammar.root][0]))
+
+	def nbest_parse(self, sent, n=None, deadline=None):
+		""" yields the n most probable derivations of a sentence (all of
+		them if n is None) as ProbabilisticTrees, best first. Derivations
+		are extracted lazily, and are kept for the last sentence, so that
+		asking for more derivations of the same sentence later continues
+		where the previous call stopped. Raises DeadlineExceeded when the
+		deadline passes before the next derivation. """
+		return (tree.totree(prob) for prob, tree in self.nbest(sent, n,
+			deadline))
+
+	def nbest(self, sent, n=None, deadline=None):
+		""" as nbest_parse, but yields (probability, ParseTree) tuples """
+		begin, first, nbest, outcome = time(), None, 0, None
+		# the trace is recorded when the caller stops asking for derivations
+		try:
+			if self.last[0] != list(sent):
+				metrics.incr("sentences")
+				with metrics.timer("parse"):
+					chart = self.chart(sent, deadline)
+				if not sent or self.grammar.root not in chart[0, len(sent)]:
+					metrics.incr("noparse")
+				self.last = list(sent), KBest(chart, sent, self.grammar)
+			for m, (logprob, tree) in enumerate(self.last[1]):
+				if n is not None and m >= n: break
+				check(deadline)
+				if first is None: first = time()
+				nbest += 1
+				yield exp(logprob), tree
+		except DeadlineExceeded:
+			metrics.incr("timeout")
+			outcome = "timeout"
+			raise
+		finally:
+			if metrics.tracing:
+				metrics.trace(self.name, sent, outcome or ("parse" if nbest
+					else "noparse"), begin, first, nbest, self.countunknown(sent))
+
+	def countunknown(self, sent):
+		""" the number of words of a sentence without lexical rules """
+		return sum(1 for a in sent if self.grammar.lexical.get(a) is None)
+
+	def batch_parse(self, sents, n=1, deadline=None):
+		""" parse a sequence of sentences; returns a list of lists with the
+		derivations of each sentence (cf. BitParChartParser). Sentences
+		which are not parsed before the deadline for the whole batch get
+		an empty list. """
+		return [[tree.totree(prob) for prob, tree in derivations]
+			for derivations in self.batch_nbest(sents, n, deadline)]
+
+	def batch_nbest(self, sents, n=1, deadline=None):
+		""" as batch_parse, but yields (probability, ParseTree) tuples """
+		result = []
+		for sent in sents:
+			try: result.append(list(self.nbest(sent, n, deadline)))
+			except DeadlineExceeded: result.append([])
+		return result
+
+# the parser of a worker process of parallelparse()
+worker = None
+
+def attach(filename, options):
+	""" initialize a worker process: read the compiled grammar """
+	global worker
+	worker = CKYParser(CompiledGrammar(filename), **options)
+
+def parseone(sent):
+	""" parse a sentence in a worker process; None if there is no parse """
+	try: return worker.parse(sent)
+	except ValueError: return None
+
+def parallelparse(filename, sents, workers=None, **options):
+	""" parse sentences with a compiled grammar (cf. compilegrammar) in
+	worker processes, which share the grammar through mmap, so that each
+	additional worker takes little memory and starts immediately. Returns
+	a list with the most probable derivation of each sentence, or None.
+
+	@param options: passed to CKYParser, eg. coarse and threshold. """
+	from multiprocessing import Pool
+	pool = Pool(workers, attach, (filename, options))
+	try: return pool.map(parseone, sents, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+def main():
+	from nltk import Tree
+	from dopg import GoodmanDOP, removeids
+	from morph import readtrain, pcfgrules
+	from sexpr import readsexpr
+	from transform import transform
+	from evalb import evalb, readparam, scoresummary
+	opts, args = getopt(argv[1:], "t:n:")
+	opts = dict(opts)
+	if len(args) > 1:
+		print __doc__
+		return
+	prefix = args[0] if args else "arbobanko"
+	threshold, maxlen = float(opts.get('-t', 1e-5)), int(opts.get('-n', 40))
+	train = readtrain(prefix)
+	gold = [transform(readsexpr(a.lower(), Tree), stripfunc=True,
+		forcepos=True, inplace=True) for a in open(prefix + ".gold")]
+	gold = [a for a in gold if len(a.leaves()) <= maxlen]
+	rules, lexicon = pcfgrules(train)
+	coarse = Grammar(rules, lexicon, "top", "unknownwordsm")
+	d = GoodmanDOP(train, rootsymbol="top", parser=CKYParser,
+		unknownwords="unknownwordsm")
+	print "coarse grammar: %d rules, fine grammar: %d rules" % (len(coarse),
+		len(d.parser.grammar))
+	goldtrees = [a._pprint_flat('', '()', '') for a in gold]
+	results = []
+	for name, ctf in (("exhaustive", None), ("coarse-to-fine", coarse)):
+		d.parser.coarse = ctf
+		parses, begin = [], time()
+		for n, tree in enumerate(gold):
+			try: parse = removeids(d.parser.parse(tree.leaves()))
+			except ValueError: parses.append('')
+			else:
+				parse.un_chomsky_normal_form()
+				parses.append(parse._pprint_flat('', '()', ''))
+			stdout.write("\r%s: %d / %d" % (name, n + 1, len(gold)))
+			stdout.flush()
+		elapsed = time() - begin
+		sents, scores = evalb(goldtrees, parses, readparam())
+		print "\r%s: %.2f s, %s" % (name, elapsed, scoresummary(scores))
+		results.append(parses)
+	print "identical parses: %d / %d" % (sum(1 for a, b in zip(*results)
+		if a == b), len(gold))
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	main()
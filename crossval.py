@@ -0,0 +1,127 @@
+#!/usr/bin/python
+""" k-fold cross-validation of the models of morph.monato(): the PCFG
+baseline, the syntax model and the combined morphology-syntax model.
+Each fold is trained in its own process, after which the bitpar jobs of
+that fold are started; all of this is scheduled under one global budget of
+worker slots, so that at most `workers' processes are busy at any time.
+Scores of all folds are collected in one report.
+
+usage: python crossval.py [-k folds] [-j workers] [-n max words] [-d dir] corpus
+"""
+from multiprocessing import Process, cpu_count
+from threading import Thread, BoundedSemaphore
+from subprocess import Popen
+from getopt import getopt
+from sys import argv
+from math import sqrt
+import os
+from split import readcorpus, kfold, writesplit
+from morph import trainmonato, parsejobs, getbest
+from evalb import evalbfiles
+
+MODELS = ("pcfg", "syntax", "morphsyntax")
+
+def makefolds(corpus, k, directory):
+	""" write the train, gold and test files of each fold to its own
+	subdirectory of directory; returns the file name prefixes of the
+	folds. """
+	prefixes = []
+	for n, (train, test) in enumerate(kfold(corpus, k)):
+		path = os.path.join(directory, "fold%d" % n)
+		if not os.path.exists(path): os.makedirs(path)
+		writesplit(train, test, os.path.join(path, "arbobanko"))
+		prefixes.append(os.path.join(path, "arbobanko"))
+	return prefixes
+
+def parsefold(budget, n, job, results):
+	""" run one bitpar job, then process and score its output. """
+	model, cmd, bitparout, resproc, gold = job
+	budget.acquire()
+	try: Popen(cmd).wait()
+	finally: budget.release()
+	getbest(bitparout, resproc, gold)
+	sents, scores = evalbfiles(gold, resproc, maxerror=1000)
+	results[n, model] = scores['all']
+	print "fold %d, %s: f-measure %.2f" % (n, model, scores['all']['fmeasure'])
+
+def trainfold(prefix, name):
+	""" train the models of a fold; stops the bitpar processes of the
+	models since the fold is parsed in batch mode. """
+	p, d, md, msd, segment, lexicon = trainmonato(prefix, name)
+	for a in (p, d.parser, md.parser, msd.parser): a.stop()
+
+def runfold(budget, n, prefix, results):
+	""" train the models of a fold in a separate process, then start its
+	bitpar jobs concurrently. """
+	budget.acquire()
+	try:
+		proc = Process(target=trainfold, args=(prefix, "fold%d" % n))
+		proc.start()
+		proc.join()
+	finally: budget.release()
+	if proc.exitcode:
+		print "fold %d: training failed (exit code %d)" % (n, proc.exitcode)
+		return
+	print "fold %d: trained models" % n
+	threads = [Thread(target=parsefold, args=(budget, n, job, results))
+		for job in parsejobs(prefix, "fold%d" % n)]
+	for a in threads: a.start()
+	for a in threads: a.join()
+
+def report(results, k):
+	""" a table with the scores per fold and model, followed by the mean
+	and standard deviation of each score over the folds. """
+	out = ["fold  model        recall  precision  f-measure  exact"]
+	for n in range(k):
+		for model in MODELS:
+			if (n, model) in results:
+				out.append("%4d  %-11s  %6.2f  %9.2f  %9.2f  %5.2f" % (
+					(n, model) + tuple(results[n, model][a] for a in
+					('recall', 'precision', 'fmeasure', 'exact'))))
+	for model in MODELS:
+		scores = [results[n, model] for n in range(k) if (n, model) in results]
+		if not scores: continue
+		line = ["mean  %-11s" % model]
+		for a in ('recall', 'precision', 'fmeasure', 'exact'):
+			mean = sum(b[a] for b in scores) / len(scores)
+			sd = sqrt(sum((b[a] - mean) ** 2 for b in scores) / len(scores))
+			line.append("%.2f (sd %.2f)" % (mean, sd))
+		out.append("  ".join(line) + "  [%d folds]" % len(scores))
+	return "\n".join(out) + "\n"
+
+def crossval(corpusfile, k=10, workers=None, directory="crossval", n=100):
+	""" build the folds, train and evaluate all models of each fold, and
+	write a report to directory/report. Returns a dictionary with the
+	corpus scores (as returned by evalb) for each (fold, model) pair.
+
+		@param workers: the maximum number of concurrent processes
+			(training or parsing); defaults to the number of CPUs.
+		@param n: only use sentences with at most n words. """
+	if workers is None: workers = cpu_count()
+	corpus = readcorpus(corpusfile, n)
+	print "%d sentences, %d folds, %d workers" % (len(corpus), k, workers)
+	prefixes = makefolds(corpus, k, directory)
+	del corpus
+	budget = BoundedSemaphore(workers)
+	results = {}
+	threads = [Thread(target=runfold, args=(budget, n, prefix, results))
+		for n, prefix in enumerate(prefixes)]
+	for a in threads: a.start()
+	for a in threads: a.join()
+	result = report(results, k)
+	open(os.path.join(directory, "report"), "w").write(result)
+	print result
+	return results
+
+def main():
+	opts, args = getopt(argv[1:], "k:j:n:d:")
+	opts = dict(opts)
+	if len(args) != 1:
+		print __doc__
+		return
+	crossval(args[0], k=int(opts.get('-k', 10)),
+		workers=int(opts['-j']) if '-j' in opts else None,
+		directory=opts.get('-d', "crossval"), n=int(opts.get('-n', 100)))
+
+if __name__ == '__main__':
+	main()
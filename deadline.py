@@ -0,0 +1,110 @@
+#!/usr/bin/python
+""" Parsing within a time budget. A deadline is an absolute time, as
+returned by time.time(); the parsers which accept one (BitParChartParser,
+CKYParser, and GoodmanDOP.parse and mostprobableparse) raise
+DeadlineExceeded when it passes before they are done, after cancelling
+their pending work (bitpar is restarted for the next sentence).
+
+A FallbackParser tries a sequence of models, eg. the DOP model and then
+the treebank PCFG, each with its own budget, and falls back to the
+right-branching baseline tree of morph.getbest() when none of them
+produces a parse in time, so that the time spent on a sentence is bounded.
+"""
+from time import time
+import metrics
+
+class DeadlineExceeded(ValueError):
+	""" raised by a parser when its deadline passes. It is a ValueError,
+	as "no parse", so that callers handling the latter degrade
+	gracefully. """
+
+def check(deadline):
+	""" raise DeadlineExceeded if a deadline (or None) has passed """
+	if deadline is not None and time() >= deadline:
+		raise DeadlineExceeded("deadline exceeded")
+
+def earliest(*deadlines):
+	""" the earliest of some deadlines, ignoring None
+
+	>>> earliest(None, 5.0, 3.0), earliest(None, None)
+	(3.0, None)
+	"""
+	deadlines = [a for a in deadlines if a is not None]
+	if deadlines: return min(deadlines)
+	return None
+
+def dummy(leaves):
+	""" construct a right-branching baseline tree.
+
+	>>> dummy(['la', 'hundo'])
+	'(np (prop la) (np (prop hundo) ))'
+	"""
+	if leaves:
+		return "(np (prop %s) %s)" % (leaves[0], dummy(leaves[1:]))
+	return ''
+
+class FallbackParser:
+	def __init__(self, levels, timeout=None, top='top'):
+		""" parse with a sequence of models, falling back to the next one
+		when a model has no parse or misses its budget, and finally to a
+		right-branching tree (cf. dummy()).
+
+		@param levels: a list of (name, function, budget) tuples, where
+			function takes a sentence and a deadline keyword argument and
+			returns a tree (eg. GoodmanDOP.mostprobableparse, or the
+			parse method of a parser), and budget is the number of
+			seconds this model may take, or None.
+		@param timeout: the number of seconds a sentence may take in
+			total, or None.
+		@param top: the label of the root of the baseline tree
+
+		>>> def slow(sent, deadline=None): raise DeadlineExceeded("deadline")
+		>>> def fast(sent, deadline=None): return "(top (x %s))" % " ".join(sent)
+		>>> p = FallbackParser([("dop", slow, 1.0), ("pcfg", fast, None)])
+		>>> p.parse("la hundo".split())
+		('pcfg', '(top (x la hundo))')
+		>>> p = FallbackParser([("dop", slow, 1.0)])
+		>>> level, tree = p.parse(["hundo"])
+		>>> level, p.counts
+		('dummy', {'dummy': 1})
+		"""
+		self.levels, self.timeout, self.top = levels, timeout, top
+		# the number of sentences parsed by each level
+		self.counts = {}
+
+	def parse(self, sent, deadline=None):
+		""" parse a sentence before a deadline (and within the timeout);
+		returns a tuple with the name of the model which produced the
+		tree, or "dummy", and the tree. """
+		if self.timeout is not None:
+			deadline = earliest(deadline, time() + self.timeout)
+		for name, function, budget in self.levels:
+			limit = earliest(deadline,
+				None if budget is None else time() + budget)
+			if limit is not None and time() >= limit: continue
+			try: tree = function(sent, deadline=limit)
+			except DeadlineExceeded: metrics.incr("deadline.%s" % name)
+			except ValueError: pass
+			else: return self.record(name), tree
+		from nltk import Tree
+		return self.record("dummy"), Tree("(%s %s)" % (self.top, dummy(sent)))
+
+	def batch_parse(self, sents, deadline=None):
+		""" parse a sequence of sentences with a deadline for the whole
+		batch; once it has passed, the remaining sentences get the
+		baseline tree. Returns a list of (level, tree) tuples. """
+		return [self.parse(sent, deadline) for sent in sents]
+
+	def record(self, name):
+		self.counts[name] = self.counts.get(name, 0) + 1
+		metrics.incr("fallback.%s" % name)
+		return name
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
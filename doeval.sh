@@ -1,4 +1,4 @@
 #!/bin/sh
 sh procresult.sh <arbobanko.results >arbobanko.resproc
-#evalb -e 1000 -p COLLINS.prm arbobanko.gold arbobanko.resproc
-evalb -e 1000 arbobanko.gold arbobanko.resproc
+#python evalb.py -e 1000 -p COLLINS.prm arbobanko.gold arbobanko.resproc
+python evalb.py -e 1000 arbobanko.gold arbobanko.resproc
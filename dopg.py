@@ -1,11 +1,24 @@
 """DOP1 implementation. Andreas van Cranenburgh <andreas@unstable.nl>
+
+usage: python dopg.py [-r maxrules] [-b maxbytes] [-t threshold] [-u] [-n maxlen] [prefix]
+	python dopg.py -m h:v[,h:v...] [-n maxlen] [prefix]
+	without arguments, a basic REPL. Otherwise, report the grammar size,
+	parsing time and scores on prefix.gold (sentences of at most maxlen
+	words, default 40) with and without compaction of the grammar
+	(cf. compact()); -u collapses unary chains. With -m, compare
+	Markovization settings, eg. -m all:0,1:0,2:1 (horizontal:vertical,
+	cf. transform.transform()).
 """
 from nltk import Production, WeightedProduction, WeightedGrammar, FreqDist, \
 		Tree, ImmutableTree, Nonterminal, InsideChartParser, ProbabilisticTree
 from collections import defaultdict
 from itertools import chain, count
-from operator import mul
-#from math import log #do something with logprobs instead?
+from operator import mul, add, sub
+from math import log, log1p, exp
+from treebank import Treebank, children, leaves as flatleaves
+from transform import transform
+import metrics
+from deadline import check
 try:
 	from itertools import product
 except ImportError:
@@ -14,9 +27,14 @@ except ImportError:
 		if seq: return (b + (a,) for b in product(*seq[:-1]) for a in seq[-1])
 		return ((), )
 
+# frequencies up to exp(MAXLOG) are written as is
+MAXLOG = 700.0
+
 class GoodmanDOP:
 	def __init__(self, treebank, rootsymbol='S', wrap=False, cnf=True,
-				cleanup=True, normalize=False, extratags=(),
+				horzmarkov=None, vertmarkov=0, cleanup=True, normalize=False, extratags=(),
+				collapseunary=False, merge=False, maxrules=None,
+				maxbytes=None, threshold=None,
 				parser=InsideChartParser, **parseroptions):
 		""" initialize a DOP model given a treebank. uses the Goodman
 		reduction of a STSG to a PCFG.  after initialization,
@@ -39,54 +57,77 @@ class GoodmanDOP:
 		
 		@param treebank: a list of Tree objects. Caveat lector:
 			terminals may not have (non-terminals as) siblings.
+			Alternatively, a binary Treebank, whose flat trees are
+			used without building Tree objects; wrap and cnf are
+			ignored, so its trees should already be binarized (as
+			in the .train files written by split.py).
 		@param wrap: boolean specifying whether to add the start symbol
 			to each tree
+		@param horzmarkov, vertmarkov: the Markovization of the
+			binarization (cf. transform.transform()); by default all
+			siblings and no ancestors.
 		@param normalize: whether to normalize frequencies
+		@param collapseunary: collapse unary chains before the reduction,
+			which removes their nodes (cf. transform.transform())
+		@param merge: merge equivalent states of the reduction (cf.
+			compact()); implied by maxrules, maxbytes and threshold,
+			which prune it to a budget. Only for BitParChartParser and
+			CKYParser.
 		@param parser: a class which will be instantiated with the DOP 
-			model as its grammar. Supports BitParChartParser.
+			model as its grammar. Supports BitParChartParser and CKYParser
+			(which accepts a coarse grammar for pruning, cf. cky.py).
 		
 		instance variables:
 		- self.grammar a WeightedGrammar containing the PCFG reduction
 		- self.fcfg a list of strings containing the PCFG reduction 
 		  with frequencies instead of probabilities
 		- self.parser an InsideChartParser object
-		- self.exemplars dictionary of known parse trees (memoization)"""
+		- self.exemplars dictionary of known parse trees (memoization)
+		- self.cfg, self.subtreefd, self.nonterminalfd, self.logweights:
+		  the counts and weights from which the grammar is derived,
+		  which are updated by add_trees()
+		- self.compaction the parameters of compact(), or None"""
 		from bitpar import BitParChartParser
-		nonterminalfd, subtreefd, cfg = FreqDist(), FreqDist(), FreqDist()
-		ids = count(1)
+		from cky import CKYParser
+		self.nonterminalfd, self.subtreefd = FreqDist(), FreqDist()
+		self.ids = count(1)
+		self.rootsymbol, self.wrap, self.cnf = rootsymbol, wrap, cnf
+		self.horzmarkov, self.vertmarkov = horzmarkov, vertmarkov
+		self.normalize, self.collapseunary = normalize, collapseunary
+		self.compaction = None
+		if merge or maxrules or maxbytes or threshold:
+			self.compaction = (maxrules, maxbytes, threshold)
+		self.bitparfmt = parser in (BitParChartParser, CKYParser)
 		self.exemplars = {}
-		if wrap:
-			# wrap trees in a common root symbol (eg. for morphology)
-			treebank = [Tree(rootsymbol, [a]) for a in treebank]
-		if cnf:
-			#CNF conversion is destructive
-			treebank = list(treebank)
-			for a in treebank:
-				a.chomsky_normal_form() #todo: sibling annotation necessary?
-
-		# add unique IDs to nodes
-		utreebank = [(tree, decorate_with_ids(tree, ids)) for tree in treebank]
-
-		# count node frequencies
-		for tree, utree in utreebank:
-			nodefreq(tree, utree, subtreefd, nonterminalfd)
+		utreebank, goodman, leaves = self.prepare(treebank)
 
-		if isinstance(parser, BitParChartParser):
-			lexicon = set(x for a, b in utreebank for x in a.pos() + b.pos())
+		if self.bitparfmt:
+			self.lexicon = set(w for a, b in utreebank for w in leaves(a))
 			# this takes the most time, produce CFG rules:
-			cfg = FreqDist(chain(*(self.goodman(tree, utree)
+			with metrics.timer("goodman"):
+				self.cfg = FreqDist(chain(*(goodman(tree, utree)
 								for tree, utree in utreebank)))
-			cfg.update("%s\t%s" % (t, w) for w, t in extratags
-								if w not in lexicon)
-			lexicon.update(a for a in extratags if a not in lexicon)
+			if metrics.enabled: metrics.incr("rules", sum(self.cfg.values()))
+			self.cfg.update("%s\t%s" % (t, w) for w, t in extratags
+								if w not in self.lexicon)
+			self.lexicon.update(w for w, t in extratags)
 			# annotate rules with frequencies
-			self.fcfg = frequencies(cfg, subtreefd, nonterminalfd, normalize)
-			self.parser = BitParChartParser(self.fcfg, lexicon, rootsymbol,
-									cleanup=cleanup, **parseroptions)
+			with metrics.timer("frequencies"):
+				self.logweights = logfrequencies(self.cfg, self.subtreefd,
+					self.nonterminalfd, normalize)
+				self.fcfg = scaleweights(self.logweights)
+			if self.compaction:
+				self.fcfg = compact(self.fcfg, *self.compaction)
+			if parser == CKYParser:
+				self.parser = CKYParser(self.fcfg, self.lexicon, rootsymbol,
+									**parseroptions)
+			else:
+				self.parser = BitParChartParser(self.fcfg, self.lexicon,
+							rootsymbol, cleanup=cleanup, **parseroptions)
 		else:
-			cfg = FreqDist(chain(*(self.goodman(tree, utree, False)
+			self.cfg = FreqDist(chain(*(goodman(tree, utree, False)
 							for tree, utree in utreebank)))
-			probs = probabilities(cfg, subtreefd, nonterminalfd)
+			probs = probabilities(self.cfg, self.subtreefd, self.nonterminalfd)
 			#for a in probs: print a
 			self.grammar = WeightedGrammar(Nonterminal(rootsymbol), probs)
 			self.parser = InsideChartParser(self.grammar)
@@ -101,8 +142,77 @@ class GoodmanDOP:
 		#self.nonterminal = dict(a.split("@")[::-1] for a in 
 		#	nonterminalfd.keys() if "@" in a)
 
-		#clean up
-		del cfg, nonterminalfd
+	def prepare(self, treebank):
+		""" add IDs to the nodes of a treebank (binarizing the trees) and
+		count its nodes and subtrees. Returns the list of tuples with the
+		trees with and without IDs, and the functions for the Goodman
+		reduction and the leaves of its trees. """
+		if isinstance(treebank, Treebank):
+			countnodes, goodman, leaves = flatnodefreq, flatgoodman, flatleaves
+			# add unique IDs to nodes
+			utreebank = [(tree, flatids(tree, self.ids)) for tree in treebank]
+		else:
+			countnodes, goodman = nodefreq, self.goodman
+			leaves = lambda tree: tree.leaves()
+			if self.wrap:
+				# wrap trees in a common root symbol (eg. for morphology)
+				treebank = [Tree(self.rootsymbol, [a]) for a in treebank]
+			# CNF conversion (destructive) and unique IDs in one pass
+			with metrics.timer("decorate_with_ids"):
+				utreebank = [transform(tree, collapseunary=self.collapseunary,
+					cnf=self.cnf, horzmarkov=self.horzmarkov,
+					vertmarkov=self.vertmarkov, ids=self.ids, inplace=True)
+					for tree in treebank]
+
+		# count node frequencies
+		with metrics.timer("nodefreq"):
+			for tree, utree in utreebank:
+				countnodes(tree, utree, self.subtreefd, self.nonterminalfd)
+		metrics.incr("trees", len(utreebank))
+		return utreebank, goodman, leaves
+
+	def add_trees(self, trees):
+		""" add trees to the model without rebuilding it. The nodes of the
+		new trees get IDs following the existing ones, so the numbers of
+		subtrees of existing nodes do not change. Only the weights of the
+		rules produced by the new trees are recomputed (with normalize,
+		also those of the rules whose lhs occurs in the new trees). The
+		parser is then reloaded with the new grammar; bitpar reads its
+		grammar files in full, so these are rewritten.
+
+		>>> d = GoodmanDOP([Tree("(S (NP mary) (VP walks))")])
+		>>> d.add_trees([Tree("(S (NP john) (VP walks))")])
+		>>> len(d.grammar.productions())
+		14
+
+			@param trees: a list of Tree objects, or a Treebank (cf.
+			__init__)."""
+		utreebank, goodman, leaves = self.prepare(trees)
+		if not self.bitparfmt:
+			self.cfg.update(chain(*(goodman(tree, utree, False)
+				for tree, utree in utreebank)))
+			probs = probabilities(self.cfg, self.subtreefd, self.nonterminalfd)
+			self.grammar = WeightedGrammar(Nonterminal(self.rootsymbol), probs)
+			self.parser = InsideChartParser(self.grammar)
+			return
+		with metrics.timer("goodman"):
+			new = FreqDist(chain(*(goodman(tree, utree)
+				for tree, utree in utreebank)))
+		if metrics.enabled: metrics.incr("rules", sum(new.values()))
+		for rule, freq in new.items(): self.cfg.inc(rule, count=freq)
+		affected = set(new)
+		if self.normalize:
+			changed = set(a.split('\t', 1)[0] for a in new)
+			affected.update(a for a in self.cfg
+				if a.split('\t', 1)[0] in changed)
+		with metrics.timer("frequencies"):
+			self.logweights.update(logfrequencies(dict((a, self.cfg[a])
+				for a in affected), self.subtreefd, self.nonterminalfd,
+				self.normalize))
+			self.fcfg = scaleweights(self.logweights)
+		if self.compaction: self.fcfg = compact(self.fcfg, *self.compaction)
+		self.lexicon.update(w for a, b in utreebank for w in leaves(a))
+		self.parser.reload(self.fcfg, self.lexicon)
 
 	def goodman(self, tree, utree, bitparfmt=True):
 		""" given a parsetree from a treebank, yield a goodman
@@ -143,20 +253,45 @@ class GoodmanDOP:
 				#	reduce(mul, map(lambda z: '@' in z and
 				#	fd[z] or 1, r)) / float(fd[l])))
 	
-	def parse(self, sent):
+	def parse(self, sent, deadline=None):
 		"""most probable derivation (not very good)."""
-		return self.parser.parse(sent)
+		if deadline is None: return self.parser.parse(sent)
+		return self.parser.parse(sent, deadline=deadline)
 
-	def mostprobableparse(self, sent, sample=None):
+	def mostprobableparse(self, sent, sample=None, deadline=None):
 		"""warning: this problem is NP-complete. using an unsorted
 		chart parser avoids unnecessary sorting (since we need all
 		derivations anyway).
 		
 		@param sent: a sequence of terminals
-		@param sample: None or int; if int then sample that many parses"""
+		@param sample: None or int; if int then sample that many parses
+		@param deadline: None or a time after which to give up, raising
+			DeadlineExceeded (only bitpar and cky.py parsers accept one)"""
+		if hasattr(self.parser, 'nbest'):
+			# bitpar and cky.py give compact trees, which are hashed once
+			p = {}
+			# the derivations are produced lazily; materialize them so that
+			# the timer only covers the aggregation
+			derivations = list(self.parser.nbest(sent, sample, deadline))
+			with metrics.timer("removeids"):
+				for prob, tree in derivations:
+					check(deadline)
+					tree = tree.removeids()
+					p[tree] = p.get(tree, 0.0) + prob
+			if not p: raise ValueError("no parse")
+			tree = max(p, key=p.get)
+			return tree.totree(p[tree])
 		p = FreqDist()
-		for a in self.parser.nbest_parse(sent, sample):
-			p.inc(removeids(a).freeze(), a.prob())
+		if deadline is None:
+			derivations = list(self.parser.nbest_parse(sent, sample))
+		else:
+			derivations = list(self.parser.nbest_parse(sent, sample,
+				deadline=deadline))
+		# sum the probabilities of the derivations of each tree
+		with metrics.timer("removeids"):
+			for a in derivations:
+				check(deadline)
+				p.inc(removeids(a).freeze(), a.prob())
 		if p.max():
 			return ProbabilisticTree(p.max().node, p.max(), prob=p[p.max()])
 		else: raise ValueError("no parse")
@@ -206,108 +341,339 @@ def decorate_with_ids(tree, ids, include_preterminals=True):
 			Tree('VP@4', ['walks'])])
 
 		@param ids: an iterator yielding a stream of IDs"""
-	utree = tree.copy(True)
-	#skip root node
-	for a in utree:
-		if not isinstance(a, Tree): continue
-		for b in a.subtrees():
-			#skip word boundary markers
-			if a.node == "_": continue
-			if include_preterminals or any(isinstance(c, Tree) for c in b):
-				b.node = "%s@%d" % (b.node, ids.next())
-	return utree
+	#skips root node and word boundary markers
+	with metrics.timer("decorate_with_ids"):
+		return transform(tree, ids=ids,
+			include_preterminals=include_preterminals, node=Tree)[1]
+
+def logadd(fd, key, x):
+	""" add exp(x) to the number in log space fd[key] """
+	if key in fd:
+		y = fd[key]
+		if x > y: x, y = y, x
+		fd[key] = y + log1p(exp(x - y))
+	else: fd[key] = x
 
 def nodefreq(tree, utree, subtreefd, nonterminalfd):
 	"""count frequencies of nodes and calculate the number of
 	subtrees headed by each node. updates "subtreefd" and "nonterminalfd"
 	as a side effect. Expects a normal tree and a tree with IDs.
+	The tree is traversed in postorder with an explicit stack. The
+	numbers of subtrees grow exponentially with the depth of the tree, so
+	they are kept in log space: subtreefd contains the logarithms of the
+	numbers of subtrees, and the return value is the logarithm of the number
+	of subtrees headed by the root.
 
 	>>> fd = FreqDist()
 	>>> tree = Tree("(S (NP mary) (VP walks))")
 	>>> d = GoodmanDOP([tree])
 	>>> utree = decorate_with_ids(tree, count(1))
-	>>> nodefreq(tree, utree, fd, FreqDist())
-	4
-	>>> fd.items()
-	[('S', 4), ('NP', 1), ('NP@1', 1), ('VP', 1), ('VP@2', 1)]
+	>>> print "%.1f" % exp(nodefreq(tree, utree, fd, FreqDist()))
+	4.0
+	>>> sorted((a, round(exp(b), 6)) for a, b in fd.items())
+	[('NP', 1.0), ('NP@1', 1.0), ('S', 4.0), ('VP', 1.0), ('VP@2', 1.0)]
 
 		@param nonterminalfd: the FreqDist to store the counts in."""
-	if not isinstance(tree, Tree):
-		raise ValueError
-	if len(tree) == 0:
-		# this error occurs when a node has zero children,
-		# e.g., (TOP (wrong))
-		raise ValueError
-	if any(isinstance(a, Tree) for a in tree):
-		n = reduce(mul,
-			(nodefreq(x, ux, subtreefd, nonterminalfd) + 1 for x, ux
-			in zip(tree, utree)))
-		subtreefd.inc(tree.node, count=n)
-		nonterminalfd.inc(tree.node, count=1)
+	freq = {}
+	agenda = [(tree, utree, False)]
+	while agenda:
+		node, unode, visited = agenda.pop()
+		if not isinstance(node, Tree):
+			raise ValueError
+		if len(node) == 0:
+			# this error occurs when a node has zero children,
+			# e.g., (TOP (wrong))
+			raise ValueError
+		if any(isinstance(a, Tree) for a in node):
+			if not visited:
+				# visit the children first
+				agenda.append((node, unode, True))
+				agenda.extend((a, b, False) for a, b in zip(node, unode))
+				continue
+			# log of the product of (number of subtrees + 1) of the children
+			n = sum(logincr(freq.pop(id(a))) for a in node)
+		else: n = 0.0
+		freq[id(node)] = n
+		logadd(subtreefd, node.node, n)
+		nonterminalfd.inc(node.node, count=1)
 		# only add counts when utree.node is actually an interior node,
 		# e.g., root node receives no ID so shouldn't be counted twice
-		if utree.node != tree.node:
-			subtreefd.inc(utree.node, count=n)
-		return n
-	else:
-		subtreefd.inc(tree.node, count=1)
-		nonterminalfd.inc(tree.node, count=1)
-		if utree.node != tree.node:
-			subtreefd.inc(utree.node, count=1)
-		return 1
+		if unode.node != node.node:
+			logadd(subtreefd, unode.node, n)
+	return freq[id(tree)]
+
+def logincr(x):
+	""" log(exp(x) + 1) for x >= 0 """
+	return x + log1p(exp(-x))
+
+def symbolweights(symbols, fd):
+	""" the logarithm of the weight of each symbol in the right hand sides
+	of the reduction: the number of subtrees headed by it for nodes with
+	IDs, 1 otherwise. """
+	return dict((z, fd[unicode(z)] if '@' in unicode(z) else 0.0)
+		for z in symbols)
 
 def probabilities(cfg, fd, nonterminalfd):
 	"""merge cfg and frequency distribution into a pcfg with the right
 	probabilities.
 
 		@param cfg: a list of Productions
-		@param fd: number of subtrees headed by each node
+		@param fd: logarithm of the number of subtrees headed by each node
 		@param nonterminalfd: a FreqDist of (non)terminals (with and
 		without IDs)""" 
-	#return [a(nonterminalfd) for a in cfg)
-	def prob(l, r):
-		return reduce(mul, map((lambda z: '@' in str(z)
-			and fd[unicode(z)] or 1), r)) / float(fd[unicode(l)])
-	# format expected by mccparse()
-	#self.pcfg = dict((Production(l, r), (reduce(mul,
-	#	map((lambda z: '@' in (type(z) == Nonterminal and z.symbol() or z)
-	#	and nonterminalfd[z] or 1), r)) / nonterminalfd[l]))
-	#	for l, r in set(cfg))
-
+	rules = cfg.items()
+	weight = symbolweights(set(z for (l, r), freq in rules for z in r), fd)
 	# merge identical rules:
-	#return [WeightedProduction(rule[0], rule[1:], prob=freq*prob(rule[0], rule[1:])) for rule, freq in ((rule.split('\t'), freq) for rule,freq in cfg.items())]
-	
-	return [WeightedProduction(l, r, prob=freq*prob(l, r))
-						for (l,r),freq in cfg.items()]
-	# do not merge identical rules
-	#return [WeightedProduction(l, r, prob=prob(l, r)) for l, r in cfg]
+	return [WeightedProduction(l, r, prob=freq * exp(sum(map(weight.get, r))
+		- fd[unicode(l)])) for (l, r), freq in rules]
 
 def frequencies(cfg, fd, nonterminalfd, normalize=False):
 	"""merge cfg and frequency distribution into a list of weighted 
 	productions with frequencies as weights (as expected by bitpar).
+	The weight of each symbol is looked up once, after which the weights
+	of all rules are computed in bulk in log space (cf. logfrequencies and
+	scaleweights).
 
 		@param cfg: a list of Productions
-		@param fd: number of subtrees headed by each node
+		@param fd: logarithm of the number of subtrees headed by each node
 		@param nonterminalfd: a FreqDist of (non)terminals (with and
 		without IDs)""" 
+	with metrics.timer("frequencies"):
+		return scaleweights(logfrequencies(cfg, fd, nonterminalfd, normalize))
+
+def logfrequencies(cfg, fd, nonterminalfd, normalize=False):
+	""" the logarithms of the weights of the rules in cfg, as a dictionary;
+	the parameters are those of frequencies(). """
+	rules = cfg.keys()
+	split = [rule.split('\t') for rule in rules]
+	weight = symbolweights(set(z for a in split for z in a[1:]), fd)
+	logs = map(add, map(log, map(cfg.get, rules)),
+		[sum(map(weight.get, a[1:])) for a in split])
 	if normalize:
 		# normalize by assigning equal weight to each node
-		return ((rule, freq * reduce(mul,
-			map((lambda z: fd[unicode(z)] if '@' in unicode(z) else 1),
-			rule.split('\t')[1:]))
-			/ (1 if '@' in rule.split('\t')[0]
-			else float(nonterminalfd[rule.split('\t')[0]])))
-		for rule, freq in cfg.items())
-	return ((rule, freq * reduce(mul,
-		map((lambda z: fd[unicode(z)] if '@' in unicode(z) else 1),
-		rule.split('\t')[1:])))
-		for rule, freq in cfg.items())
+		logs = map(sub, logs, [0.0 if '@' in a[0]
+			else log(nonterminalfd[a[0]]) for a in split])
+	return dict(zip(rules, logs))
+
+def scaleweights(logweights):
+	""" convert a dictionary of rules with log weights to a list of
+	(rule, weight) tuples. If a weight is too large for a float, the weights
+	of each left hand side are scaled by the largest one, which leaves the
+	relative frequencies unchanged. """
+	if not logweights or max(logweights.itervalues()) < MAXLOG:
+		return [(rule, exp(x)) for rule, x in logweights.iteritems()]
+	scale = {}
+	for rule, x in logweights.iteritems():
+		lhs = rule.split('\t', 1)[0]
+		scale[lhs] = max(x, scale.get(lhs, x))
+	return [(rule, exp(x - scale[rule.split('\t', 1)[0]]))
+		for rule, x in logweights.iteritems()]
+
+def isstate(symbol):
+	""" whether a symbol is a state of the Goodman reduction, eg. NP@1 """
+	return '@' in symbol and symbol.rsplit('@', 1)[1].isdigit()
+
+def grammarsize(weightedrules):
+	""" the number of rules and bytes of a grammar in the format of
+	BitParChartParser (when written to a file). """
+	return len(weightedrules), sum(len(repr(w)) + len(rule) + 2
+		for rule, w in weightedrules)
+
+def mergestates(weightedrules):
+	""" merge the states of the Goodman reduction that have the same rules
+	(after merging their children), ie. the nodes with identical subtrees.
+	Rules which become identical are merged by adding their weights, which
+	leaves the probabilities of the trees unchanged.
+
+	>>> sorted(mergestates([("S\\tNP@1\\tVP", 1.0), ("S\\tNP@3\\tVP", 1.0),
+	... ("NP@1\\tmary", 1.0), ("NP@3\\tmary", 1.0)]))
+	[('NP@1\\tmary', 1.0), ('S\\tNP@1\\tVP', 2.0)]
+	"""
+	bylhs = defaultdict(list)
+	for rule, w in weightedrules:
+		rule = rule.split('\t')
+		bylhs[rule[0]].append((rule[1:], w))
+	# visit the states bottom-up
+	canonical, signatures = {}, {}
+	for state in sorted(bylhs):
+		if not isstate(state): continue
+		agenda = [state]
+		while agenda:
+			a = agenda[-1]
+			if a in canonical:
+				agenda.pop()
+				continue
+			pending = [z for rhs, _ in bylhs[a] for z in rhs
+				if isstate(z) and z in bylhs and z not in canonical]
+			if pending:
+				agenda.extend(pending)
+				continue
+			agenda.pop()
+			signature = (a.rsplit('@', 1)[0], tuple(sorted(("\t".join(
+				canonical.get(z, z) for z in rhs), w) for rhs, w in bylhs[a])))
+			canonical[a] = signatures.setdefault(signature, a)
+	result = {}
+	for lhs, rules in bylhs.iteritems():
+		if canonical.get(lhs, lhs) != lhs: continue
+		for rhs, w in rules:
+			rule = "\t".join([lhs] + [canonical.get(z, z) for z in rhs])
+			result[rule] = result.get(rule, 0.0) + w
+	return result.items()
+
+def removeuseless(weightedrules):
+	""" remove the rules with states of the Goodman reduction that have no
+	rules, and the rules of states that are not used by other rules. """
+	while True:
+		lhs = set(rule.split('\t', 1)[0] for rule, _ in weightedrules)
+		used = set(z for rule, _ in weightedrules for z in rule.split('\t')[1:])
+		result = [(rule, w) for rule, w in weightedrules
+			if all(z in lhs or not isstate(z) for z in rule.split('\t')[1:])
+			and (rule.split('\t', 1)[0] in used
+				or not isstate(rule.split('\t', 1)[0]))]
+		if len(result) == len(weightedrules): return result
+		weightedrules = result
+
+def prunerules(weightedrules, maxrules=None, maxbytes=None, threshold=None):
+	""" drop the rules of the Goodman reduction with the lowest relative
+	frequencies (given their lhs) until the grammar has at most maxrules
+	rules and maxbytes bytes (cf. grammarsize()); with threshold, all
+	rules with a lower relative frequency are dropped. The rules without
+	states, the PCFG of the treebank, are always kept, so that coverage
+	does not change.
+
+	>>> prunerules([("S\\tNP\\tVP", 1.0), ("S\\tNP@1\\tVP", 1.0),
+	... ("NP@1\\tmary", 1.0), ("NP\\tmary", 2.0)], maxrules=2)
+	[('S\\tNP\\tVP', 1.0), ('NP\\tmary', 2.0)]
+	"""
+	total = defaultdict(float)
+	for rule, w in weightedrules: total[rule.split('\t', 1)[0]] += w
+	keep, droppable = [], []
+	for rule, w in weightedrules:
+		if any(isstate(z) for z in rule.split('\t')): droppable.append((rule, w))
+		else: keep.append((rule, w))
+	relfreq = lambda (rule, w): w / total[rule.split('\t', 1)[0]]
+	droppable.sort(key=relfreq)
+	def fits(n):
+		rules, size = grammarsize(removeuseless(keep + droppable[n:]))
+		return ((maxrules is None or rules <= maxrules)
+			and (maxbytes is None or size <= maxbytes))
+	low = 0
+	if threshold:
+		while low < len(droppable) and relfreq(droppable[low]) < threshold:
+			low += 1
+	# the smallest number of rules to drop
+	high = len(droppable)
+	while low < high:
+		mid = (low + high) // 2
+		if fits(mid): high = mid
+		else: low = mid + 1
+	return removeuseless(keep + droppable[low:])
+
+def compact(weightedrules, maxrules=None, maxbytes=None, threshold=None):
+	""" merge equivalent states of the Goodman reduction and prune the
+	result to a budget of rules or bytes (cf. mergestates(),
+	prunerules()). Unary chains are collapsed before the reduction, cf.
+	GoodmanDOP. """
+	weightedrules = mergestates(weightedrules)
+	if maxrules or maxbytes or threshold:
+		return prunerules(weightedrules, maxrules, maxbytes, threshold)
+	return weightedrules
+
+def flatids(tree, ids, include_preterminals=True):
+	""" decorate_with_ids for a flat tree (cf. treebank.py); returns a flat
+	tree with the new labels.
+
+	>>> flatids((['S', 'NP', 'mary', 'VP', 'walks'], [2, 1, -1, 1, -1]), count(1))
+	(['S', 'NP@1', 'mary', 'VP@2', 'walks'], [2, 1, -1, 1, -1])
+	"""
+	labels, arity = tree
+	ulabels = list(labels)
+	kids = children(tree)
+	# skip root node, and subtrees of word boundary markers
+	for a in kids[0] if labels else ():
+		if arity[a] == -1: continue
+		end = a + 1
+		pending = arity[a]
+		while pending > 0:
+			pending += max(arity[end], 0) - 1
+			end += 1
+		if labels[a] == "_": continue
+		for b in range(a, end):
+			if arity[b] != -1 and (include_preterminals
+					or any(arity[c] != -1 for c in kids[b])):
+				ulabels[b] = "%s@%d" % (labels[b], ids.next())
+	return ulabels, arity
+
+def flatnodefreq(tree, utree, subtreefd, nonterminalfd):
+	""" nodefreq for flat trees, computed bottom-up; returns the logarithm
+	of the number of subtrees headed by the root.
+
+	>>> fd = FreqDist()
+	>>> tree = (['S', 'NP', 'mary', 'VP', 'walks'], [2, 1, -1, 1, -1])
+	>>> print "%.1f" % exp(flatnodefreq(tree, flatids(tree, count(1)), fd,
+	... FreqDist()))
+	4.0
+	>>> sorted((a, round(exp(b), 6)) for a, b in fd.items())
+	[('NP', 1.0), ('NP@1', 1.0), ('S', 4.0), ('VP', 1.0), ('VP@2', 1.0)]
+	"""
+	labels, arity = tree
+	ulabels, _ = utree
+	if not labels or arity[0] == -1: raise ValueError
+	kids = children(tree)
+	freq = [0.0] * len(labels)
+	for n in range(len(labels) - 1, -1, -1):
+		if arity[n] == -1: continue
+		# nodes with zero children, e.g., (TOP (wrong))
+		if arity[n] == 0: raise ValueError
+		if any(arity[a] != -1 for a in kids[n]):
+			# terminals may not have non-terminals as siblings
+			if any(arity[a] == -1 for a in kids[n]): raise ValueError
+			freq[n] = sum(logincr(freq[a]) for a in kids[n])
+		logadd(subtreefd, labels[n], freq[n])
+		nonterminalfd.inc(labels[n], count=1)
+		if ulabels[n] != labels[n]:
+			logadd(subtreefd, ulabels[n], freq[n])
+	return freq[0]
+
+def flatgoodman(tree, utree, bitparfmt=True):
+	""" GoodmanDOP.goodman for flat trees.
+
+	>>> tree = (['S', 'NP', 'mary', 'VP', 'walks'], [2, 1, -1, 1, -1])
+	>>> sorted(flatgoodman(tree, flatids(tree, count(1)), False))
+	[(NP, ('mary',)), (NP@1, ('mary',)), (S, (NP, VP)), (S, (NP, VP@2)),
+	(S, (NP@1, VP)), (S, (NP@1, VP@2)), (VP, ('walks',)),
+	(VP@2, ('walks',))]
+	"""
+	labels, arity = tree
+	ulabels, _ = utree
+	sep = "\t"
+	for n, kids in enumerate(children(tree)):
+		if arity[n] == -1: continue
+		if arity[n] == 0: raise ValueError
+		if bitparfmt:
+			r, ur = [labels[a] for a in kids], [ulabels[a] for a in kids]
+		else:
+			r = [Nonterminal(labels[a]) if arity[a] != -1 else labels[a]
+				for a in kids]
+			ur = [Nonterminal(ulabels[a]) if arity[a] != -1 else ulabels[a]
+				for a in kids]
+		if len(kids) == 1:
+			if arity[kids[0]] == -1: rhs = (tuple(r), )
+			else: rhs = (tuple(r), tuple(ur))
+		elif all(arity[a] != -1 for a in kids):
+			rhs = set(product(*zip(r, ur)))
+		else: rhs = product(*zip(r, ur))
+		lhs = set((labels[n], ulabels[n]))
+		if not bitparfmt: lhs = set(map(Nonterminal, lhs))
+		for l, r in product(lhs, rhs):
+			if bitparfmt:
+				yield "%s%s%s" % (l, sep, sep.join(r))
+			else:
+				yield l, r
 
 def removeids(tree):
 	""" remove unique IDs introduced by the Goodman reduction """
-	for a in tree.subtrees(lambda t: '@' in t.node):
-		a.node = a.node.rsplit('@', 1)[0]
-	return tree
+	return transform(tree, removeids=True, inplace=True)
 
 #NB: the following code is equivalent to nltk.Tree.productions,
 # except for accepting unicode
@@ -337,8 +703,98 @@ node labels that are strings'
 			prods += productions(child)
 	return prods
 				
+def readgold(prefix, maxlen=40):
+	""" the trees of prefix.gold with at most maxlen words """
+	from sexpr import readsexpr
+	gold = [transform(readsexpr(a.lower(), Tree), stripfunc=True,
+		forcepos=True, inplace=True) for a in open(prefix + ".gold")]
+	return [a for a in gold if len(a.leaves()) <= maxlen]
+
+def evaluate(d, gold, name=''):
+	""" parse the sentences of a list of gold trees with the most probable
+	derivations of a model; returns the parsing time and the scores of
+	evalb. """
+	from sys import stdout
+	from time import time
+	from evalb import evalb, readparam
+	parses, begin = [], time()
+	for n, tree in enumerate(gold):
+		try: parse = removeids(d.parser.parse(tree.leaves()))
+		except ValueError: parses.append('')
+		else:
+			parse.un_chomsky_normal_form()
+			parses.append(parse._pprint_flat('', '()', ''))
+		stdout.write("\r%s: %d / %d" % (name, n + 1, len(gold)))
+		stdout.flush()
+	elapsed = time() - begin
+	sents, scores = evalb([a._pprint_flat('', '()', '') for a in gold],
+		parses, readparam())
+	stdout.write("\r")
+	return elapsed, scores
+
+def compactionreport(prefix, maxlen=40, **options):
+	""" compare the Goodman reduction of prefix.train with and without
+	compaction on prefix.gold; options are passed to GoodmanDOP. """
+	from cky import CKYParser
+	from morph import readtrain
+	from evalb import scoresummary
+	gold = readgold(prefix, maxlen)
+	results = []
+	for name, opts in (("full", {}), ("compact", options)):
+		d = GoodmanDOP(readtrain(prefix), rootsymbol="top", parser=CKYParser,
+			unknownwords="unknownwordsm", **opts)
+		rules, size = grammarsize(d.fcfg)
+		elapsed, scores = evaluate(d, gold, name)
+		print "%s: %d rules, %d bytes, %.2f s, %s" % (name, rules, size,
+			elapsed, scoresummary(scores))
+		results.append((rules, size, elapsed, scores))
+	(rules0, size0, time0, scores0), (rules1, size1, time1, scores1) = results
+	print "rules %+.1f%%, bytes %+.1f%%, parsing time %+.1f%%" % (
+		100.0 * (rules1 - rules0) / rules0, 100.0 * (size1 - size0) / size0,
+		100.0 * (time1 - time0) / time0)
+	print "f-measure %+.2f, exact %+.2f" % tuple(scores1['all'][a]
+		- scores0['all'][a] for a in ('fmeasure', 'exact'))
+
+def markovreport(prefix, settings, maxlen=40):
+	""" compare the Goodman reductions of prefix.train binarized with
+	different Markovizations on prefix.gold; settings is a list of
+	(horzmarkov, vertmarkov) tuples (cf. morph.readtrain()). """
+	from cky import CKYParser
+	from morph import readtrain
+	from evalb import scoresummary
+	gold = readgold(prefix, maxlen)
+	for horzmarkov, vertmarkov in settings:
+		name = "h=%s v=%d" % ("all" if horzmarkov is None else horzmarkov,
+			vertmarkov)
+		train = readtrain(prefix, horzmarkov, vertmarkov)
+		labels = set(a.node for tree in train for a in tree.subtrees())
+		d = GoodmanDOP(train, rootsymbol="top", parser=CKYParser,
+			unknownwords="unknownwordsm")
+		elapsed, scores = evaluate(d, gold, name)
+		print "%s: %d labels, %d rules, %.2f s, %s" % (name, len(labels),
+			len(d.fcfg), elapsed, scoresummary(scores))
+
 def main():
 	""" a basic REPL for testing """
+	from sys import argv
+	from getopt import getopt
+	opts, args = getopt(argv[1:], "r:b:t:un:m:")
+	opts = dict(opts)
+	if len(args) > 1:
+		print __doc__
+		return
+	if '-m' in opts:
+		return markovreport(args[0] if args else "arbobanko",
+			[(None if h == "all" else int(h), int(v)) for h, v in
+			(a.split(":") for a in opts['-m'].split(","))],
+			int(opts.get('-n', 40)))
+	if args or opts:
+		return compactionreport(args[0] if args else "arbobanko",
+			int(opts.get('-n', 40)), merge=True,
+			maxrules=int(opts['-r']) if '-r' in opts else None,
+			maxbytes=int(opts['-b']) if '-b' in opts else None,
+			threshold=float(opts['-t']) if '-t' in opts else None,
+			collapseunary='-u' in opts)
 	corpus = """(S (NP John) (VP (V likes) (NP Mary)))
 (S (NP Peter) (VP (V hates) (NP Susan)))
 (S (NP Harry) (VP (V eats) (NP pizza)))
@@ -371,8 +827,9 @@ def main():
 			print
 			print 'best', p.max(), p[p.max()]
 			#print d.parse(w)
-		except Exception: # as e:
-			print "error", #e
+		except Exception as e:
+			metrics.incr("errors")
+			print "error:", e
 
 if __name__ == '__main__':
 	import doctest
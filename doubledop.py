@@ -0,0 +1,314 @@
+#!/usr/bin/python
+""" Double-DOP (Sangati & Zuidema 2011): a DOP model with only the fragments
+that occur at least twice in the treebank, as an alternative to the Goodman
+reduction, which has a nonterminal for every node of the treebank and eight
+rules for each binary node.
+
+The fragments are the largest common fragments of the pairs of nodes with
+the same production. Together with the productions of the treebank (which
+guarantee coverage), they are encoded as a PCFG: a fragment with root X and
+frontier y1 ... yk becomes X -> X}<n>, where X}<n> is a new nonterminal
+which derives the frontier through binarized rules with probability 1;
+terminals in the frontier get a new preterminal T}<n>/i. The weight of the
+rule X -> X}<n> is the frequency of the fragment in the treebank. The
+derivations of the PCFG are converted back into trees with the table of
+fragments (backtransform).
+
+usage: python doubledop.py [-n maxlen] [prefix]
+	compare the grammar sizes, parsing times and scores of Double-DOP and
+	the Goodman reduction on prefix.gold (sentences of at most maxlen words,
+	default 40), with prefix.train as training data (default: arbobanko).
+"""
+from time import time
+from getopt import getopt
+from sys import argv, stdout
+from sexpr import readsexpr, writesexpr, leaves
+from treebank import Treebank, writetree
+
+def production(node):
+	""" the production of a node of a tuple tree, as a tuple of labels """
+	return (node[0], ) + tuple(a if isinstance(a, basestring) else a[0]
+		for a in node[1])
+
+def nodes(tree):
+	""" the internal nodes of a tuple tree, in preorder """
+	result, agenda = [], [tree]
+	while agenda:
+		node = agenda.pop()
+		result.append(node)
+		agenda.extend(a for a in reversed(node[1])
+			if not isinstance(a, basestring))
+	return result
+
+def share(tree, table):
+	""" a copy of a tuple tree in which identical subtrees are the same
+	object, given a table of the nodes seen so far. """
+	if isinstance(tree, basestring): return tree
+	children = tuple(share(a, table) for a in tree[1])
+	key = (tree[0], ) + tuple(a if isinstance(a, basestring) else id(a)
+		for a in children)
+	return table.setdefault(key, (tree[0], children))
+
+def common(a, b):
+	""" the largest common fragment of two nodes with the same production;
+	a child whose productions differ becomes a frontier node (label, ()).
+
+	>>> a = readsexpr("(S (NP (D the) (N dog)) (VP (V walks)))")
+	>>> b = readsexpr("(S (NP (D the) (N cat)) (VP (V walks)))")
+	>>> writesexpr(common(a, b))
+	'(S (NP (D the) (N )) (VP (V walks)))'
+	"""
+	if a is b: return a
+	children = []
+	for x, y in zip(a[1], b[1]):
+		if isinstance(x, basestring): children.append(x)
+		elif production(x) == production(y): children.append(common(x, y))
+		else: children.append((x[0], ()))
+	return a[0], tuple(children)
+
+def matches(fragment, node, memo):
+	""" whether a fragment occurs at a node of a tuple tree; memo is a
+	dictionary of results for pairs of shared nodes (cf. share()). """
+	if fragment is node or not fragment[1]: return fragment[0] == node[0]
+	key = id(fragment), id(node)
+	if key not in memo:
+		memo[key] = (fragment[0] == node[0]
+			and len(fragment[1]) == len(node[1])
+			and all(x == y if isinstance(x, basestring)
+				else not isinstance(y, basestring) and matches(x, y, memo)
+				for x, y in zip(fragment[1], node[1])))
+	return memo[key]
+
+def extractfragments(trees):
+	""" the fragments of a treebank of tuple trees that occur at least twice
+	(excluding single productions), with their frequencies. Identical
+	subtrees are shared, and each pair of them is compared only once.
+
+	>>> trees = map(readsexpr, ["(S (NP (D the) (N dog)) (VP (V walks)))",
+	... "(S (NP (D the) (N cat)) (VP (V walks)))"])
+	>>> for a, b in sorted(extractfragments(trees).items()): print a, b
+	(NP (D the) (N )) 2
+	(S (NP (D the) (N )) (VP (V walks))) 2
+	(VP (V walks)) 2
+	"""
+	# the distinct subtrees for each production, with their frequencies
+	table, subtrees = {}, {}
+	for tree in trees:
+		for node in nodes(share(tree, table)):
+			a = subtrees.setdefault(production(node), {})
+			if id(node) in a: a[id(node)][1] += 1
+			else: a[id(node)] = [node, 1]
+	fragments = {}
+	for candidates in subtrees.itervalues():
+		candidates = candidates.values()
+		for n, (a, freq) in enumerate(candidates):
+			if freq > 1: addfragment(a, fragments, table)
+			for b, _ in candidates[n + 1:]:
+				addfragment(common(a, b), fragments, table)
+	# count the occurrences of the fragments in the treebank; the candidates
+	# are the subtrees with the same productions at the root and at the
+	# children which are not in the frontier.
+	index = {}
+	for prod, candidates in subtrees.iteritems():
+		for key, (node, _) in candidates.iteritems():
+			for n, a in enumerate(node[1]):
+				if not isinstance(a, basestring):
+					index.setdefault((prod, n, production(a)), set()).add(key)
+	memo = {}
+	for key, fragment in fragments.items():
+		prod = production(fragment)
+		candidates = reduce(set.intersection, sorted((index[prod, n,
+			production(a)] for n, a in enumerate(fragment[1])
+			if not isinstance(a, basestring) and a[1]), key=len))
+		fragments[key] = sum(subtrees[prod][a][1] for a in candidates
+			if matches(fragment, subtrees[prod][a][0], memo))
+	return fragments
+
+def addfragment(fragment, fragments, table):
+	""" add a fragment unless it is a single production """
+	if any(not isinstance(a, basestring) and a[1] for a in fragment[1]):
+		key = writesexpr(fragment)
+		if key not in fragments: fragments[key] = share(fragment, table)
+
+def frontier(fragment):
+	""" the frontier of a fragment, a list of substitution sites (labels)
+	and (preterminal, terminal) tuples. """
+	result, agenda = [], [fragment]
+	while agenda:
+		node = agenda.pop()
+		if not node[1]: result.append(node[0])
+		for a in reversed(node[1]):
+			if isinstance(a, basestring): result.append((node[0], a))
+			else: agenda.append(a)
+	return result
+
+def fragmentrules(fragment, n, freq):
+	""" encode a fragment as a list of (rule, frequency) tuples (in the
+	format of BitParChartParser).
+
+	>>> for a in fragmentrules(readsexpr("(S (NP (D the) (N )) (VP (V walks)))"),
+	... 1, 2): print repr(a)
+	('S\\tS}<1>', 2)
+	('S}<1>\\tD}<1>/0\\tS}<1>-1', 1)
+	('S}<1>-1\\tN\\tV}<1>/2', 1)
+	('D}<1>/0\\tthe', 1)
+	('V}<1>/2\\twalks', 1)
+	"""
+	label = "%s}<%d>" % (fragment[0], n)
+	symbols, lexical = [], []
+	for m, a in enumerate(frontier(fragment)):
+		if isinstance(a, tuple):
+			symbols.append("%s}<%d>/%d" % (a[0], n, m))
+			lexical.append(("%s\t%s" % (symbols[-1], a[1]), 1))
+		else: symbols.append(a)
+	rules = [("%s\t%s" % (fragment[0], label), freq)]
+	lhs = label
+	for m in range(len(symbols) - 2):
+		rules.append(("%s\t%s\t%s-%d" % (lhs, symbols[m], label, m + 1), 1))
+		lhs = "%s-%d" % (label, m + 1)
+	rules.append(("%s\t%s" % (lhs, "\t".join(symbols[-2:])), 1))
+	return rules + lexical
+
+def fill(fragment, subtrees, node):
+	""" replace the substitution sites of a fragment with trees """
+	if not fragment[1]: return subtrees.next()
+	return node(fragment[0], [a if isinstance(a, basestring)
+		else fill(a, subtrees, node) for a in fragment[1]])
+
+def backtransform(tree, fragments, node):
+	""" convert a derivation of the PCFG of the fragments (an nltk Tree)
+	back into a tree. fragments is a list of tuple trees, indexed by the
+	numbers in the labels of the derivation.
+
+	>>> from nltk import Tree
+	>>> fragments = [None, readsexpr("(S (NP (D the) (N )) (VP (V walks)))")]
+	>>> print backtransform(Tree("(S (S}<1> (D}<1>/0 the) (S}<1>-1 "
+	... "(N (N dog)) (V}<1>/2 walks))))"), fragments, Tree)
+	(S (NP (D the) (N (N dog))) (VP (V walks)))
+	"""
+	if isinstance(tree, basestring): return tree
+	if (len(tree) == 1 and not isinstance(tree[0], basestring)
+			and "}<" in tree[0].node):
+		fragment = fragments[int(tree[0].node.split("}<", 1)[1].split(">")[0])]
+		subtrees, agenda = [], [tree[0]]
+		while agenda:
+			a = agenda.pop()
+			if "}<" not in a.node:
+				subtrees.append(backtransform(a, fragments, node))
+			elif "/" not in a.node.rsplit(">", 1)[1]:
+				agenda.extend(reversed(a))
+		return fill(fragment, iter(subtrees), node)
+	return node(tree.node, [backtransform(a, fragments, node) for a in tree])
+
+class DoubleDOP:
+	def __init__(self, treebank, rootsymbol='S', wrap=False, cnf=True,
+			horzmarkov=None, vertmarkov=0, parser=None, **parseroptions):
+		""" a Double-DOP model of a treebank, with the same parameters and
+		parsing methods as GoodmanDOP.
+
+		@param treebank: a list of nltk Trees (which are binarized in
+			place), or a binary Treebank with binarized trees.
+		@param parser: BitParChartParser or CKYParser (the default).
+
+		instance variables:
+		- self.fragments the fragments as tuple trees, indexed by their
+		  number in the labels of the grammar (the first is None)
+		- self.fcfg the grammar, as (rule, frequency) tuples
+		- self.lexicon the set of terminals
+		- self.parser the parser """
+		from nltk import Tree
+		from transform import transform
+		from cky import CKYParser
+		if parser is None: parser = CKYParser
+		if isinstance(treebank, Treebank):
+			trees = [readsexpr(writetree(a)) for a in treebank]
+		else:
+			if wrap: treebank = [Tree(rootsymbol, [a]) for a in treebank]
+			trees = [transform(a, cnf=cnf, horzmarkov=horzmarkov,
+				vertmarkov=vertmarkov) for a in treebank]
+		fragments = sorted(extractfragments(trees).items())
+		self.fragments = [None] + [readsexpr(a) for a, _ in fragments]
+		productions = {}
+		for tree in trees:
+			for a in nodes(tree):
+				a = "\t".join(production(a))
+				productions[a] = productions.get(a, 0) + 1
+		self.fcfg = productions.items()
+		for n, (fragment, freq) in enumerate(fragments):
+			self.fcfg.extend(fragmentrules(self.fragments[n + 1], n + 1, freq))
+		self.lexicon = set(w for tree in trees for w in leaves(tree))
+		self.parser = parser(self.fcfg, self.lexicon, rootsymbol,
+			**parseroptions)
+
+	def backtransform(self, tree):
+		""" convert a derivation into a tree """
+		from nltk import Tree, ProbabilisticTree
+		result = backtransform(tree, self.fragments, Tree)
+		if isinstance(tree, ProbabilisticTree):
+			return ProbabilisticTree(result.node, result, prob=tree.prob())
+		return result
+
+	def parse(self, sent):
+		""" the tree of the most probable derivation """
+		return self.backtransform(self.parser.parse(sent))
+
+	def mostprobableparse(self, sent, sample=None):
+		""" the most probable parse, approximated with the sum of the
+		probabilities of the n-best derivations of each tree.
+
+		@param sample: the number of derivations (None for all)"""
+		from nltk import FreqDist, ProbabilisticTree
+		p = FreqDist()
+		for a in self.parser.nbest_parse(sent, sample):
+			p.inc(self.backtransform(a).freeze(), a.prob())
+		if p.max():
+			return ProbabilisticTree(p.max().node, p.max(), prob=p[p.max()])
+		else: raise ValueError("no parse")
+
+def main():
+	from nltk import Tree
+	from dopg import GoodmanDOP, removeids
+	from cky import CKYParser
+	from morph import readtrain
+	from transform import transform
+	from evalb import evalb, readparam, scoresummary
+	opts, args = getopt(argv[1:], "n:")
+	opts = dict(opts)
+	if len(args) > 1:
+		print __doc__
+		return
+	prefix = args[0] if args else "arbobanko"
+	maxlen = int(opts.get('-n', 40))
+	gold = [transform(readsexpr(a.lower(), Tree), stripfunc=True,
+		forcepos=True, inplace=True) for a in open(prefix + ".gold")]
+	gold = [a for a in gold if len(a.leaves()) <= maxlen]
+	goldtrees = [a._pprint_flat('', '()', '') for a in gold]
+	for name, model in (("goodman", GoodmanDOP), ("double-dop", DoubleDOP)):
+		begin = time()
+		d = model(readtrain(prefix), rootsymbol="top", parser=CKYParser,
+			unknownwords="unknownwordsm")
+		print "%s: %d rules, %.2f s to build" % (name, len(d.parser.grammar),
+			time() - begin)
+		parses, begin = [], time()
+		for n, tree in enumerate(gold):
+			try: parse = d.parse(tree.leaves())
+			except ValueError: parses.append('')
+			else:
+				parse = removeids(parse)
+				parse.un_chomsky_normal_form()
+				parses.append(parse._pprint_flat('', '()', ''))
+			stdout.write("\r%s: %d / %d" % (name, n + 1, len(gold)))
+			stdout.flush()
+		elapsed = time() - begin
+		sents, scores = evalb(goldtrees, parses, readparam())
+		print "\r%s: %.2f s, %s" % (name, elapsed, scoresummary(scores))
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	main()
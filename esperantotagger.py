@@ -5,7 +5,11 @@
 #
 # Tagset based on Penn treebank tagset, see:
 # ftp://ftp.cis.upenn.edu/pub/treebank/doc/tagguide.ps.gz
-import codecs, operator, locale, sys
+import codecs, operator, locale, sys, re
+from multiprocessing import Pool, cpu_count
+from collections import deque
+from itertools import chain, imap
+from getopt import getopt
 # hacks to do UTF-8 from stdin/out
 #sys.stdout = codecs.EncodedFile(sys.stdout, 'utf-8')
 sys.stdout = codecs.getwriter(locale.getpreferredencoding())(sys.stdout)
@@ -30,129 +34,287 @@ DT = set(u"la kiu iu ĉiu tiu kies ies ties ĉies kia tia ia ĉia".split())
 NUMBER = set("unu du tri kvar kvin ses sep ok naŭ dek cent mil dudek tridek kvardek kvindek sesdek sepdek okdek naŭdek ducent tricent kvarcent kvincent sescent sepcent okcent naŭcent dumil trimil kvarmil kvinmil sesmil sepmil okmil naŭmil dekmil centmil".split())
 JJR = set("pli malpli ol plej".split())
 
+#punctuation that is split off from words, with its replacement
+PUNCT = {u',': u' ,', u'.': u' .', u'"': u' " ', u';': u' ;',
+	u'---': u' --- ', u'--': u' -- ', u'—': u' -- ', u'?': u' ?', u'!': u' !'}
+_punct = re.compile(u'---|--|[,.";?!—]')
+#the same, for a list of word types (most punctuation is removed)
+MORPHPUNCT = {u',': u' ', u'.': u' ', u'"': u' " ', u';': u' ', u'---': u' ',
+	u'--': u' ', u'—': u' -- ', u'?': u' ', u'!': u' '}
+
+def splitpunct(line, punct=PUNCT):
+	""" separate punctuation from words, in a single pass over the line.
+
+	>>> splitpunct(u'Saluton, "amiko"!').split()
+	[u'Saluton', u',', u'"', u'amiko', u'"', u'!']
+	"""
+	return _punct.sub(lambda m: punct[m.group()], line)
+
 def preprocess(file):
-	corpus = lower(codecs.open(file, encoding='utf-8').read())
-	#split punctuation:
-	corpus = corpus.replace(',', ' ,').replace('.', ' .').replace('"', 
-		' " ').replace(';', ' ;').replace('---', ' --- ').replace('--',
-		' -- ').replace(u'—', ' -- ').replace('?', ' ?').replace('!',
-		' !')
-	
-	for sent in corpus.split('.'):
+	""" tag a text, printing a tree for each sentence (delimited by
+	periods). The text is read line by line. """
+	def printsent(sent):
 		print '(S',
-		for word in sent.split():
-			print '(%s %s)' % (tag(word), word),
+		for word, wtag in zip(sent, tag_many(sent)):
+			print '(%s %s)' % (wtag, word),
 		print ')'
 
+	sent = []
+	for line in codecs.open(file, encoding='utf-8'):
+		#split punctuation:
+		parts = splitpunct(lower(line)).split('.')
+		for part in parts[:-1]:
+			sent.extend(part.split())
+			printsent(sent)
+			sent = []
+		sent.extend(parts[-1].split())
+	printsent(sent)
+
 def preprocessmorph(file):
-	corpus = lower(codecs.open(file, encoding='utf-8').read())
-	#split punctuation:
-	corpus = corpus.replace(',', ' ').replace('.', ' ').replace('"', 
-		' " ').replace(';', ' ').replace('---', ' ').replace('--',
-		' ').replace(u'—', ' -- ').replace('?', ' ').replace('!',
-		' ')
-	from nltk import FreqDist
-	fd = FreqDist(corpus.split())	
-	for word in fd:
+	""" print each word type of a text with its tag, most frequent first. """
+	fd = {}
+	for line in codecs.open(file, encoding='utf-8'):
+		#split punctuation:
+		for word in splitpunct(lower(line), MORPHPUNCT).split():
+			fd[word] = fd.get(word, 0) + 1
+	for word, freq in dictsort(fd):
 		print '(%s %s)' % (tag(word), word)
-			
-def main():
-	#filename to read:
-	corpus = "/dev/stdin"
-	#read corpus as one string:
-	corpus = codecs.open(corpus, encoding='utf-8').read()
-	#split punctuation:
-	corpus = corpus.replace(',', ' ,').replace('.', ' .').replace('"', 
-		' " ').replace(';', ' ;').replace('---', ' --- ').replace('--',
-		' -- ').replace(u'—', ' -- ').replace('?', ' ?').replace('!',
-		' !')
-
-	#first split lines, then split words:
-	corpus = [a.split() for a in corpus.splitlines()]
-	
-	tagged, untagged = [], []
-	
-	for line in corpus:
-		result = []
-		for word in line:
-			result.append((word, tag(word)))
-			if tag(word) == u'none':
-				untagged.append(word)
-		tagged.append(result)
-
-	for line in tagged:
-		for word, wtag in line:
-			print "(%s %s)" % (wtag, word),
-		print
+
+def tagchunk(lines):
+	""" tag a list of lines; returns the tagged lines as a single string,
+	the number of words, and a dictionary with the counts of untagged
+	words.
+
+	>>> tagchunk([u'Mi vidas vin.', u'blablabl'])
+	(u'(PRP Mi) (VB vidas) (PRP vin) (SYM .)\\n(none blablabl)\\n', 5, {u'blablabl': 1})
+	"""
+	out, n, untagged = [], 0, {}
+	for line in lines:
+		words = splitpunct(line).split()
+		tags = tag_many(words)
+		n += len(words)
+		for word, wtag in zip(words, tags):
+			if wtag == u'none': untagged[word] = untagged.get(word, 0) + 1
+		out.append(u" ".join(u"(%s %s)" % (wtag, word)
+			for word, wtag in zip(words, tags)) + u"\n")
+	return u"".join(out), n, untagged
+
+def mergecounts(counts, other, maxsize=None):
+	""" add the counts of the dictionary other to counts. When counts has
+	more than maxsize words, only the maxsize / 2 most frequent ones are
+	kept.
+
+	>>> counts = {u'a': 3, u'b': 1}
+	>>> mergecounts(counts, {u'b': 1, u'c': 2}, maxsize=2)
+	>>> sorted(counts.items())
+	[(u'a', 3)]
+	"""
+	for word, freq in other.iteritems():
+		counts[word] = counts.get(word, 0) + freq
+	if maxsize is not None and len(counts) > maxsize:
+		keep = dict(dictsort(counts)[:maxsize // 2])
+		counts.clear()
+		counts.update(keep)
+
+def chunked(lines, size):
+	""" group an iterable of lines in lists of at most size lines. """
+	chunk = []
+	for line in lines:
+		chunk.append(line)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+	if chunk: yield chunk
+
+def tagstream(infile, out, workers=1, chunksize=1000):
+	""" tag a stream of lines in chunks on a pool of processes, writing
+	the results to out in the original order. At most two chunks per
+	worker are in flight, and the memo of each worker and the counts of
+	untagged words are bounded, so memory use does not depend on the size
+	of the input. Returns the number of words, the number of untagged
+	words, and a dictionary with the counts of (the most frequent)
+	untagged words. """
+	n, u, untagged = 0, 0, {}
+	if workers == 1:
+		results = imap(tagchunk, chunked(infile, chunksize))
+	else:
+		pool = Pool(workers)
+		def inorder():
+			pending = deque()
+			for chunk in chunked(infile, chunksize):
+				pending.append(pool.apply_async(tagchunk, (chunk, )))
+				if len(pending) >= 2 * workers:
+					yield pending.popleft().get()
+			while pending:
+				yield pending.popleft().get()
+		results = inorder()
+	for tagged, words, counts in results:
+		out.write(tagged)
+		n += words
+		u += sum(counts.itervalues())
+		mergecounts(untagged, counts, MAXUNTAGGED)
+	if workers != 1:
+		pool.close()
+		pool.join()
+	return n, u, untagged
+
+def main(argv=()):
+	""" tag a text from files or standard input, line by line.
+	usage: esperantotagger.py [-j workers] [-c lines per chunk] [files]"""
+	opts, args = getopt(argv, "j:c:")
+	opts = dict(opts)
+	workers = int(opts.get('-j', cpu_count()))
+	chunksize = int(opts.get('-c', 1000))
+	if args: infile = chain(*(codecs.open(a, encoding='utf-8') for a in args))
+	else: infile = codecs.getreader('utf-8')(sys.stdin)
+	N, u, untagged = tagstream(infile, sys.stdout, workers, chunksize)
 
 	sys.stderr.write("untagged words:\n")
-	for a in set(untagged): sys.stderr.write("%s " % a)
+	for a, freq in dictsort(untagged): sys.stderr.write("%s " % a)
 
-	N = sum([len(line) for line in corpus])
-	u = len(untagged)
 	sys.stderr.write("\n\n word count %d, tagged %d = %f%%, untagged %d\n" 
-	  % (N, N - u, (N - u) / float(N) * 100, u))
+	  % (N, N - u, (N - u) / float(N or 1) * 100, u))
 
-def tag(word1):
-	word = word1.lower()
-	
-	#non-words or numbers
-	if len(word) <= 1: return "SYM"	
-	if word in NUMBER or word.isdigit(): return "CD"
-	if not any(a.isalpha() for a in word): return word
-	
-	#elision is only allowed on article la or nouns:
-	if word == "l'": return "DT"
-	if word[-1] in u"'’": return "NN"
-	#other punctuation is not part of word:
-	if not word[-1].isalpha(): return tag(word1[:-1])
-	if not word[0].isalpha(): return tag(word1[1:])
-
-	if word == 'nu' or word == 'jen': return "UH"
-	if word in CC: return "CC"
-	if word in IN: return u"IN"
-	
-	#tag uninflected forms:
-	if word[-1] == 'n': return tag(word[:-1])
-	if word[-1] == 'j': return tag(word[:-1])
-	
-	if word in DT: return "DT"
-	if word in PRP: return u"PRP"
-	if word in PRPd: return u"PRP"
-	
-	if word in WRB: return "RB"
-	if word in RB: return "RB"
-	
-	if word in JJR: return "JJ"
-
-	if word == "kio": return "WDT"
-	if word == "kiu": return "WP"
-	if word == "kies": return "WP"
-	
+# The rules of the tagger, in order of precedence. A "word" rule applies
+# when the whole word is in the given set, a "suffix" rule when the word
+# ends with one of the strings. STRIP means the word is tagged as the word
+# without its last letter (accusative -n, plural -j).
+STRIP = object()
+RULES = (
+	('word', (u'nu', u'jen'), "UH"),
+	('word', CC, "CC"),
+	('word', IN, u"IN"),
+	('suffix', (u'n', u'j'), STRIP),
+	('word', DT, "DT"),
+	('word', PRP, u"PRP"),
+	('word', PRPd, u"PRP"),
+	('word', WRB, "RB"),
+	('word', RB, "RB"),
+	('word', JJR, "JJ"),
+	('word', (u"kio", ), "WDT"),
+	('word', (u"kiu", u"kies"), "WP"),
 	#words like hodiaŭ, preskaŭ etc.
-	if word[-2:] == u'aŭ': return "RB"
-	
+	('suffix', (u'aŭ', ), "RB"),
 	#open word classes:
-	if word[-1] == 'a': return "JJ"
-	if word[-1] == 'e': return "RB"		#this includes "ne"!
-	if word[-1] == 'i': return "VB"
-	if word[-1] == 'o': return "NN"
-	if word[-1] == 'u': return "VB"
-	
-	#verbs	
-	if word[-1:] == 's':
-		if word[-2] == 'a': return "VB"
-		if word[-2] == 'i': return "VB"
-		if word[-2] == 'o': return "VB"
-		if word[-2] == 'u': return "VB"
-	
-	
-	#proper nouns / names
-	if capitalized(word1):
-		if word1[-1] == "j": return u"NN"
-		else: return "NN"
-	
-	return u"none"
+	('suffix', (u'a', ), "JJ"),
+	('suffix', (u'e', ), "RB"),		#this includes "ne"!
+	('suffix', (u'i', ), "VB"),
+	('suffix', (u'o', ), "NN"),
+	('suffix', (u'u', ), "VB"),
+	#verbs
+	('suffix', (u'as', u'is', u'os', u'us'), "VB"))
+
+def compilerules(rules):
+	""" compile the rules into a deterministic automaton reading a word
+	from right to left. Returns three tables indexed by state: the
+	transitions (a dictionary mapping characters to states), the tag when
+	the word ends in this state, and the tag when the word continues but
+	there is no transition for the next character. Tags are None when no
+	rule applies. State 0 is the start state.
+
+	>>> delta, final, default = compilerules((('word', ('la', ), 'DT'),
+	...	('suffix', ('a', ), 'JJ')))
+	>>> delta
+	[{'a': 1}, {'l': 2}, {}]
+	>>> final, default
+	([None, 'JJ', 'DT'], [None, 'JJ', 'JJ'])
+	"""
+	delta, words, suffixes = [{}], [[]], [[]]
+	for prec, (kind, strings, tag) in enumerate(rules):
+		for a in strings:
+			state = 0
+			for char in reversed(a):
+				if char not in delta[state]:
+					delta[state][char] = len(delta)
+					delta.append({})
+					words.append([])
+					suffixes.append([])
+				state = delta[state][char]
+			(words if kind == 'word' else suffixes)[state].append((prec, tag))
+	# the best suffix rule of a state is inherited by its successors;
+	# successors always have a higher number than their predecessor.
+	best = [min(a) if a else None for a in suffixes]
+	for state in range(len(delta)):
+		for nextstate in delta[state].values():
+			if best[state] and (not best[nextstate]
+					or best[state] < best[nextstate]):
+				best[nextstate] = best[state]
+	final = [min(a + [b] if b else a)[1] if a or b else None
+		for a, b in zip(words, best)]
+	default = [b[1] if b else None for b in best]
+	return delta, final, default
+
+_delta, _final, _default = compilerules(RULES)
+# the memo of tag() is cleared when it reaches this number of words, and
+# tagstream() keeps the counts of at most this number of untagged words
+MEMOSIZE = 1 << 16
+MAXUNTAGGED = 1 << 14
+_memo = {}
+
+def automaton(word):
+	""" run the automaton on a (lowercase) word, returns a tag, STRIP,
+	or None """
+	delta = _delta
+	state = 0
+	for char in reversed(word):
+		try: state = delta[state][char]
+		except KeyError: return _default[state]
+	return _final[state]
+
+def tag(word1):
+	""" tag a word; the result is memoized for each word type.
+
+	>>> [tag(a) for a in u"la hundoj de Petro kuras rapide al liaj domoj".split()]
+	['DT', 'NN', u'IN', 'NN', 'VB', 'RB', u'IN', u'PRP', 'NN']
+	"""
+	try: return _memo[word1]
+	except KeyError:
+		if len(_memo) >= MEMOSIZE: _memo.clear()
+		result = _memo[word1] = _tag(word1)
+		return result
+
+def tag_many(words):
+	""" tag a sequence of words, returns a list of tags. """
+	memo = _memo
+	result = []
+	for word in words:
+		try: result.append(memo[word])
+		except KeyError:
+			if len(memo) >= MEMOSIZE: memo.clear()
+			memo[word] = _tag(word)
+			result.append(memo[word])
+	return result
+
+def _tag(word1):
+	while True:
+		word = word1.lower()
+
+		#non-words or numbers
+		if len(word) <= 1: return "SYM"	
+		if word in NUMBER or word.isdigit(): return "CD"
+		if not any(a.isalpha() for a in word): return word
+
+		#elision is only allowed on article la or nouns:
+		if word == "l'": return "DT"
+		if word[-1] in u"'’": return "NN"
+		#other punctuation is not part of word:
+		if not word[-1].isalpha():
+			word1 = word1[:-1]
+			continue
+		if not word[0].isalpha():
+			word1 = word1[1:]
+			continue
+
+		result = automaton(word)
+		#tag uninflected forms:
+		if result is STRIP:
+			word1 = word[:-1]
+			continue
+		if result is not None: return result
+
+		#proper nouns / names
+		if capitalized(word1): return "NN"
+		return u"none"
 
 def capitalized(word):
 	#esperanto alphabet including non-esperanto western characters
@@ -179,5 +341,5 @@ def dictsort(d):
 	return a
 
 if __name__ == '__main__':
-	preprocessmorph('dualibro.txt')
-	#main()
+	#preprocessmorph('dualibro.txt')
+	main(sys.argv[1:])
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+""" Bracket scoring in the style of evalb (Sekine & Collins 1997), without
+shelling out to the external binary. Gold and test trees are read in bulk,
+each tree is reduced to an array of integer keys (one per labeled span),
+and the matching brackets of a sentence are counted with a single merge of
+two sorted arrays. Understands the parameter files of evalb, eg. COLLINS.prm.
+
+usage: python evalb.py [-p param.prm] [-e max_error] [-v] gold test
+"""
+from sys import argv, stderr
+from getopt import getopt, GetoptError
+import re
+
+# defaults of the evalb binary when no parameter file is given
+DEFAULTPARAM = dict(DEBUG=0, MAX_ERROR=10, CUTOFF_LEN=40, LABELED=1,
+	DELETE_LABEL=set(), DELETE_LABEL_FOR_LENGTH=set(), EQ_LABEL={},
+	EQ_WORD={})
+
+tokenize = re.compile(r"\(|\)|[^\s()]+").findall
+
+def readparam(filename=None):
+	""" read an evalb parameter file, returns a dictionary with the
+	parameters (using the defaults of evalb for missing values).
+	Equivalent labels and words are stored as mappings to a
+	canonical representative.
+
+	>>> param = readparam('COLLINS.prm')
+	>>> param['LABELED'], param['CUTOFF_LEN'], sorted(param['DELETE_LABEL'])
+	(1, 40, ["''", ',', '-NONE-', '.', ':', 'TOP', '``'])
+	>>> param['EQ_LABEL']
+	{'PRT': 'ADVP'}
+	"""
+	param = dict((a, b.copy() if hasattr(b, 'copy') else b)
+		for a, b in DEFAULTPARAM.items())
+	if filename is None: return param
+	for line in open(filename):
+		line = line.split()
+		if not line or line[0].startswith('#'): continue
+		if line[0] in ('DELETE_LABEL', 'DELETE_LABEL_FOR_LENGTH'):
+			param[line[0]].add(line[1])
+		elif line[0] in ('EQ_LABEL', 'EQ_WORD'):
+			for a in line[2:]:
+				param[line[0]][a] = param[line[0]].get(line[1], line[1])
+		elif line[0] in ('DEBUG', 'MAX_ERROR', 'CUTOFF_LEN', 'LABELED'):
+			param[line[0]] = int(line[1])
+		else:
+			raise ValueError("unknown parameter %r in %s" % (line[0], filename))
+	return param
+
+def readbrackets(line, param):
+	""" read a tree in bracket notation, or a list of its tokens (cf.
+	treebank.tokens); returns a tuple with its
+	words, POS tags and brackets (label, start, end). Labels are stripped
+	of function tags and deleted according to the parameters; a deleted
+	preterminal removes its word as well. Preterminals are not brackets.
+
+	>>> param = readparam('COLLINS.prm')
+	>>> readbrackets("(TOP (S (NP-SBJ (NN mary)) (VP walks) (. .)))", param)
+	(['mary', 'walks'], ['NN', 'VP'], [('NP', 0, 1), ('S', 0, 2)])
+	"""
+	words, tags, brackets = [], [], []
+	# stack of [label, index of first word, dominates a node?]
+	stack = []
+	tokens = tokenize(line) if isinstance(line, basestring) else line
+	for n, a in enumerate(tokens):
+		if a == '(':
+			if n + 1 < len(tokens) and tokens[n + 1] not in '()':
+				label = tokens[n + 1]
+			else: label = ''
+			if stack: stack[-1][2] = True
+			stack.append([label, len(words), False])
+		elif a == ')':
+			if not stack: raise ValueError("unbalanced parentheses: %s" % line)
+			label, start, haschild = stack.pop()
+			if not haschild and len(words) > start:
+				# preterminal
+				if label in param['DELETE_LABEL']:
+					del words[start:], tags[start:]
+				else: tags[start:] = [label] * (len(words) - start)
+			elif label not in param['DELETE_LABEL'] and len(words) > start:
+				if label[:1] != '-':
+					label = re.split('[-=]', label)[0]
+				brackets.append((param['EQ_LABEL'].get(label, label),
+					start, len(words)))
+		elif tokens[n - 1] != '(':
+			words.append(param['EQ_WORD'].get(a, a))
+			tags.append(None)
+	if stack: raise ValueError("unbalanced parentheses: %s" % line)
+	return words, tags, brackets
+
+def bracketkeys(brackets, length, labels, labeled=True):
+	""" encode brackets as a sorted array of integers, such that identical
+	brackets map to identical integers.
+
+		@param labels: a dictionary to intern labels with, shared by the
+			gold and test trees.
+		@param labeled: if false, all labels are equal. """
+	m = length + 1
+	if labeled:
+		return sorted((labels.setdefault(label, len(labels)) * m + start)
+			* m + end for label, start, end in brackets)
+	return sorted(start * m + end for label, start, end in brackets)
+
+def matches(gold, test):
+	""" count the number of elements in common between two sorted arrays,
+	respecting multiplicity.
+
+	>>> matches([1, 3, 3, 7, 9], [3, 3, 3, 8, 9])
+	3
+	"""
+	i = j = n = 0
+	while i < len(gold) and j < len(test):
+		if gold[i] == test[j]:
+			n += 1
+			i += 1
+			j += 1
+		elif gold[i] < test[j]: i += 1
+		else: j += 1
+	return n
+
+def crossing(gold, test):
+	""" the number of test brackets crossing at least one gold bracket. """
+	gspans = set((a, b) for _, a, b in gold)
+	return sum(1 for _, i, j in test if any(k < i < l < j or i < k < j < l
+		for k, l in gspans))
+
+def evalsent(gold, test, param, labels):
+	""" compare a gold and a test tree given as strings (or lists of
+	tokens). returns a tuple
+	(status, length, matched, gold brackets, test brackets, crossing,
+	words, correct tags). status is 0 for valid sentences, 1 for errors,
+	2 for skipped sentences (no test tree). """
+	gwords, gtags, gbrackets = readbrackets(gold, param)
+	if not (test.strip() if isinstance(test, basestring) else test):
+		return (2, len(gwords), 0, 0, 0, 0, 0, 0)
+	twords, ttags, tbrackets = readbrackets(test, param)
+	length = sum(1 for a in gtags
+		if a not in param['DELETE_LABEL_FOR_LENGTH'])
+	if len(gwords) != len(twords) or gwords != twords:
+		return (1, length, 0, 0, 0, 0, 0, 0)
+	n = len(gwords)
+	match = matches(bracketkeys(gbrackets, n, labels, param['LABELED']),
+		bracketkeys(tbrackets, n, labels, param['LABELED']))
+	return (0, length, match, len(gbrackets), len(tbrackets),
+		crossing(gbrackets, tbrackets), n,
+		sum(1 for a, b in zip(gtags, ttags) if a == b))
+
+def evalb(gold, test, param=None):
+	""" score a sequence of test trees against a sequence of gold trees,
+	both in bracket notation. returns a list with a tuple of scores for each
+	sentence (see evalsent) and a dictionary with corpus scores for all
+	sentences and for those of at most CUTOFF_LEN words.
+
+	>>> gold = ["(S (NP (DT the) (NN cat)) (VP (VB sat)))", "(S (NN hi))"]
+	>>> test = ["(S (DT the) (VP (NN cat) (VB sat)))", ""]
+	>>> sents, scores = evalb(gold, test, readparam())
+	>>> sents[0]
+	(0, 3, 1, 3, 2, 1, 3, 3)
+	>>> print '%(recall).2f %(precision).2f %(fmeasure).2f' % scores['all']
+	33.33 50.00 40.00
+	"""
+	if param is None: param = readparam()
+	labels = {}
+	sents = []
+	errors = 0
+	for n, (g, t) in enumerate(zip(gold, test)):
+		try: result = evalsent(g, t, param, labels)
+		except ValueError as e:
+			stderr.write("sentence %d: %s\n" % (n + 1, e))
+			result = (1, 0, 0, 0, 0, 0, 0, 0)
+		if result[0] == 1:
+			errors += 1
+			if errors > param['MAX_ERROR']:
+				raise ValueError("too many errors (sentence %d)" % (n + 1))
+		sents.append(result)
+	return sents, dict(all=summary(sents),
+		cutoff=summary([a for a in sents if a[1] <= param['CUTOFF_LEN']]))
+
+def summary(sents):
+	""" aggregate sentence scores into corpus scores (percentages). """
+	valid = [a for a in sents if a[0] == 0]
+	match = sum(a[2] for a in valid)
+	gold = sum(a[3] for a in valid)
+	test = sum(a[4] for a in valid)
+	recall = 100.0 * match / gold if gold else 0.0
+	precision = 100.0 * match / test if test else 0.0
+	return dict(sents=len(sents),
+		errors=sum(1 for a in sents if a[0] == 1),
+		skipped=sum(1 for a in sents if a[0] == 2),
+		valid=len(valid), recall=recall, precision=precision,
+		fmeasure=2 * recall * precision / (recall + precision)
+			if recall + precision else 0.0,
+		exact=100.0 * sum(1 for a in valid if a[2] == a[3] == a[4])
+			/ len(valid) if valid else 0.0,
+		crossing=float(sum(a[5] for a in valid)) / len(valid)
+			if valid else 0.0,
+		nocrossing=100.0 * sum(1 for a in valid if a[5] == 0) / len(valid)
+			if valid else 0.0,
+		tagging=100.0 * sum(a[7] for a in valid) / sum(a[6] for a in valid)
+			if sum(a[6] for a in valid) else 0.0)
+
+def scoresummary(scores):
+	""" a one line summary of corpus scores as returned by evalb. """
+	return ("labeled recall %(recall).2f precision %(precision).2f "
+		"f-measure %(fmeasure).2f exact %(exact).2f (%(valid)d valid, "
+		"%(errors)d errors)" % scores['all'])
+
+def readtrees(filename):
+	""" the trees of a file with one tree per line, or the token lists of
+	the trees of a binary treebank (*.tbk, cf. treebank.py) """
+	if filename.endswith(".tbk"):
+		from treebank import Treebank, tokens
+		return map(tokens, Treebank(filename))
+	return open(filename).read().splitlines()
+
+def evalbfiles(goldfile, testfile, paramfile=None, maxerror=None):
+	""" score a file of test trees against a file of gold trees, with one
+	tree per line (or binary treebanks). """
+	param = readparam(paramfile)
+	if maxerror is not None: param['MAX_ERROR'] = maxerror
+	return evalb(readtrees(goldfile), readtrees(testfile), param)
+
+def report(sents, scores, param, out, verbose=False):
+	""" write scores in the format of evalb. """
+	status = ('0', 'E', 'S')
+	if verbose:
+		out.write("  Sent.                        Matched  Bracket   Cross"
+			"        Correct Tag\n ID  Len.  Stat. Recal  Prec.  Bracket"
+			" gold test Bracket Words  Tags Accracy\n" + "=" * 75 + "\n")
+		for n, a in enumerate(sents):
+			out.write("%4d %4d    %s  %6.2f %6.2f  %5d %5d %5d  %5d  %4d"
+				" %4d  %6.2f\n" % (n + 1, a[1], status[a[0]],
+				100.0 * a[2] / a[3] if a[3] else 0.0,
+				100.0 * a[2] / a[4] if a[4] else 0.0,
+				a[2], a[3], a[4], a[5], a[6], a[7],
+				100.0 * a[7] / a[6] if a[6] else 0.0))
+		out.write("=" * 75 + "\n")
+	for name, title in (('all', 'All'),
+		('cutoff', 'len<=%d' % param['CUTOFF_LEN'])):
+		out.write("\n-- %s --\n" % title)
+		out.write("Number of sentence        = %6d\n"
+			"Number of Error sentence  = %6d\n"
+			"Number of Skip  sentence  = %6d\n"
+			"Number of Valid sentence  = %6d\n"
+			"Bracketing Recall         = %6.2f\n"
+			"Bracketing Precision      = %6.2f\n"
+			"Bracketing FMeasure       = %6.2f\n"
+			"Complete match            = %6.2f\n"
+			"Average crossing          = %6.2f\n"
+			"No crossing               = %6.2f\n"
+			"Tagging accuracy          = %6.2f\n" % tuple(scores[name][a]
+			for a in ('sents', 'errors', 'skipped', 'valid', 'recall',
+			'precision', 'fmeasure', 'exact', 'crossing', 'nocrossing',
+			'tagging')))
+
+def main():
+	from sys import stdout
+	try: opts, args = getopt(argv[1:], "p:e:v")
+	except GetoptError as e:
+		print e
+		print __doc__
+		return
+	opts = dict(opts)
+	if len(args) != 2:
+		print __doc__
+		return
+	param = readparam(opts.get('-p'))
+	if '-e' in opts: param['MAX_ERROR'] = int(opts['-e'])
+	sents, scores = evalb(readtrees(args[0]), readtrees(args[1]), param)
+	report(sents, scores, param, stdout, '-v' in opts or param['DEBUG'])
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		stderr.write("%d doctests succeeded!\n" % attempted)
+	main()
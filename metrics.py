@@ -0,0 +1,309 @@
+#!/usr/bin/python
+""" Lightweight instrumentation of the stages of grammar extraction and
+parsing: counters (eg. rules emitted, bytes written, sentences parsed) and
+histograms of latencies (eg. of decorate_with_ids, nodefreq, the goodman
+reduction, bitpar's start, send and receive), which can be exported as a
+JSON snapshot or in the text format of Prometheus.
+
+Instrumentation is disabled by default, in which case incr() and observe()
+return immediately and timer() returns a shared object which does nothing,
+so that the instrumented code pays only for a function call. Enable it
+with enable(), or by setting the environment variable DOPMETRICS to a file
+name; the metrics are then written to that file when the program exits
+(in the Prometheus format when its name ends with .prom, else as JSON).
+Each process keeps its own metrics; within a process, they may be updated
+from several threads (eg. morph.concurrently()).
+
+Independently, parsers can record a trace of each sentence they parse
+(cf. starttrace()): its length, number of unknown words, the model, the
+time to the first result and in total, the number of derivations
+received, and the outcome (parse, noparse or timeout). Sentences taking
+longer than a threshold are also written to a slow log, from which
+targeted benchmarks can be made (cf. bench.py -l). Tracing is enabled by
+setting DOPTRACE to a file name, optionally with DOPSLOWLOG and DOPSLOW
+(the threshold in seconds, default 10).
+"""
+from bisect import bisect_left
+from threading import Lock
+from time import time
+import os
+
+# upper bounds of the buckets of latency histograms, in seconds
+BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+enabled = False
+counters = {}
+histograms = {}
+# per-sentence tracing, cf. starttrace()
+tracing = False
+tracefile = slowlog = None
+slowthreshold = 10.0
+tracelock = Lock()
+# guards the counters and histograms when enabled
+lock = Lock()
+
+class Histogram:
+	def __init__(self, buckets=BUCKETS):
+		""" the number of observations in each bucket (the last one
+		without upper bound), and their sum and number. """
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.sum, self.count = 0.0, 0
+	def observe(self, x):
+		self.counts[bisect_left(self.buckets, x)] += 1
+		self.sum += x
+		self.count += 1
+	def cumulative(self):
+		""" (upper bound, number of observations up to that bound) pairs,
+		the last one with bound None (infinity). """
+		result, total = [], 0
+		for bound, n in zip(self.buckets + (None, ), self.counts):
+			total += n
+			result.append((bound, total))
+		return result
+
+class Timer:
+	""" a context manager adding the time spent in its block to the
+	histogram of name """
+	def __init__(self, name):
+		self.name = name
+	def __enter__(self):
+		self.begin = time()
+		return self
+	def __exit__(self, *exc):
+		observe(self.name, time() - self.begin)
+		return False
+
+class NoTimer:
+	""" the timer used when instrumentation is disabled """
+	def __enter__(self): return self
+	def __exit__(self, *exc): return False
+
+NOTIMER = NoTimer()
+
+def enable():
+	global enabled
+	enabled = True
+
+def disable():
+	global enabled
+	enabled = False
+
+def reset():
+	""" forget all counters and histograms """
+	lock.acquire()
+	try:
+		counters.clear()
+		histograms.clear()
+	finally: lock.release()
+
+def incr(name, n=1):
+	""" add n to a counter """
+	if enabled:
+		lock.acquire()
+		try: counters[name] = counters.get(name, 0) + n
+		finally: lock.release()
+
+def observe(name, seconds):
+	""" add an observation to a histogram
+
+	>>> from threading import Thread
+	>>> enable(); reset()
+	>>> def work():
+	...	for _ in range(10000): incr('sentences'); observe('parse', 0.01)
+	>>> threads = [Thread(target=work) for _ in range(4)]
+	>>> for a in threads: a.start()
+	>>> for a in threads: a.join()
+	>>> counters['sentences'], histograms['parse'].count
+	(40000, 40000)
+	>>> disable(); reset()
+	"""
+	if enabled:
+		lock.acquire()
+		try:
+			if name not in histograms: histograms[name] = Histogram()
+			histograms[name].observe(seconds)
+		finally: lock.release()
+
+def timer(name):
+	""" time a block of code: with timer("nodefreq"): ... """
+	if enabled: return Timer(name)
+	return NOTIMER
+
+def rates():
+	""" derived metrics: the number of sentences parsed per second of
+	parsing, and the fraction of sentences without a parse. """
+	result = {}
+	sents = counters.get('sentences', 0)
+	if sents and histograms.get('parse') and histograms['parse'].sum:
+		result['sentences_per_second'] = sents / histograms['parse'].sum
+	if sents:
+		result['noparse_rate'] = counters.get('noparse', 0) / float(sents)
+	return result
+
+def snapshot():
+	""" the current metrics as a dictionary
+
+	>>> enable(); reset()
+	>>> incr('sentences', 4); incr('noparse')
+	>>> for a in (0.02, 0.3, 0.3, 0.7): observe('parse', a)
+	>>> with timer('nodefreq'): pass
+	>>> s = snapshot()
+	>>> s['counters']
+	{'noparse': 1, 'sentences': 4}
+	>>> s['histograms']['parse']['buckets'][4:]
+	[[0.05, 1], [0.1, 1], [0.5, 3], [1.0, 4], [5.0, 4], [10.0, 4], [60.0, 4],
+	['+Inf', 4]]
+	>>> sorted(s['rates'].items())
+	[('noparse_rate', 0.25), ('sentences_per_second', 3.03...)]
+	>>> disable(); incr('sentences'); counters['sentences']
+	4
+	"""
+	lock.acquire()
+	try:
+		return dict(counters=dict(counters), histograms=dict((name,
+				dict(buckets=[[bound if bound is not None else '+Inf', n]
+					for bound, n in a.cumulative()],
+				sum=a.sum, count=a.count)) for name, a in histograms.items()),
+			rates=rates())
+	finally: lock.release()
+
+def tojson():
+	""" the current metrics as JSON """
+	from json import dumps
+	return dumps(snapshot(), indent=1, sort_keys=True)
+
+def promname(name):
+	""" a metric name in the Prometheus format, eg. bitpar.send =>
+	dop_bitpar_send """
+	return "dop_" + "".join(a if a.isalnum() else "_" for a in name)
+
+def toprometheus():
+	""" the current metrics in the text format of Prometheus
+
+	>>> enable(); reset()
+	>>> incr('writegrammar.bytes', 1024); observe('bitpar.send', 0.003)
+	>>> print toprometheus()
+	# TYPE dop_writegrammar_bytes_total counter
+	dop_writegrammar_bytes_total 1024
+	# TYPE dop_bitpar_send_seconds histogram
+	dop_bitpar_send_seconds_bucket{le="0.0001"} 0
+	dop_bitpar_send_seconds_bucket{le="0.001"} 0
+	dop_bitpar_send_seconds_bucket{le="0.005"} 1
+	...
+	dop_bitpar_send_seconds_bucket{le="+Inf"} 1
+	dop_bitpar_send_seconds_sum 0.003
+	dop_bitpar_send_seconds_count 1
+	>>> disable(); reset()
+	"""
+	lines = []
+	lock.acquire()
+	try:
+		for name in sorted(counters):
+			lines.append("# TYPE %s_total counter" % promname(name))
+			lines.append("%s_total %s" % (promname(name), counters[name]))
+		for name in sorted(histograms):
+			a, prefix = histograms[name], promname(name) + "_seconds"
+			lines.append("# TYPE %s histogram" % prefix)
+			for bound, n in a.cumulative():
+				lines.append('%s_bucket{le="%s"} %d' % (prefix,
+					"+Inf" if bound is None else repr(bound), n))
+			lines.append("%s_sum %r" % (prefix, a.sum))
+			lines.append("%s_count %d" % (prefix, a.count))
+		for name, value in sorted(rates().items()):
+			lines.append("# TYPE %s gauge" % promname(name))
+			lines.append("%s %r" % (promname(name), value))
+		return "\n".join(lines)
+	finally: lock.release()
+
+def write(filename):
+	""" write the metrics to a file; in the Prometheus format if its name
+	ends with .prom, else as JSON. """
+	out = open(filename, "w")
+	if filename.endswith(".prom"): out.write(toprometheus() + "\n")
+	else: out.write(tojson() + "\n")
+	out.close()
+
+def starttrace(filename, slowlogname=None, threshold=10.0):
+	""" record a trace of each parsed sentence (cf. trace()) in filename,
+	one JSON object per line, and write the sentences which take at least
+	threshold seconds to slowlogname as well. Records are flushed
+	immediately, so when a run stalls, the sentence after the last one in
+	the trace of a model is the culprit. """
+	global tracing, tracefile, slowlog, slowthreshold
+	stoptrace()
+	tracefile = open(filename, "a")
+	slowlog = open(slowlogname, "a") if slowlogname else None
+	slowthreshold = threshold
+	tracing = True
+
+def stoptrace():
+	global tracing, tracefile, slowlog
+	tracing = False
+	for a in (tracefile, slowlog):
+		if a is not None: a.close()
+	tracefile = slowlog = None
+
+def trace(model, sent, outcome, begin, first=None, nbest=0, unknown=None):
+	""" record the parse of a sentence, when tracing is enabled.
+
+	@param model: the name of the model or parser
+	@param sent: the sentence, a list of words
+	@param outcome: "parse", "noparse" or "timeout"
+	@param begin: the time at which parsing started
+	@param first: the time at which the first derivation was received
+	@param nbest: the number of derivations received
+	@param unknown: the number of unknown words, if known
+
+	>>> import tempfile
+	>>> filename = tempfile.mktemp()
+	>>> starttrace(filename, filename + ".slow", threshold=1.0)
+	>>> now = time()
+	>>> trace('syntax', ['la', 'hundo'], 'parse', now - 0.5, now - 0.4, 3, 1)
+	>>> trace('syntax', ['bojas'], 'timeout', now - 30)
+	>>> stoptrace()
+	>>> [(a['sentence'], a['outcome'], a['nbest']) for a in readtrace(filename)]
+	[([u'la', u'hundo'], u'parse', 3), ([u'bojas'], u'timeout', 0)]
+	>>> [a['sentence'] for a in readtrace(filename + ".slow")]
+	[[u'bojas']]
+	>>> os.remove(filename); os.remove(filename + ".slow")
+	"""
+	if not tracing: return
+	from json import dumps
+	end = time()
+	line = dumps(dict(model=model, sentence=list(sent), length=len(sent),
+		unknown=unknown, first=None if first is None else first - begin,
+		total=end - begin, nbest=nbest, outcome=outcome, time=end)) + "\n"
+	tracelock.acquire()
+	try:
+		tracefile.write(line)
+		tracefile.flush()
+		if slowlog is not None and end - begin >= slowthreshold:
+			slowlog.write(line)
+			slowlog.flush()
+	finally: tracelock.release()
+
+def readtrace(filename, model=None):
+	""" the records of a trace or slow log, optionally only those of one
+	model """
+	from json import loads
+	records = [loads(line) for line in open(filename) if line.strip()]
+	return [a for a in records if model is None or a['model'] == model]
+
+if os.environ.get('DOPTRACE'):
+	starttrace(os.environ['DOPTRACE'], os.environ.get('DOPSLOWLOG'),
+		float(os.environ.get('DOPSLOW', 10.0)))
+
+if os.environ.get('DOPMETRICS'):
+	import atexit
+	enable()
+	atexit.register(write, os.environ['DOPMETRICS'])
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
@@ -4,14 +4,20 @@
 	Combines a syntax and a morphology corpus. """
 
 from dopg import *
-from evalb import evalb
+from evalb import evalb, evalbfiles, scoresummary
 from nltk import UnsortedChartParser, InsideChartParser, NgramModel, Nonterminal, induce_pcfg, ProbabilisticTree
 from nltk.metrics.scores import precision, recall, f_measure
-from bitpar import BitParChartParser
+from bitpar import BitParChartParser, TracedJob
+from cky import CKYParser, Grammar
+from sexpr import readsexpr, unescape, leaves as sexprleaves
+from transform import transform
+from deadline import dummy
 from random import sample, seed
+from itertools import repeat
 from sys import argv
 from subprocess	import Popen
 import re
+import metrics
 seed()
 
 def chapelitoj(word): #todo: replace capitals as well Ĉ Ĝ Ĥ Ĵ Ŝ Ŭ
@@ -25,19 +31,12 @@ def malchapelitoj(word): #todo: replace capitals as well Ĉ Ĝ Ĥ Ĵ Ŝ Ŭ
 def forcepos(tree):
 	""" make sure all terminals have POS tags; 
 	invent one if necessary ("parent_word") """
-	result = tree.copy(True)
-	for a in tree.treepositions('leaves'):
-		if len(tree[a[:-1]]) != 1:
-			result[a] = Tree("%s_%s" % (tree[a[:-1]].node, tree[a]), [tree[a]])
-	return result
+	return transform(tree, forcepos=True, node=Tree)
 
 def stripfunc(tree):
 	""" strip all function labels from a tree with labels of
 	the form "function:form", eg. S:np for subject, np. """
-	for a in tree.treepositions():
-		if isinstance(tree[a], Tree) and ':' in tree[a].node and len(tree[a].node.split(':')[1]):
-			tree[a].node = tree[a].node.split(':')[1].replace("-", "_")
-	return tree
+	return transform(tree, stripfunc=True, inplace=True)
 
 def dos(words):
 	""" `Data-Oriented Segmentation 1': given a sequence of segmented words
@@ -140,41 +139,63 @@ def segmentor(segmentd):
 		return f
 	return s(segmentd)
 
-def morphmerge(tree, md, segmented):
-	""" merge morphology into phrase structure tree """
-	copy = tree.copy(True)
-	for a,w in zip(tree.treepositions('leaves'), segmented):
-		try:
-			#copy[a[:-1]] = md.mostprobableparse(w)[0]
-			# insert a word boundary
-			copy[a[:-1]] = Tree(copy[a[:-1]].node, 
-								[md.mostprobableparse(w)[0], Tree("_", ["_"])])
-		except ValueError as e:
-			print "word:", tree[a[:-1]][0], "segmented", w, e
-	return copy
+def morphmerge(tree, md, segmented, analyses=None):
+	""" merge morphology into phrase structure tree
 
-def morphology(train, top='S'):
-	""" generates three DOP models for a given list of phrase structure trees:
-	a syntax model, a morphology model, and a combined syntax and morphology
-	model """ 
-	from cPickle import dump, load
-	d = GoodmanDOP((Tree(malchapelitoj(a)) for a in train), cnf=True, rootsymbol=top,
-		parser=BitParChartParser, n=100, unknownwords='unknownwordsm',
-		openclassdfsa='pos.dfsa', name='syntax', cleanup=False)
-	print "built syntax model"
+	@param analyses: None, or a dictionary with the analysis of each
+		segmented word by the morphology model (a tree, or the exception it
+		raised), eg. as parsed concurrently by analyze(); md is not used
+		then. """
+	with metrics.timer("morphmerge"):
+		copy = tree.copy(True)
+		for a,w in zip(tree.treepositions('leaves'), segmented):
+			try:
+				if analyses is None: analysis = md.mostprobableparse(w)
+				else: analysis = analyses[w]
+				if isinstance(analysis, Exception): raise analysis
+				#copy[a[:-1]] = analysis[0]
+				# insert a word boundary
+				copy[a[:-1]] = Tree(copy[a[:-1]].node, 
+									[analysis[0], Tree("_", ["_"])])
+			except ValueError as e:
+				metrics.incr("morphmerge.unanalyzed")
+				print "word:", tree[a[:-1]][0], "segmented", w, e
+	return copy
 
-	mcorpus = map(malchapelitoj, open("morph.corp.txt").readlines())
-	md = GoodmanDOP((forcepos(Tree(a)) for a in mcorpus), rootsymbol='W',
+def syntaxmodel(train, top='S', name='syntax', directory='/tmp',
+		unknownwords='unknownwordsm', dfsa='pos.dfsa'):
+	""" DOP model of syntax, given a list of trees in bracket notation.
+	unknownwords and dfsa are the files for bitpar's unknown word
+	handling; cf. wordclass.py to generate them from the treebank. """
+	return GoodmanDOP((Tree(malchapelitoj(a)) for a in train), cnf=True, rootsymbol=top,
+		parser=BitParChartParser, n=100, unknownwords=unknownwords,
+		openclassdfsa=dfsa, name=name, cleanup=False, directory=directory)
+
+def morphmodel(mcorpus, name='morphology', directory='/tmp'):
+	""" DOP model of morphology, given a morphology corpus with a tree in
+	bracket notation for each word. """
+	return GoodmanDOP((forcepos(Tree(a)) for a in mcorpus), rootsymbol='W',
 		wrap=True, parser=BitParChartParser, n=100, 
-		unknownwords='unknownmorph', name='morphology')
-	print "built morphology model"
+		unknownwords='unknownmorph', name=name, directory=directory)
 
+def morphsyntaxmodel(mtreebank, mcorpus, top='S', name='morphsyntax',
+		directory='/tmp'):
+	""" combined DOP model of morphology and syntax, given a treebank with
+	morphological analyses and the morphology corpus. """
+	# add morphology corpus to the elementary trees
+	mtreebank = list(mtreebank)
+	mtreebank.extend(forcepos(Tree(a)) for a in mcorpus)
+	return GoodmanDOP(mtreebank, rootsymbol=top, cnf=True, parser=BitParChartParser, 
+		n=100, unknownwords='unknownmorph', name=name, cleanup=False,
+		directory=directory)
+
+def segmentation(mcorpus):
+	""" returns a segmentation dictionary of the words in the morphology
+	corpus. """
 	#try:
 	#	segmentd = load(open("segmentd.pickle", "rb"))
 	#except:
 	segmentd = dict(("".join(a), tuple(a)) for a in (Tree(a).leaves() for a in mcorpus))
-	print "segmentation dictionary size:", len(segmentd)
-	mlexicon = set(reduce(chain, segmentd.values()))
 
 	"""
 	segmentd = dos1(set(segmentd.values()))
@@ -184,23 +205,50 @@ def morphology(train, top='S'):
 	print "extrapolated:", len(segmentd) #, " ".join(segmentd.keys())
 	dump(segmentd, open('segmentd.pickle', 'wb'), protocol=-1)
 	"""
+	return segmentd
+
+def analyzemorphology(train, md, segment):
+	""" add morphological analyses to the words of a list of trees in
+	bracket notation """
+	mtreebank = []
+	for n, a in enumerate(Tree(a) for a in train):
+		print '%d / %d:' % (n, len(train)-1),
+		mtreebank.append(forcepos(morphmerge(a, md, map(segment, a.leaves()))))
+		print
+	return mtreebank
+
+def morphology(train, top='S', name='', prefix='arbobanko', directory='/tmp'):
+	""" generates three DOP models for a given list of phrase structure trees:
+	a syntax model, a morphology model, and a combined syntax and morphology
+	model
+
+		@param name: suffix for the names of the grammar files, so that
+			models of different experiments can coexist.
+		@param prefix: file name prefix of the corpus; the morphological
+			analysis of the treebank is cached in prefix.train.morph
+		@param directory: where to write the grammar files """ 
+	from cPickle import dump, load
+	d = syntaxmodel(train, top, 'syntax' + name, directory)
+	print "built syntax model"
+
+	mcorpus = map(malchapelitoj, open("morph.corp.txt").readlines())
+	md = morphmodel(mcorpus, 'morphology' + name, directory)
+	print "built morphology model"
+
+	segmentd = segmentation(mcorpus)
+	print "segmentation dictionary size:", len(segmentd)
+	mlexicon = set(reduce(chain, segmentd.values()))
 	segment = segmentor(segmentd)
 	
 	try:
-		mtreebank = map(Tree, open("arbobanko.train.morph").readlines())
+		mtreebank = map(Tree, open(prefix + ".train.morph").readlines())
 	except:
 		print "analyzing morphology of treebank"
-		mtreebank = []
-		for n, a in enumerate(Tree(a) for a in train):
-			print '%d / %d:' % (n, len(train)-1),
-			mtreebank.append(forcepos(morphmerge(a, md, map(segment, a.leaves()))))
-			print
-		open("arbobanko.train.morph", "w").writelines(a._pprint_flat("", "()", 
+		mtreebank = analyzemorphology(train, md, segment)
+		open(prefix + ".train.morph", "w").writelines(a._pprint_flat("", "()", 
 			"") + "\n" for a in mtreebank)
-	# add morphology corpus to the elementary trees
-	mtreebank.extend(forcepos(Tree(a)) for a in mcorpus)
-	msd = GoodmanDOP(mtreebank, rootsymbol=top, cnf=True, parser=BitParChartParser, 
-		n=100, unknownwords='unknownmorph', name='morphsyntax', cleanup=False)
+	msd = morphsyntaxmodel(mtreebank, mcorpus, top, 'morphsyntax' + name,
+		directory)
 	print "built combined morphology-syntax model"
 
 	return d, md, msd, segment, mlexicon
@@ -268,9 +316,98 @@ def toy():
 			try: print guess(a[:-1])
 			except: print "( %s)" % a[:-1].lower()
 
+def mostprobableparses(parser, sents, n=100, deadline=None):
+	""" the most probable parse of each of a sequence of sentences, which
+	are parsed at once (eg. all the words of a sentence with the
+	morphology model, in one round trip to its bitpar process, cf.
+	BitParChartParser.nbest_many); a ValueError instead of a tree for the
+	sentences without a parse.
+	The derivations are summed as ParseTrees (cf.
+	GoodmanDOP.mostprobableparse); only the best tree is converted to nltk.
+	"""
+	results = []
+	many = getattr(parser, 'nbest_many', parser.batch_nbest)
+	for derivations in many(sents, n, deadline=deadline):
+		p = {}
+		for prob, tree in derivations:
+			tree = tree.removeids()
+			p[tree] = p.get(tree, 0.0) + prob
+		if p:
+			tree = max(p, key=p.get)
+			results.append(tree.totree(p[tree]))
+		else: results.append(ValueError("no parse"))
+	return results
+
+def concurrently(tasks):
+	""" call functions in threads; yields (name, result) tuples in the order
+	in which they complete, where result is the return value of the
+	function, or the exception it raised.
+
+	@param tasks: a dictionary of functions without arguments
+
+	>>> from time import sleep
+	>>> list(concurrently(dict(slow=lambda: sleep(0.2) or 1,
+	... fast=lambda: 2, error=lambda: 1/0)))[-1]
+	('slow', 1)
+	"""
+	from threading import Thread
+	from Queue import Queue
+	queue = Queue()
+	def run(name, function):
+		try: result = function()
+		except Exception as e: result = e
+		queue.put((name, result))
+	for name, function in tasks.items():
+		thread = Thread(target=run, args=(name, function))
+		thread.daemon = True
+		thread.start()
+	for _ in tasks: yield queue.get()
+
+def analyze(w, d, md, msd, segment, deadline=None):
+	""" parse a sentence with the syntax, morphology and combined models
+	concurrently: each model has its own bitpar process, and the words are
+	analyzed by the morphology model all at once. Yields (name, result)
+	tuples as the analyses complete, where result is a tree or the
+	exception raised: "morphology", a list with the analysis of each word;
+	"combined"; "syntax"; and "separate", the syntax tree with the
+	morphology merged into it, once both of these are done.
+	The time taken is that of the slowest model, instead of the sum of all
+	of them.
+
+	@param d, md, msd: the models of morphology() (GoodmanDOP instances);
+		they must have separate parsers, since a bitpar process handles
+		one request at a time
+	@param deadline: None, or a time after which the models give up """
+	segmented = map(segment, w)
+	def combined():
+		sent = list(reduce(chain, (a + ('_',) for a in segmented)))
+		t = removeids(msd.mostprobableparse(sent, deadline=deadline))
+		t.un_chomsky_normal_form()
+		return t
+	def syntax():
+		t = removeids(d.mostprobableparse(w, deadline=deadline))
+		t.un_chomsky_normal_form()
+		return t
+	done = {}
+	for name, result in concurrently(dict(combined=combined, syntax=syntax,
+			morphology=lambda: mostprobableparses(md.parser, segmented,
+			deadline=deadline))):
+		done[name] = result
+		yield name, result
+		if name in ("morphology", "syntax") and "morphology" in done and (
+				"syntax" in done):
+			if isinstance(done["syntax"], Exception):
+				yield "separate", done["syntax"]
+			elif isinstance(done["morphology"], Exception):
+				yield "separate", done["morphology"]
+			else:
+				yield "separate", morphmerge(done["syntax"], md, segmented,
+					dict(zip(segmented, done["morphology"])))
+
 def interface():
 	from corpus import corpus
-	train = [forcepos(stripfunc(Tree(a.lower()))) for a in open("arbobanko.train")]
+	train = [transform(readsexpr(a.lower(), Tree), stripfunc=True,
+		forcepos=True, inplace=True) for a in open("arbobanko.train")]
 	train = [a._pprint_flat("","()",0) for a in train]
 	d, md, msd, segment, lexicon = morphology(train, top="top")
 
@@ -283,57 +420,55 @@ def interface():
 		w = raw_input().split()
 		if not w: break	#quit
 
-		print "morphology:"
-		for a in w:
-			try:
-				print a, md.mostprobableparse(segment(a))[0]
-			except Exception as e:
-				print "error:", e
-			
-		print "morphology + syntax combined:"
-		try:
-			sent = list(reduce(chain, (segment(a) + ('_',) for a in w)))
-			print sent
-			t = msd.removeids(msd.mostprobableparse(sent))
-			t.un_chomsky_normal_form()
-			print t
-			#for tree in d.parser.nbest_parse(w):
-			#	print tree
-		except Exception as e:
-			print "error", e
-
-		print "syntax & morphology separate:"
-		try:
-			#TODO?: d.parse(w) should backoff to POS supplied by morphology for
-			#unknown words; but bitpar already does this with its word class
-			#automata support
-			print w
-			t = d.removeids(d.mostprobableparse(w))
-			t.un_chomsky_normal_form()
-			print "syntax", t
-			t = morphmerge(t, md, map(segment, w))
-			print t
-			#sent = ["".join(a.split('|')) for a in w]
-			#for tree in d.parser.nbest_parse(w):
-			#	print tree
-		except Exception as e:
-			print "error", e
-
-def monato():
-	""" produce the goodman reduction of the monato corpus """
-	#splitting has already been done. TODO: split here?
-	train = [forcepos(stripfunc(Tree(a.lower()))) for a in open("arbobanko.train")]
-
-	# surface forms:
-	test = ["%s\n\n" % "\n".join(Tree(a.lower()).leaves()) 
-				for a in open("arbobanko.gold")]
-	open("arbobanko.test", "w").writelines(test)
-	test = [Tree(a.lower()).leaves() for a in open("arbobanko.gold")]
-
-	gold = [stripfunc(forcepos(Tree(a.lower()))) 
-				for a in open("arbobanko.gold")]
+		# the models parse concurrently; print each analysis when it is done
+		#TODO?: d.parse(w) should backoff to POS supplied by morphology for
+		#unknown words; but bitpar already does this with its word class
+		#automata support
+		for name, result in analyze(w, d, md, msd, segment):
+			if name == "morphology" and not isinstance(result, Exception):
+				print "morphology:"
+				for a, b in zip(w, result):
+					if isinstance(b, Exception): print a, "error:", b
+					else: print a, b[0]
+				continue
+			print {"morphology": "morphology:",
+				"combined": "morphology + syntax combined:",
+				"syntax": "syntax:",
+				"separate": "syntax & morphology separate:"}[name]
+			if isinstance(result, Exception): print "error", result
+			else: print result
+
+def readtrain(prefix="arbobanko", horzmarkov=None, vertmarkov=0):
+	""" read the training trees of the monato corpus. The trees are
+	binarized as written by split.writesplit(); when horzmarkov or
+	vertmarkov are given, they are binarized again with that Markovization
+	(cf. transform.transform()). """
+	train = [transform(readsexpr(a.lower(), Tree), stripfunc=True,
+		forcepos=True, inplace=True) for a in open(prefix + ".train")]
+	if horzmarkov is not None or vertmarkov:
+		for a in train:
+			a.un_chomsky_normal_form()
+			transform(a, cnf=True, horzmarkov=horzmarkov,
+				vertmarkov=vertmarkov, inplace=True)
+	return train
+
+def writetest(prefix="arbobanko"):
+	""" write the surface forms of the gold corpus in the format of bitpar,
+	returns the gold trees. """
+	gold = [readsexpr(a.lower(), Tree) for a in open(prefix + ".gold")]
+	open(prefix + ".test", "w").writelines("%s\n\n" % "\n".join(a.leaves())
+		for a in gold)
+	return [transform(a, stripfunc=True, forcepos=True, node=Tree)
+		for a in gold]
+
+def writetestmorph(goldm, prefix="arbobanko"):
+	""" write the surface forms of the gold corpus with morphology. """
+	testm = ["%s\n\n" % "\n".join(a.leaves()) for a in goldm]
+	open(prefix + ".test.morph", "w").writelines(testm)
 
-	print "inducing PCFG . . ."
+def pcfgrules(train):
+	""" the rules of the plain treebank PCFG with their frequencies, in the
+	format of BitParChartParser, and the lexicon. """
 	#pcfg = induce_pcfg(Nonterminal("top"), reduce(chain, (productions(a) for a in train)))
 	#p = InsideChartParser(pcfg)
 	def rule2str(a):
@@ -341,45 +476,113 @@ def monato():
 			return "%s\t%s" % (str(a.lhs()), "\t".join(map(str, a.rhs())))
 		return "%s\t%s" % (str(a.lhs()), str(a.rhs()))
 	weightedrules = FreqDist(reduce(chain, (map(rule2str, productions(a)) for a in train))).items()
-	p = BitParChartParser(weightedrules, set(reduce(chain, (a.leaves() for a in train))), "top", name='pcfgsyntax', cleanup=False, n=100, unknownwords='unknownwordsm', openclassdfsa='pos.dfsa')
+	return weightedrules, set(reduce(chain, (a.leaves() for a in train)))
+
+def pcfgmodel(train, top='top', name='pcfgsyntax', directory='/tmp',
+		unknownwords='unknownwordsm', dfsa='pos.dfsa'):
+	""" the plain treebank PCFG, for use as a baseline. """
+	weightedrules, lexicon = pcfgrules(train)
+	return BitParChartParser(weightedrules, lexicon, top, name=name, cleanup=False, n=100, unknownwords=unknownwords, openclassdfsa=dfsa, directory=directory)
+
+def coarsetofinemodel(train, top='top', threshold=1e-5):
+	""" DOP model of syntax parsed in-process with coarse-to-fine pruning:
+	the chart of the Goodman reduction is restricted to the constituents
+	with a posterior probability above threshold according to the plain
+	treebank PCFG. Expects a list of binarized trees (cf. readtrain); the
+	trees are used for the PCFG first, since GoodmanDOP modifies them. """
+	weightedrules, lexicon = pcfgrules(train)
+	coarse = Grammar(weightedrules, lexicon, top, 'unknownwordsm')
+	return GoodmanDOP(train, rootsymbol=top, cnf=True, parser=CKYParser,
+		unknownwords='unknownwordsm', coarse=coarse, threshold=threshold)
+
+def trainmonato(prefix="arbobanko", name="", directory="/tmp",
+		horzmarkov=None, vertmarkov=0):
+	""" produce the PCFG baseline and the goodman reductions of the monato
+	corpus, given the files prefix.train and prefix.gold produced by
+	split.py, binarized with the given Markovization (cf. readtrain()).
+	Also writes the test files for bitpar (prefix.test and
+	prefix.test.morph). Returns the PCFG parser and the result of
+	morphology(). """
+	train = readtrain(prefix, horzmarkov, vertmarkov)
+	# surface forms:
+	gold = writetest(prefix)
+
+	print "inducing PCFG . . ."
+	p = pcfgmodel(train, "top", 'pcfgsyntax' + name, directory)
 
 	print "inducing DOP reduction . . ."
 	train = [str(a._pprint_flat('', '()', '')) for a in train]
-	d, md, msd, segment, lexicon = morphology(train, "top")
+	d, md, msd, segment, lexicon = morphology(train, "top", name, prefix,
+		directory)
 	
 	try:
-		goldm = map(Tree, open("arbobanko.gold.morph").readlines())
+		goldm = map(Tree, open(prefix + ".gold.morph").readlines())
 	except:
 		print "adding morphology to gold corpus"
 		goldm = [morphmerge(a, md, map(segment, a.leaves())) for a in gold]
-		open("arbobanko.gold.morph", "w").writelines(a._pprint_flat("","()", 0) + "\n" for a in goldm)
-
-	testm = ["%s\n\n" % "\n".join(a.leaves()) for a in goldm]
-	open("arbobanko.test.morph", "w").writelines(testm)
-
-	print "parsing pcfg baseline"
-	p1 = Popen("bitpar -q -p -vp -b 10 -s top -u unknownwordsm -w pos.dfsa /tmp/gpcfgsyntax.pcfg /tmp/gpcfgsyntax.lex arbobanko.test arbobanko.results.pcfg".split())
-	print "parsing syntax"
-	p2 = Popen("bitpar -q -p -vp -b 1000 -s top -u unknownwordsm -w pos.dfsa /tmp/gsyntax.pcfg /tmp/gsyntax.lex arbobanko.test arbobanko.results".split())
-	print "parsing morphosyntax"
-	p3 = Popen("bitpar -q -p -vp -b 1000 -s top -u unknownmorph /tmp/gmorphsyntax.pcfg /tmp/gmorphsyntax.lex arbobanko.test.morph arbobanko.results.morph".split())
-
-	p1.wait()
-	print "processing results"
-	getbest("arbobanko.results.pcfg", "arbobanko.resproc.pcfg", "arbobanko.gold")
-	print "pcfg done"
-	p2.wait()
-	getbest("arbobanko.results", "arbobanko.resproc", "arbobanko.gold")
-	print "syntax done"
-	p3.wait()
-	getbest("arbobanko.results.morph", "arbobanko.resproc.morph", "arbobanko.gold.morph")
-	print "morph done"
-	# add morphology to arbobanko.resproc
-	out = open("arbobanko.resproc.sepmorph", "w")
-	for a in open("arbobanko.resproc").readlines():
+		open(prefix + ".gold.morph", "w").writelines(a._pprint_flat("","()", 0) + "\n" for a in goldm)
+
+	writetestmorph(goldm, prefix)
+	return p, d, md, msd, segment, lexicon
+
+def parsejobs(prefix="arbobanko", name="", directory="/tmp",
+		unknownwords='unknownwordsm', dfsa='pos.dfsa'):
+	""" the bitpar invocations parsing the test corpus with each model
+	produced by trainmonato(). Returns a list of tuples with the name of
+	the model, the command line (a list), the file with bitpar's output,
+	the file for the processed results, and the gold file. unknownwords
+	and dfsa are used for the syntax models (cf. syntaxmodel()). """
+	cmd = "bitpar -q -p -vp -b %d -s top %s %s/g%s.pcfg %s/g%s.lex %s %s"
+	syntaxopts = "-u %s -w %s" % (unknownwords, dfsa)
+	return [(model, (cmd % (n, opts, directory, grammar, directory, grammar,
+		test, results)).split(), results, resproc, gold)
+		for model, grammar, n, opts, test, results, resproc, gold in (
+			("pcfg", "pcfgsyntax" + name, 10, syntaxopts,
+				prefix + ".test", prefix + ".results.pcfg",
+				prefix + ".resproc.pcfg", prefix + ".gold"),
+			("syntax", "syntax" + name, 1000, syntaxopts,
+				prefix + ".test", prefix + ".results",
+				prefix + ".resproc", prefix + ".gold"),
+			("morphsyntax", "morphsyntax" + name, 1000, "-u unknownmorph",
+				prefix + ".test.morph", prefix + ".results.morph",
+				prefix + ".resproc.morph", prefix + ".gold.morph"))]
+
+def monato(prefix="arbobanko", name="", directory="/tmp", timeout=None):
+	""" produce the goodman reduction of the monato corpus, parse the test
+	corpus with each model and evaluate the results. When tracing (cf.
+	metrics.starttrace), the time of each sentence is recorded.
+	With a timeout (in seconds per sentence), sentences taking longer are
+	abandoned (cf. TracedJob); for the DOP model they fall back to the
+	parse of the PCFG, and else to a baseline tree. """
+	#splitting has already been done. TODO: split here?
+	p, d, md, msd, segment, lexicon = trainmonato(prefix, name, directory)
+
+	procs = []
+	for model, cmd, results, resproc, gold in parsejobs(prefix, name,
+			directory):
+		print "parsing", model
+		if metrics.tracing or timeout is not None:
+			proc = TracedJob(model, cmd, timeout)
+		else: proc = Popen(cmd)
+		procs.append((model, proc, results, resproc, gold))
+
+	for model, proc, results, resproc, gold in procs:
+		proc.wait()
+		print "processing results"
+		# the pcfg is first, so its results are complete at this point
+		counts = getbest(results, resproc, gold, fallback=prefix
+			+ ".results.pcfg" if model == "syntax" else None)
+		print "%s done; %s" % (model, ", ".join("%s: %d" % a
+			for a in sorted(counts.items())))
+	for model, proc, results, resproc, gold in procs:
+		sents, scores = evalbfiles(gold, resproc, maxerror=1000)
+		print "%s: %s" % (model, scoresummary(scores))
+	# add morphology to prefix.resproc
+	out = open(prefix + ".resproc.sepmorph", "w")
+	for a in open(prefix + ".resproc").readlines():
 		try:
-			t = Tree(a)
-		except:
+			t = readsexpr(a, Tree)
+		except ValueError:
 			t = None
 		if t:
 			out.write(forcepos(morphmerge(t, md, map(segment, t.leaves())))._pprint_flat("", "()", "") + "\n")
@@ -389,48 +592,50 @@ def monato():
 	
 def removeids(tree):
 	""" remove unique IDs introduced by the Goodman reduction """
-	result = Tree.convert(tree)
-	for a in tree.treepositions():
-		if '@' in str(tree[a]):
-			result[a].node = tree[a].node.split('@')[0]
-	return result
+	return transform(tree, removeids=True, node=Tree)
 
 def trymap(f, list):
 	for a in list:
 		try: yield f(a)
 		except: pass
 
-def getbest(infile, outfile, gold):
+def getbest(infile, outfile, gold, fallback=None):
 	""" process output of bitpar, remove ids from parse trees and choose
-	the ones with highest probability. """
-	def dummy(leaves):
-		""" construct a right-branching baseline tree. """
-		if leaves:
-			return "(np (prop %s) %s)" % (leaves[0], dummy(leaves[1:]))
-		return ''
+	the ones with highest probability. Sentences without a parse (or which
+	timed out, cf. TracedJob) get the best parse in the output of bitpar
+	for another model (fallback, eg. the PCFG), if any, and otherwise a
+	right-branching baseline tree. Returns the number of sentences for
+	each of these levels. """
 	def rep(a):
-		#tree = Tree(re.sub(r"\\([{}\[\]<>'])", r"\1", a._pprint_flat("","()",0)))
-		tree = Tree(re.sub(r"\\([{}\[\]<>'])", r"\1", a))
+		tree = readsexpr(unescape(a), Tree)
 		tree.un_chomsky_normal_form()
 		return tree._pprint_flat("","()","") + "\n"
-
-	results = []
-	for result, leaves in zip(open(infile).read().split("\n\n")[:-1], 
-		map((lambda a: Tree(a).leaves()), open(gold).readlines())):
+	def best(result):
 		result = result.splitlines()
-		if "No parse" in result[0]:
-			results.append("(top %s)\n" % dummy(leaves))
-			continue
+		if not result or "No parse" in result[0]: return None
 		probs = (float(a.split("=")[1]) for a in result[::2])
 		trees = result[1::2]
 		p = FreqDist()
 		for a,b in zip(trees, probs):
 			p.inc(re.sub(r"@[0-9]+", "", a), b)
-		if p.max():
-			results.append(rep(p.max()))
+		if p.max(): return rep(p.max())
+
+	results, counts = [], dict(parse=0, fallback=0, dummy=0)
+	if fallback: fallback = open(fallback).read().split("\n\n")[:-1]
+	else: fallback = repeat('')
+	for result, alternative, leaves in zip(
+		open(infile).read().split("\n\n")[:-1], fallback,
+		(sexprleaves(readsexpr(a)) for a in open(gold))):
+		for level, tree in (("parse", result), ("fallback", alternative)):
+			tree = best(tree)
+			if tree: break
 		else:
-			results.append("(top %s)\n" % dummy(leaves))
+			level, tree = "dummy", "(top %s)\n" % dummy(leaves)
+		results.append(tree)
+		counts[level] += 1
+		metrics.incr("getbest.%s" % level)
 	open(outfile, "w").writelines(results)
+	return counts
 
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+""" Dependency-aware pipeline for the experiment of runexp.sh / monato(),
+with a cache of artifacts keyed by content hashes.
+
+Each stage declares its input and output files. The key of a stage is a
+hash of its name, its parameters and the contents of its inputs (which
+include the source files of the code it runs). When a stage with the same
+key has run before, it is skipped and its outputs are restored from the
+cache if they are missing or different. Stages run as soon as the stages
+producing their inputs are done, at most `workers' at a time, each in its
+own process. All files of a run (including the grammars) are written to
+its own working directory, so concurrent runs do not interfere.
+
+usage: python pipeline.py [-j workers] [-w workdir] [-c cachedir] [-s seed] corpus
+"""
+from multiprocessing import Process, cpu_count
+from threading import Thread, Condition, BoundedSemaphore
+from subprocess import Popen
+from hashlib import sha1
+from getopt import getopt
+from sys import argv, stderr
+import os, shutil, tempfile
+
+class Stage:
+	def __init__(self, name, inputs, outputs, function=None, args=(),
+			cmd=None):
+		""" a step of a pipeline.
+
+		@param inputs: the files this stage reads. Files that are not
+			produced by another stage have to exist beforehand.
+		@param outputs: the files this stage produces.
+		@param function: a function that will be called with args in a
+			separate process.
+		@param cmd: alternatively, a command line (a list of strings). """
+		self.name = name
+		self.inputs = list(inputs)
+		self.outputs = list(outputs)
+		self.function = function
+		self.args = args
+		self.cmd = cmd
+	def __repr__(self):
+		return "Stage(%r)" % self.name
+
+	def run(self):
+		""" run this stage, returns True if it succeeded and produced all of
+		its outputs. """
+		if self.cmd:
+			proc = Popen(self.cmd)
+			returncode = proc.wait()
+		else:
+			proc = Process(target=self.function, args=self.args)
+			proc.start()
+			proc.join()
+			returncode = proc.exitcode
+		if returncode:
+			stderr.write("%s: exit code %d\n" % (self.name, returncode))
+			return False
+		missing = [a for a in self.outputs if not os.path.exists(a)]
+		if missing:
+			stderr.write("%s: missing outputs %s\n" % (self.name,
+				", ".join(missing)))
+			return False
+		return True
+
+class Cache:
+	def __init__(self, directory='.cache'):
+		""" a cache of stage outputs, with a subdirectory for each
+		stage key. """
+		self.directory = directory
+		self.hashes = {}
+		if not os.path.exists(directory): os.makedirs(directory)
+
+	def filehash(self, filename):
+		""" sha1 of the contents of a file, memoized on modification time
+		and size. """
+		st = os.stat(filename)
+		key = (filename, st.st_mtime, st.st_size)
+		if key not in self.hashes:
+			h = sha1()
+			f = open(filename, 'rb')
+			for a in iter(lambda: f.read(1 << 20), ''): h.update(a)
+			f.close()
+			self.hashes[key] = h.hexdigest()
+		return self.hashes[key]
+
+	def key(self, stage):
+		""" the key of a stage given the current contents of its inputs. """
+		h = sha1(stage.name)
+		h.update(repr((stage.cmd, stage.args, stage.outputs,
+			stage.function and stage.function.__name__)))
+		for a in stage.inputs:
+			h.update("%s\t%s\n" % (a, self.filehash(a)))
+		return h.hexdigest()
+
+	def restore(self, key, stage):
+		""" copy the cached outputs of a stage to their destinations, if
+		they are not already there. returns False if there is no cached
+		result for key. """
+		path = os.path.join(self.directory, key)
+		if not os.path.exists(path): return False
+		for n, a in enumerate(stage.outputs):
+			cached = os.path.join(path, str(n))
+			if (not os.path.exists(a)
+					or self.filehash(a) != self.filehash(cached)):
+				shutil.copyfile(cached, a)
+		return True
+
+	def store(self, key, stage):
+		""" add the outputs of a stage to the cache; the directory is
+		renamed into place so that concurrent runs see either all outputs
+		or none. """
+		path = os.path.join(self.directory, key)
+		tmp = tempfile.mkdtemp(dir=self.directory)
+		for n, a in enumerate(stage.outputs):
+			shutil.copyfile(a, os.path.join(tmp, str(n)))
+		try: os.rename(tmp, path)
+		except OSError: shutil.rmtree(tmp)
+
+def run(stages, workers=None, cache=None):
+	""" run a list of stages respecting their dependencies; returns the
+	set of stages that failed (or could not run because a stage they
+	depend on failed). """
+	if workers is None: workers = cpu_count()
+	if cache is None: cache = Cache()
+	producer = {}
+	for stage in stages:
+		for a in stage.outputs:
+			if a in producer:
+				raise ValueError("%s produced by %r and %r" % (a,
+					producer[a], stage))
+			producer[a] = stage
+	deps = dict((stage, set(producer[a] for a in stage.inputs
+		if a in producer)) for stage in stages)
+	for stage in stages:
+		for a in stage.inputs:
+			if a not in producer and not os.path.exists(a):
+				raise ValueError("%r: input %s does not exist" % (stage, a))
+	budget = BoundedSemaphore(workers)
+	cond = Condition()
+	pending, running, done, failed = list(stages), set(), set(), set()
+
+	def worker(stage):
+		try:
+			key = cache.key(stage)
+			if cache.restore(key, stage):
+				print "%s: unchanged, skipped" % stage.name
+				ok = True
+			else:
+				print "%s: running" % stage.name
+				budget.acquire()
+				try: ok = stage.run()
+				finally: budget.release()
+				if ok: cache.store(key, stage)
+				print "%s: %s" % (stage.name, "done" if ok else "FAILED")
+		except Exception as e:
+			stderr.write("%s: %s\n" % (stage.name, e))
+			ok = False
+		cond.acquire()
+		running.discard(stage)
+		if ok: done.add(stage)
+		else: failed.add(stage)
+		cond.notify()
+		cond.release()
+
+	cond.acquire()
+	try:
+		while pending or running:
+			for stage in list(pending):
+				if deps[stage] & failed:
+					print "%s: skipped because of failed dependency" % stage.name
+					pending.remove(stage)
+					failed.add(stage)
+				elif deps[stage] <= done:
+					pending.remove(stage)
+					running.add(stage)
+					Thread(target=worker, args=(stage, )).start()
+			if running: cond.wait()
+			elif pending:
+				raise ValueError("circular dependencies: %r" % pending)
+	finally: cond.release()
+	return failed
+
+# the stages of the monato experiment
+CODE = ['morph.py', 'dopg.py', 'bitpar.py', 'split.py', 'evalb.py', 'sexpr.py',
+	'transform.py', 'treebank.py', 'cky.py', 'metrics.py',
+	'deadline.py', 'wordclass.py', 'esperantotagger.py']
+
+def splitstage(corpusfile, prefix, seed):
+	from random import seed as setseed
+	from split import readcorpus, split, writesplit
+	from morph import writetest
+	setseed(seed)
+	train, test = split(readcorpus(corpusfile))
+	writesplit(train, test, prefix)
+	# replace the test file with the lowercased surface forms
+	writetest(prefix)
+
+def wordclassstage(prefix):
+	""" the word class automaton and open class file for the syntax models,
+	estimated from the training corpus (cf. wordclass.py) """
+	from wordclass import wordclasses, ambiguity, classify
+	tokens, (delta, classes), dists = wordclasses(prefix + ".train",
+		prefix + ".dfsa", prefix + ".unknownwords")
+	flat = set(line.split()[0] for line in open("unknownwordsm")
+		if line.strip())
+	for name, tagsof in (("flat", lambda word: flat), ("word classes",
+			lambda word: dists[classify(word, delta, classes) - 1])):
+		print "%s: %.2f tags per rare word, correct tag among them for " \
+			"%.1f%%" % ((name, ) + ambiguity(tokens, tagsof))
+
+def grammarstage(model, prefix, directory):
+	from morph import (readtrain, pcfgmodel, syntaxmodel, morphmodel,
+		morphsyntaxmodel, malchapelitoj)
+	from nltk import Tree
+	# the unknown word files generated by the wordclass stage
+	unknown = prefix + ".unknownwords", prefix + ".dfsa"
+	if model == 'pcfgsyntax':
+		pcfgmodel(readtrain(prefix), 'top', model, directory,
+			*unknown).stop()
+	elif model == 'syntax':
+		train = [str(a._pprint_flat('', '()', '')) for a in readtrain(prefix)]
+		syntaxmodel(train, 'top', model, directory, *unknown).parser.stop()
+	elif model == 'morphsyntax':
+		mcorpus = map(malchapelitoj, open("morph.corp.txt").readlines())
+		mtreebank = map(Tree, open(prefix + ".train.morph").readlines())
+		morphsyntaxmodel(mtreebank, mcorpus, 'top', model,
+			directory).parser.stop()
+
+def morphstage(prefix, directory):
+	""" add morphological analyses to the train and gold corpora """
+	from morph import (readtrain, morphmodel, segmentation, segmentor,
+		analyzemorphology, morphmerge, writetestmorph, malchapelitoj)
+	from transform import transform
+	from nltk import Tree
+	mcorpus = map(malchapelitoj, open("morph.corp.txt").readlines())
+	md = morphmodel(mcorpus, 'morphology', directory)
+	segment = segmentor(segmentation(mcorpus))
+	train = [str(a._pprint_flat('', '()', '')) for a in readtrain(prefix)]
+	open(prefix + ".train.morph", "w").writelines(a._pprint_flat("", "()",
+		"") + "\n" for a in analyzemorphology(train, md, segment))
+	gold = [transform(Tree(a.lower()), stripfunc=True, forcepos=True,
+		inplace=True) for a in open(prefix + ".gold")]
+	goldm = [morphmerge(a, md, map(segment, a.leaves())) for a in gold]
+	open(prefix + ".gold.morph", "w").writelines(a._pprint_flat("","()", 0)
+		+ "\n" for a in goldm)
+	writetestmorph(goldm, prefix)
+	md.parser.stop()
+
+def scorestage(gold, resproc, out):
+	from evalb import evalb, readparam, report
+	param = readparam()
+	param['MAX_ERROR'] = 1000
+	sents, scores = evalb(open(gold).read().splitlines(),
+		open(resproc).read().splitlines(), param)
+	f = open(out, "w")
+	report(sents, scores, param, f)
+	f.close()
+
+def getbeststage(infile, outfile, gold):
+	from morph import getbest
+	getbest(infile, outfile, gold)
+
+def monatostages(corpusfile, workdir="work", seed=1):
+	""" the stages of the monato experiment: split, word classes for
+	unknown words, grammar extraction for each model, morphological
+	analysis, parsing, getbest and scoring. """
+	from morph import parsejobs
+	prefix = os.path.join(workdir, "arbobanko")
+	grammar = lambda model: [os.path.join(workdir, "g%s.%s" % (model, a))
+		for a in ("pcfg", "lex")]
+	stages = [
+		Stage("split", [corpusfile] + CODE,
+			[prefix + ".train", prefix + ".gold", prefix + ".test"],
+			splitstage, (corpusfile, prefix, seed)),
+		Stage("morphology", [prefix + ".train", prefix + ".gold",
+			"morph.corp.txt", "unknownmorph"] + CODE,
+			[prefix + ".train.morph", prefix + ".gold.morph",
+			prefix + ".test.morph"], morphstage, (prefix, workdir)),
+		Stage("wordclass", [prefix + ".train", "unknownwordsm"] + CODE,
+			[prefix + ".unknownwords", prefix + ".dfsa"], wordclassstage,
+			(prefix, ))]
+	unknown = [prefix + ".unknownwords", prefix + ".dfsa"]
+	stages.extend(Stage("grammar-" + model, [train, "morph.corp.txt"]
+			+ (unknown if model != "morphsyntax" else []) + CODE,
+			grammar(model), grammarstage, (model, prefix, workdir))
+		for model, train in (("pcfgsyntax", prefix + ".train"),
+			("syntax", prefix + ".train"),
+			("morphsyntax", prefix + ".train.morph")))
+	for model, cmd, results, resproc, gold in parsejobs(prefix, "", workdir,
+			*unknown):
+		# inputs: grammar, lexicon, test corpus, unknown words & dfsa
+		stages.append(Stage("parse-" + model, cmd[-4:-1] + [cmd[n + 1]
+			for n, a in enumerate(cmd) if a in ('-u', '-w')],
+			[results], cmd=cmd))
+		stages.append(Stage("getbest-" + model, [results, gold] + CODE,
+			[resproc], getbeststage, (results, resproc, gold)))
+		stages.append(Stage("score-" + model, [gold, resproc] + CODE,
+			[prefix + ".score." + model], scorestage,
+			(gold, resproc, prefix + ".score." + model)))
+	return stages
+
+def main():
+	opts, args = getopt(argv[1:], "j:w:c:s:")
+	opts = dict(opts)
+	if len(args) != 1:
+		print __doc__
+		return
+	workdir = opts.get('-w', "work")
+	if not os.path.exists(workdir): os.makedirs(workdir)
+	stages = monatostages(args[0], workdir, int(opts.get('-s', 1)))
+	failed = run(stages, int(opts['-j']) if '-j' in opts else None,
+		Cache(opts.get('-c', ".cache")))
+	for stage in stages:
+		if stage.name.startswith("score-") and stage not in failed:
+			print stage.name[len("score-"):]
+			print open(stage.outputs[0]).read()
+	if failed:
+		print "failed:", ", ".join(a.name for a in stages if a in failed)
+
+if __name__ == '__main__':
+	main()
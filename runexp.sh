@@ -1,6 +1,10 @@
 #!/bin/sh
 python split.py
-python morph.py
+python morph.py monato
 #fix lexicon
 sh dotest.sh
 sh doeval.sh
+# tenfold cross-validation of all models:
+#python crossval.py -k 10 ../arbobanko1.sexp
+# the same experiment as a cached pipeline, skipping unchanged stages:
+#python pipeline.py -w work ../arbobanko1.sexp
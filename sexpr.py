@@ -0,0 +1,226 @@
+#!/usr/bin/python
+""" A reader and writer for trees in bracket notation (s-expressions), in
+the formats used in this project: the one tree per line files written with
+Tree._pprint_flat('', '()', ''), and the output of bitpar, which escapes
+some characters with backslashes. Trees are read with a single regular
+expression and a stack, either as nltk Trees, as nested tuples
+(label, children), where children is a tuple of trees and strings, or as
+ParseTrees.
+
+A ParseTree is a compact immutable tree used for the n-best results of the
+parsers and their aggregation in GoodmanDOP.mostprobableparse: its labels
+and words are interned, and its hash is computed once, so that summing the
+probabilities of thousands of derivations of a sentence does not build and
+walk nltk Trees (lists) for each of them. Trees are converted to nltk only
+when they are returned (cf. ParseTree.totree).
+
+usage: python sexpr.py [-r repeats] [treebank]
+	benchmark the reader against nltk's Tree() on a treebank with one tree
+	per line (default: arbobanko.train).
+"""
+from time import time
+from getopt import getopt
+from sys import argv
+import re
+
+tokenize = re.compile(r"\(|\)|[^\s()]+").findall
+# bitpar escapes these characters with a backslash
+escaped = re.compile(r"\\([/{}\[\]<>'\$])")
+# a terminal without preterminal, eg. "( :)", is read as "(: :)"
+unlabeled = re.compile(r"\( ([^\s()]+)\)")
+
+def unescape(line):
+	""" remove the escaping of bitpar output
+
+	>>> print unescape(r"(S (NP \\{mary\\}) (VP walks))")
+	(S (NP {mary}) (VP walks))
+	"""
+	if "\\" in line: return escaped.sub(r"\1", line)
+	return line
+
+def readsexpr(line, node=None):
+	""" read a tree in bracket notation. Raises ValueError for an empty
+	line or unbalanced parentheses.
+
+	@param node: a function to construct a node given its label and a list
+		of children, eg. nltk.Tree; by default nodes are tuples
+		(label, children).
+
+	>>> readsexpr("(S (NP mary) (VP walks) (. ))")
+	('S', (('NP', ('mary',)), ('VP', ('walks',)), ('.', ())))
+	>>> readsexpr("(top ( :) (np x))")
+	('top', ((':', (':',)), ('np', ('x',))))
+	>>> readsexpr("\\n")
+	Traceback (most recent call last):
+	ValueError: empty line
+	"""
+	if "( " in line: line = unlabeled.sub(r"(\1 \1)", line)
+	stack = [[]]
+	label = False
+	for a in tokenize(line):
+		if a == '(':
+			# a node without a label, eg. "((S ...))"
+			if label: stack[-1].append('')
+			stack.append([])
+			label = True
+		elif a == ')':
+			if label: stack[-1].append('')
+			label = False
+			children = stack.pop()
+			if not stack: raise ValueError("unbalanced parentheses: %s" % line)
+			if node is None:
+				stack[-1].append((children[0], tuple(children[1:])))
+			else: stack[-1].append(node(children[0], children[1:]))
+		else:
+			stack[-1].append(a)
+			label = False
+	if len(stack) != 1 or len(stack[0]) > 1:
+		raise ValueError("unbalanced parentheses: %s" % line)
+	if not stack[0]: raise ValueError("empty line")
+	return stack[0][0]
+
+def symbol(a):
+	""" intern a label or word of a ParseTree, so that equal strings are
+	shared. The builtin intern() frees strings that are no longer used,
+	so that a long-running process does not keep every word it has seen;
+	it only accepts byte strings, so unicode strings are not shared. """
+	if type(a) is str: return intern(a)
+	return a
+
+# sets the attributes of a ParseTree, bypassing its __setattr__
+initialize = object.__setattr__
+
+class ParseTree(object):
+	""" an immutable tree with a label and a tuple of children (ParseTrees
+	and strings).
+
+	>>> a = readsexpr("(S (NP@1 mary) (VP@2 walks))", ParseTree)
+	>>> b = readsexpr("(S (NP@3 mary) (VP walks))", ParseTree)
+	>>> a == b, a.removeids() == b.removeids()
+	(False, True)
+	>>> print a.removeids()
+	(S (NP mary) (VP walks))
+	>>> a.leaves(), a[0].label, len(a)
+	(['mary', 'walks'], 'NP@1', 2)
+	>>> print a.totree(prob=0.5)
+	(S (NP@1 mary) (VP@2 walks)) (p=0.5)
+	>>> a.label = 'VP'
+	Traceback (most recent call last):
+	AttributeError: ParseTree is immutable
+	"""
+	__slots__ = ('label', 'children', 'hash')
+	def __init__(self, label, children):
+		label = symbol(label)
+		children = tuple([a if type(a) is ParseTree
+			else symbol(a) for a in children])
+		initialize(self, 'label', label)
+		initialize(self, 'children', children)
+		initialize(self, 'hash', hash((label, children)))
+	def __setattr__(self, name, value):
+		raise AttributeError("ParseTree is immutable")
+	def __hash__(self):
+		return self.hash
+	def __eq__(self, other):
+		if self is other: return True
+		return (isinstance(other, ParseTree) and self.hash == other.hash
+			and self.label == other.label and self.children == other.children)
+	def __ne__(self, other):
+		return not self == other
+	def __len__(self):
+		return len(self.children)
+	def __iter__(self):
+		return iter(self.children)
+	def __getitem__(self, n):
+		return self.children[n]
+	def __str__(self):
+		return writesexpr((self.label, self.children))
+	def __repr__(self):
+		return "ParseTree(%r, %r)" % (self.label, self.children)
+	def leaves(self):
+		return leaves((self.label, self.children))
+	def removeids(self):
+		""" a copy without the IDs of the Goodman reduction (cf.
+		transform.relabeler) """
+		return ParseTree(self.label.rsplit('@', 1)[0] if '@' in self.label
+			else self.label, [a.removeids() if isinstance(a, ParseTree)
+			else a for a in self.children])
+	def totree(self, prob=None):
+		""" convert to an nltk Tree, or a ProbabilisticTree if a probability
+		is given """
+		from nltk import Tree, ProbabilisticTree
+		children = [totree(a) for a in self.children]
+		if prob is None: return Tree(self.label, children)
+		return ProbabilisticTree(self.label, children, prob=prob)
+
+def writesexpr(tree):
+	""" write a tuple tree (or a ParseTree) in bracket notation, as
+	Tree._pprint_flat does.
+
+	>>> writesexpr(readsexpr("(S (NP mary) (VP walks) (. ))"))
+	'(S (NP mary) (VP walks) (. ))'
+	"""
+	if isinstance(tree, basestring): return tree
+	if isinstance(tree, ParseTree): tree = tree.label, tree.children
+	return "(%s %s)" % (tree[0], " ".join(map(writesexpr, tree[1])))
+
+def leaves(tree):
+	""" the terminals of a tuple tree (or a ParseTree)
+
+	>>> leaves(readsexpr("(S (NP mary) (VP walks))"))
+	['mary', 'walks']
+	"""
+	result, agenda = [], [tree]
+	while agenda:
+		a = agenda.pop()
+		if isinstance(a, basestring): result.append(a)
+		elif isinstance(a, ParseTree): agenda.extend(reversed(a.children))
+		else: agenda.extend(reversed(a[1]))
+	return result
+
+def totree(tree):
+	""" convert a tuple tree (or a ParseTree) to an nltk Tree """
+	from nltk import Tree
+	if isinstance(tree, basestring): return tree
+	if isinstance(tree, ParseTree): tree = tree.label, tree.children
+	return Tree(tree[0], map(totree, tree[1]))
+
+def benchmark(filename, repeats=3):
+	""" time nltk's Tree() against readsexpr() on a treebank, and check
+	that they produce the same trees (apart from the "( :)" fixup). """
+	from nltk import Tree
+	lines = [a for a in open(filename).read().splitlines() if a.strip()]
+	def timeit(f):
+		best = None
+		for _ in range(repeats):
+			begin = time()
+			for a in lines: f(a)
+			if best is None or time() - begin < best: best = time() - begin
+		return best
+	print "%d trees, best of %d runs" % (len(lines), repeats)
+	baseline = timeit(Tree)
+	print "%-24s %8.2f us per tree" % ("Tree()", 1e6 * baseline / len(lines))
+	for name, f in (("readsexpr(a, Tree)", lambda a: readsexpr(a, Tree)),
+			("readsexpr(a, ParseTree)", lambda a: readsexpr(a, ParseTree)),
+			("readsexpr(a)", readsexpr)):
+		t = timeit(f)
+		print "%-24s %8.2f us per tree (%.1fx)" % (name,
+			1e6 * t / len(lines), baseline / t)
+	different = sum(1 for a in lines if "( " not in a and
+		Tree(a)._pprint_flat('', '()', '')
+		!= readsexpr(a, Tree)._pprint_flat('', '()', ''))
+	print "trees that differ from Tree():", different
+
+def main():
+	opts, args = getopt(argv[1:], "r:")
+	opts = dict(opts)
+	benchmark(args[0] if args else "arbobanko.train", int(opts.get('-r', 3)))
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	main()
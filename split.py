@@ -1,37 +1,88 @@
 #!/usr/bin/python
 from nltk import Tree
-from random import sample
-from morph import forcepos, stripfunc
+from random import sample, shuffle
+from sexpr import readsexpr
+from transform import transform
 
-print "splitting original corpus . . .",
+def readcorpus(filename, n=100):
+	""" read a treebank with one tree per line; select sents with at most n
+	words, add POS tags when necessary, strip function annotations
+	(SUBJ:np => np) """
+	corpus = [readsexpr(a, Tree) for a in open(filename)]
+	return [transform(a, stripfunc=True, forcepos=True, inplace=True)
+		for a in corpus if len(a.leaves()) <= n]
 
-n = 100		# at most n words
-s = 0.2		# take 20% for test corpus
+def split(corpus, s=0.2):
+	""" random split into a train and test corpus, taking a fraction s of
+	the trees for the test corpus. """
+	indices = range(len(corpus))
+	test = sample(indices, int(s * len(corpus)))
+	train = set(indices) - set(test)
+	return [corpus[a] for a in train], [corpus[a] for a in test]
 
-# read data
-corpus = open("../arbobanko1.sexp").readlines()
-corpus = map(Tree, corpus)
+def kfold(corpus, k=10):
+	""" yield k (train, test) splits such that each tree occurs in exactly
+	one test corpus. Each fold gets its own copies of the trees, since
+	writesplit() binarizes the training trees in place.
 
-# select sents with at most n words, add POS tags when necessary, 
-# strip function annotations (SUBJ:np => np)
-corpus = [stripfunc(forcepos(a)) for a in corpus if len(a.leaves()) <= n]
+	>>> folds = list(kfold(range(10), 5))
+	>>> len(folds), sorted(sum((test for train, test in folds), []))
+	(5, [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+	>>> all(set(train) | set(test) == set(range(10)) for train, test in folds)
+	True
 
-# split (tenfold?)
-indices = range(len(corpus))
-test = sample(indices, int(s * len(corpus)))
-train = set(indices) - set(test)
-test = [corpus[a] for a  in test]
-train = [corpus[a] for a  in train]
+	the gold trees of later folds are not binarized by earlier ones:
 
-#CNF
-for a in train:
-	a.chomsky_normal_form() #todo: sibling annotation necessary?
+	>>> import os, tempfile
+	>>> directory = tempfile.mkdtemp()
+	>>> corpus = [Tree("(S (A a) (B b) (C c))") for _ in range(4)]
+	>>> for n, (train, test) in enumerate(kfold(corpus, 2)):
+	...	writesplit(train, test, os.path.join(directory, "fold%d" % n))
+	>>> [a for a in open(os.path.join(directory, "fold1.gold"))
+	...	if "|<" in a]
+	[]
+	>>> "|<" in open(os.path.join(directory, "fold1.train")).read()
+	True
+	>>> for a in os.listdir(directory): os.remove(os.path.join(directory, a))
+	>>> os.rmdir(directory)
+	"""
+	def copy(a):
+		if isinstance(a, Tree): return a.copy(True)
+		return a
+	indices = range(len(corpus))
+	shuffle(indices)
+	for n in range(k):
+		test = set(indices[n::k])
+		yield ([copy(corpus[a]) for a in indices if a not in test],
+			[copy(corpus[a]) for a in indices if a in test])
 
-# write out
-open("../arbobanko.train", "w").write("\n".join(a._pprint_flat('', "()", "") for a in train).replace("( :)", "(: :)"))
-open("../arbobanko.gold", "w").write("\n".join(a._pprint_flat('', "()", "") for a in test).replace("( :)", "(: :)").lower())
-# bitpar wants one word per line, sents separated by two newlines
-open("../arbobanko.test", "w").write("\n\n".join("\n".join(a.leaves()) for a in test))
+def writesplit(train, test, prefix="../arbobanko", horzmarkov=None,
+		vertmarkov=0):
+	""" write out the train, gold and test files for a split; the training
+	trees are converted to CNF (destructively), with the given
+	Markovization (cf. transform.transform()). """
+	for a in train:
+		transform(a, cnf=True, horzmarkov=horzmarkov, vertmarkov=vertmarkov,
+			inplace=True)
+	open(prefix + ".train", "w").write("\n".join(a._pprint_flat('', "()", "") for a in train).replace("( :)", "(: :)"))
+	open(prefix + ".gold", "w").write("\n".join(a._pprint_flat('', "()", "") for a in test).replace("( :)", "(: :)").lower())
+	# bitpar wants one word per line, sents separated by two newlines
+	open(prefix + ".test", "w").write("\n\n".join("\n".join(a.leaves()) for a in test))
 
-# finis
-print "done"
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	print "splitting original corpus . . .",
+	# read data
+	corpus = readcorpus("../arbobanko1.sexp")
+	# split (for tenfold, see crossval.py)
+	train, test = split(corpus)
+	# write out
+	writesplit(train, test)
+	# finis
+	print "done"
@@ -0,0 +1,152 @@
+#!/usr/bin/python
+""" Tree normalizations applied in a single traversal: stripping function
+labels, adding POS tags to terminals without them, removing the IDs of the
+Goodman reduction, collapsing unary chains (as Tree.collapse_unary),
+binarization (as Tree.chomsky_normal_form) and adding IDs (as
+dopg.decorate_with_ids). Instead of a copy and a traversal per
+normalization, transform() builds the result in one top-down pass, either
+as a fresh tree or by editing the nodes of the given tree in place.
+
+Trees are nltk Trees or tuples (label, children) as read by sexpr.py.
+"""
+
+def relabeler(stripfunc=False, removeids=False):
+	""" a function transforming a label """
+	def relabel(label):
+		if removeids and '@' in label: label = label.rsplit('@', 1)[0]
+		# "function:form", eg. S:np for subject, np.
+		if stripfunc and ':' in label and label.split(':')[1]:
+			label = label.split(':')[1].replace("-", "_")
+		return label
+	return relabel
+
+def transform(tree, stripfunc=False, forcepos=False, removeids=False,
+		collapseunary=False, cnf=False, horzmarkov=None, vertmarkov=0,
+		ids=None, include_preterminals=True, node=None, inplace=False):
+	""" apply a combination of normalizations to a tree in one traversal.
+	Labels are transformed first, then terminals get POS tags, unary chains
+	are collapsed, the tree is binarized, and finally IDs are added. This
+	corresponds to decorate_with_ids(chomsky_normal_form(collapse_unary(
+	forcepos(stripfunc(tree))))).
+
+	@param stripfunc: strip function labels, eg. S:np => np (cf.
+		morph.stripfunc)
+	@param forcepos: make sure all terminals have POS tags; invent one if
+		necessary ("parent_word") (cf. morph.forcepos)
+	@param removeids: remove IDs introduced by the Goodman reduction
+	@param collapseunary: merge a node with a single child which is not a
+		preterminal into one node labeled "parent+child", except for the
+		root (as Tree.collapse_unary(); Tree.un_chomsky_normal_form()
+		expands these nodes again).
+	@param cnf: binarize nodes with more than two children by right
+		factoring, eg. A -> B C D becomes A -> B A|<C-D>, A|<C-D> -> C D.
+	@param horzmarkov: the number of siblings in the labels introduced by
+		binarization; by default all of them.
+	@param vertmarkov: the number of ancestors added to the labels of
+		nodes that are not preterminals (except for the root), eg.
+		NP^<S> with 1; by default none. (Tree.un_chomsky_normal_form()
+		removes them again.)
+	@param ids: an iterator yielding IDs. When given, a tuple with the tree
+		and a copy with IDs added to its nodes (except for the root and
+		word boundary markers) is returned (cf. dopg.decorate_with_ids).
+	@param node: a function constructing a node from its label and a list
+		of children, eg. nltk.Tree; by default nodes are tuples
+		(label, children).
+	@param inplace: reuse the nodes of the given (nltk) tree, which is
+		modified. Nodes are only created for new POS tags and
+		binarization.
+
+	>>> transform(('S', (('SUBJ:np', ('mary', 'smith')), ('P:v', ('walks',)),
+	... ('fA:adv', ('very', 'fast')))), stripfunc=True, forcepos=True, cnf=True)
+	('S', (('np', (('np_mary', ('mary',)), ('np_smith', ('smith',)))),
+	('S|<v-adv>', (('v', ('walks',)), ('adv', (('adv_very', ('very',)),
+	('adv_fast', ('fast',))))))))
+	>>> transform(('S', (('VP', (('V', ('walks',)),)),)), collapseunary=True)
+	('S', (('VP', (('V', ('walks',)),)),))
+	>>> transform(('S', (('NP', ('mary',)), ('VP', (('VP', (('V', ('walks',)),
+	... ('ADV', ('fast',)))),)))), collapseunary=True)
+	('S', (('NP', ('mary',)), ('VP+VP', (('V', ('walks',)), ('ADV', ('fast',))))))
+	>>> transform(('S', (('NP', ('mary',)), ('VP', (('V', ('walks',)),
+	... ('ADV', ('very', 'fast')), ('PP', ('today',)))))), cnf=True,
+	... horzmarkov=1, vertmarkov=1)
+	('S', (('NP', ('mary',)), ('VP^<S>', (('V', ('walks',)),
+	('VP|<ADV>^<S>', (('ADV', ('very', 'fast')), ('PP', ('today',))))))))
+	>>> from itertools import count
+	>>> transform(('S', (('NP', ('mary',)), ('VP', ('walks',)))), ids=count(1))[1]
+	('S', (('NP@1', ('mary',)), ('VP@2', ('walks',))))
+	"""
+	if tree is None: return None
+	relabel = relabeler(stripfunc, removeids)
+	if horzmarkov is None: horzmarkov = 999
+	if node is None:
+		if inplace: node = type(tree)
+		else: node = lambda label, children: (label, tuple(children))
+
+	def prepare(label, children):
+		""" the children of a node as (label, children, source node,
+		prepared, label for binarization) tuples or terminals. """
+		result = []
+		for a in children:
+			if isinstance(a, basestring):
+				if forcepos and len(children) != 1:
+					pos = "%s_%s" % (label, a)
+					result.append((pos, [a], None, False, pos))
+				else: result.append(a)
+			elif isinstance(a, tuple):
+				label1 = relabel(a[0])
+				result.append((label1, a[1], None, False, label1))
+			else:
+				label1 = relabel(a.node)
+				result.append((label1, a, a, False, label1))
+		return result
+
+	def visit(label, children, source, prepared, base, decorate, top=False,
+			parents=()):
+		kids = children if prepared else prepare(label, children)
+		while (collapseunary and not top and len(kids) == 1
+				and not isinstance(kids[0], basestring) and not kids[0][3]
+				and not all(isinstance(a, basestring) for a in kids[0][1])):
+			label = base = "%s+%s" % (label, kids[0][0])
+			kids = prepare(kids[0][0], kids[0][1])
+		# the ancestors of the children, nearest first
+		kidparents = parents if prepared else (label, ) + parents
+		if (vertmarkov and not top and parents and kids
+				and not isinstance(kids[0], basestring)):
+			annotation = "^<%s>" % "-".join(parents[:vertmarkov])
+			if not prepared: label += annotation
+		else: annotation = ""
+		if (ids is not None and decorate and not top and (include_preterminals
+				or any(not isinstance(a, basestring) for a in kids))):
+			ulabel = "%s@%d" % (label, ids.next())
+		else: ulabel = label
+		if cnf and len(kids) > 2:
+			kids = [kids[0], ("%s|<%s>%s" % (base, "-".join(a
+				if isinstance(a, basestring) else a[0]
+				for a in kids[1:1 + horzmarkov]), annotation),
+				kids[1:], None, True, base)]
+		results = [(a, a) if isinstance(a, basestring) else visit(*a,
+			decorate=decorate and not (top and a[0] == "_"),
+			parents=kidparents) for a in kids]
+		if inplace and source is not None:
+			source.node = label
+			source[:] = [a for a, _ in results]
+			result = source
+		else: result = node(label, [a for a, _ in results])
+		if ids is None: return result, None
+		return result, node(ulabel, [b for _, b in results])
+
+	if isinstance(tree, tuple): label, children, source = tree[0], tree[1], None
+	else: label, children, source = tree.node, tree, tree
+	label = relabel(label)
+	result, uresult = visit(label, children, source, False, label, True, True)
+	if ids is None: return result
+	return result, uresult
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
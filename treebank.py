@@ -0,0 +1,254 @@
+#!/usr/bin/python
+""" A compact binary treebank format. Labels and terminals are interned in
+a symbol table, and each tree is stored as a flat array of its nodes in
+preorder, with a (symbol id, number of children) pair per node; terminals
+have -1 children. A file is loaded with mmap, and trees are only decoded
+when they are accessed, as a flat tree: a tuple of the list of labels and
+the list of child counts. The functions on flat trees in this module
+(leaves, pos, productions, brackets, tokens) do not need nltk.
+
+File layout (integers are 32 bits, little endian):
+	header: magic, number of trees, number of nodes, number of symbols
+	offsets: the index of the first node of each tree, plus the total
+	nodes: a (symbol id, number of children) pair per node
+	symbols: the symbols separated by newlines
+
+usage: python treebank.py [-d] input output
+	convert a text treebank (one tree per line in bracket notation, eg.
+	arbobanko.train) to the binary format, or back with -d.
+"""
+from struct import Struct
+from array import array
+from mmap import mmap, ACCESS_READ
+from getopt import getopt
+from sys import argv, byteorder
+import re
+
+MAGIC = "TBK1"
+HEADER = Struct("<4sIII")
+
+tokenize = re.compile(r"\(|\)|[^\s()]+").findall
+
+def readtree(line):
+	""" convert a tree in bracket notation to a flat tree. A node without a
+	label gets the empty label; an empty line gives an empty tree.
+
+	>>> readtree("(S (NP mary) (VP walks))")
+	(['S', 'NP', 'mary', 'VP', 'walks'], [2, 1, -1, 1, -1])
+	"""
+	labels, arity = [], []
+	stack = []
+	tokens = tokenize(line)
+	n = 0
+	while n < len(tokens):
+		a = tokens[n]
+		if a == ')':
+			if not stack: raise ValueError("unbalanced parentheses: %s" % line)
+			stack.pop()
+		else:
+			if stack: arity[stack[-1]] += 1
+			if a == '(':
+				if n + 1 < len(tokens) and tokens[n + 1] not in '()':
+					label = tokens[n + 1]
+					n += 1
+				else: label = ''
+				stack.append(len(labels))
+				labels.append(label)
+				arity.append(0)
+			else:
+				labels.append(a)
+				arity.append(-1)
+		n += 1
+	if stack: raise ValueError("unbalanced parentheses: %s" % line)
+	return labels, arity
+
+def writetree(tree):
+	""" a flat tree in bracket notation, as produced by
+	Tree._pprint_flat('', '()', '').
+
+	>>> writetree(readtree("(S (NP mary) (VP walks) (. ))"))
+	'(S (NP mary) (VP walks) (. ))'
+	"""
+	labels, arity = tree
+	result, stack = [], []
+	for label, a in zip(labels, arity):
+		if stack: stack[-1] -= 1
+		if a == -1: result.append(" " + label)
+		elif a == 0: result.append(" (%s )" % label)
+		else:
+			result.append(" (" + label)
+			stack.append(a)
+		while stack and stack[-1] == 0:
+			stack.pop()
+			result.append(")")
+	return "".join(result)[1:]
+
+def tokens(tree):
+	""" the tokens of a flat tree in bracket notation, as produced by
+	evalb.tokenize
+
+	>>> tokens(readtree("(S (NP mary) (VP walks))"))
+	['(', 'S', '(', 'NP', 'mary', ')', '(', 'VP', 'walks', ')', ')']
+	"""
+	labels, arity = tree
+	result, stack = [], []
+	for label, a in zip(labels, arity):
+		if stack: stack[-1] -= 1
+		if a == -1: result.append(label)
+		else:
+			result.extend(('(', label))
+			stack.append(a)
+		while stack and stack[-1] == 0:
+			stack.pop()
+			result.append(')')
+	return result
+
+def children(tree):
+	""" the indices of the children of each node of a flat tree
+
+	>>> children(readtree("(S (NP mary) (VP walks))"))
+	[[1, 3], [2], [], [4], []]
+	"""
+	labels, arity = tree
+	result = [[] for _ in arity]
+	stack = []
+	for n, a in enumerate(arity):
+		if stack:
+			result[stack[-1]].append(n)
+			if len(result[stack[-1]]) == arity[stack[-1]]: stack.pop()
+		if a > 0: stack.append(n)
+	return result
+
+def leaves(tree):
+	labels, arity = tree
+	return [label for label, a in zip(labels, arity) if a == -1]
+
+def pos(tree):
+	""" the (word, tag) pairs of a flat tree; a terminal with siblings gets
+	the tag None. """
+	labels, arity = tree
+	return [(label, labels[n - 1] if arity[n - 1] == 1 else None)
+		for n, (label, a) in enumerate(zip(labels, arity)) if a == -1]
+
+def productions(tree):
+	""" the productions of a flat tree in preorder, as (lhs, rhs) tuples;
+	rhs has the labels of the children, terminals included.
+
+	>>> productions(readtree("(S (NP mary) (VP walks))"))
+	[('S', ('NP', 'VP')), ('NP', ('mary',)), ('VP', ('walks',))]
+	"""
+	labels, arity = tree
+	return [(labels[n], tuple(labels[m] for m in a))
+		for n, a in enumerate(children(tree)) if arity[n] != -1]
+
+def brackets(tree):
+	""" the constituents of a flat tree as (label, start, end) tuples, in
+	postorder; preterminals and nodes without children are included.
+
+	>>> brackets(readtree("(S (NP mary) (VP walks))"))
+	[('NP', 0, 1), ('VP', 1, 2), ('S', 0, 2)]
+	"""
+	labels, arity = tree
+	result, stack = [], []
+	words = 0
+	for label, a in zip(labels, arity):
+		if stack: stack[-1][2] -= 1
+		if a == -1: words += 1
+		else: stack.append([label, words, a])
+		while stack and stack[-1][2] == 0:
+			label, start, _ = stack.pop()
+			result.append((label, start, words))
+	return result
+
+def writetreebank(trees, filename):
+	""" write an iterable of flat trees to a file in the binary format """
+	symbols = {}
+	offsets, nodes = array('I', [0]), array('i')
+	for labels, arity in trees:
+		for label, a in zip(labels, arity):
+			nodes.append(symbols.setdefault(label, len(symbols)))
+			nodes.append(a)
+		offsets.append(len(nodes) / 2)
+	if byteorder == 'big':
+		offsets.byteswap()
+		nodes.byteswap()
+	out = open(filename, "wb")
+	out.write(HEADER.pack(MAGIC, len(offsets) - 1, len(nodes) / 2,
+		len(symbols)))
+	out.write(offsets.tostring())
+	out.write(nodes.tostring())
+	out.write("\n".join(sorted(symbols, key=symbols.get)))
+	out.close()
+
+class Treebank:
+	def __init__(self, filename):
+		""" a treebank in the binary format, read through mmap. Supports
+		len(), indexing and iteration, which yield flat trees. """
+		self.filename = filename
+		self.file = open(filename, "rb")
+		self.map = mmap(self.file.fileno(), 0, access=ACCESS_READ)
+		magic, self.ntrees, self.nnodes, nsymbols = HEADER.unpack_from(
+			self.map, 0)
+		if magic != MAGIC:
+			raise ValueError("%s: not a binary treebank" % filename)
+		self.offsets = HEADER.size
+		self.nodes = self.offsets + 4 * (self.ntrees + 1)
+		self.symbols = self.map[self.nodes + 8 * self.nnodes:].split("\n")
+		self.symbols = self.symbols[:nsymbols]
+	def __len__(self):
+		return self.ntrees
+	def __getitem__(self, n):
+		if n < 0: n += self.ntrees
+		if not 0 <= n < self.ntrees: raise IndexError(n)
+		start, end = Struct("<II").unpack_from(self.map,
+			self.offsets + 4 * n)
+		data = Struct("<%di" % (2 * (end - start))).unpack_from(self.map,
+			self.nodes + 8 * start)
+		return [self.symbols[a] for a in data[::2]], list(data[1::2])
+	def __iter__(self):
+		for n in xrange(self.ntrees): yield self[n]
+	def tree(self, n):
+		""" tree n as an nltk Tree """
+		from nltk import Tree
+		labels, arity = self[n]
+		if not labels: return None
+		result, stack = None, []
+		for label, a in zip(labels, arity):
+			if a == -1: node = label
+			else: node = Tree(label, [])
+			if stack:
+				stack[-1][0].append(node)
+				stack[-1][1] -= 1
+			else: result = node
+			if a > 0: stack.append([node, a])
+			while stack and stack[-1][1] == 0: stack.pop()
+		return result
+	def sexprs(self):
+		""" the trees in bracket notation """
+		for tree in self: yield writetree(tree)
+
+def fromtext(infile, outfile):
+	""" convert a text treebank with one tree per line """
+	writetreebank((readtree(line) for line in open(infile)), outfile)
+
+def totext(infile, outfile):
+	open(outfile, "w").writelines("%s\n" % a
+		for a in Treebank(infile).sexprs())
+
+def main():
+	opts, args = getopt(argv[1:], "d")
+	if len(args) != 2:
+		print __doc__
+		return
+	if ('-d', '') in opts: totext(*args)
+	else: fromtext(*args)
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		print "%d doctests succeeded!" % attempted
+	main()
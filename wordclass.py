@@ -0,0 +1,213 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" Generate the word class automaton and the open class file for bitpar's
+unknown word handling (the -w and -u options) from the suffix rules of
+esperantotagger, with the tag distribution of each word class estimated
+from a training treebank. Replaces the hand-made pos.dfsa and the flat
+unknownwords files, which allow every open class tag for every unknown word.
+
+Each suffix of an open word class in the tagger rules, combined with each
+inflectional ending (-j, -n, -jn), is a word class; words matching none of
+them (eg. names) form the last class. The tags of a class are estimated
+from the rare words of the treebank (which resemble unknown words), and
+tags below a relative frequency threshold are dropped.
+
+The automaton is written in the format of pos.dfsa: lines with
+"state<TAB>character<TAB>state" for the transitions, and
+"state<TAB>wordclass<TAB>class" for the class of each state, where state 0
+is the start state. Line k of the open class file lists the tags of word
+class k with their frequencies, separated by tabs, as in the lexicon.
+
+usage: python wordclass.py [-f maxfreq] [-t threshold] [-c flatfile] treebank dfsa unknownwords
+"""
+from esperantotagger import RULES, STRIP
+from getopt import getopt
+from sys import argv, stderr
+
+INFLECTIONS = ('', 'j', 'n', 'jn')
+# the x-system used by the treebank
+XSYSTEM = ((u'ĉ', 'cx'), (u'ĝ', 'gx'), (u'ĥ', 'hx'), (u'ĵ', 'jx'),
+	(u'ŝ', 'sx'), (u'ŭ', 'ux'))
+
+def xsystem(word):
+	""" write a word in the x-system.
+
+	>>> xsystem(u'a\u016d')
+	'aux'
+	"""
+	for a, b in XSYSTEM: word = word.replace(a, b)
+	return str(word)
+
+def suffixpatterns(rules=RULES):
+	""" the suffixes of the open word classes in the tagger rules, each
+	combined with the inflectional endings.
+
+	>>> suffixpatterns()[:6]
+	['aux', 'auxj', 'auxn', 'auxjn', 'a', 'aj']
+	"""
+	patterns = []
+	for kind, strings, tag in rules:
+		if kind == 'suffix' and tag is not STRIP:
+			for a in strings:
+				for b in INFLECTIONS:
+					if xsystem(a) + b not in patterns:
+						patterns.append(xsystem(a) + b)
+	return patterns
+
+def suffixautomaton(patterns, alphabet):
+	""" a deterministic automaton reading a word from left to right, which
+	ends in a state identifying the longest pattern that is a suffix of
+	the word. The states are the prefixes of the patterns; the transition
+	on a character goes to the longest suffix of the state plus that
+	character which is again a state. Returns the transitions (a list of
+	dictionaries) and the word class of each state: the 1-based index of
+	the pattern, or len(patterns) + 1 when no pattern matches.
+
+	>>> delta, classes = suffixautomaton(['o', 'oj'], 'jko')
+	>>> delta
+	[{'k': 0, 'j': 0, 'o': 1}, {'k': 0, 'j': 2, 'o': 1}, {'k': 0, 'j': 0, 'o': 1}]
+	>>> classes
+	[3, 1, 2]
+	"""
+	states = sorted(set(a[:n] for a in patterns for n in range(len(a) + 1)),
+		key=lambda a: (len(a), a))
+	index = dict((a, n) for n, a in enumerate(states))
+	delta = []
+	for state in states:
+		transitions = {}
+		for char in alphabet:
+			target = state + char
+			while target not in index: target = target[1:]
+			transitions[char] = index[target]
+		delta.append(transitions)
+	classes = []
+	for state in states:
+		matched = [n for n, a in enumerate(patterns) if state.endswith(a)]
+		classes.append(max(matched, key=lambda n: len(patterns[n])) + 1
+			if matched else len(patterns) + 1)
+	return delta, classes
+
+def classify(word, delta, classes):
+	""" the word class of a word; characters outside of the alphabet of the
+	automaton return it to the start state. """
+	state = 0
+	for char in word: state = delta[state].get(char, 0)
+	return classes[state]
+
+def estimate(tokens, delta, classes, patterns, maxfreq=1, threshold=0.01):
+	""" estimate the tag distribution of each word class from the tagged
+	tokens of words occurring at most maxfreq times. A class without such
+	tokens gets the distribution of the same suffix without inflection, or
+	else that of all rare words. When no word is that rare (eg. in a small
+	treebank), all tokens are used. Tags with a relative frequency below
+	threshold are dropped. Returns a list of dictionaries, one per class.
+
+	>>> delta, classes = suffixautomaton(['o', 'oj'], 'abdjko')
+	>>> tokens = [('domo', 'n'), ('kato', 'n'), ('do', 'prp'), ('ba', 'x')]
+	>>> estimate(tokens, delta, classes, ['o', 'oj'], threshold=0.4)
+	[{'n': 2}, {'n': 2}, {'x': 1}]
+	"""
+	freq = {}
+	for word, tag in tokens: freq[word] = freq.get(word, 0) + 1
+	if tokens and min(freq.values()) > maxfreq: maxfreq = max(freq.values())
+	dists = [{} for _ in range(len(patterns) + 1)]
+	alltags = {}
+	for word, tag in tokens:
+		if freq[word] <= maxfreq:
+			dist = dists[classify(word, delta, classes) - 1]
+			dist[tag] = dist.get(tag, 0) + 1
+			alltags[tag] = alltags.get(tag, 0) + 1
+	for n, dist in enumerate(dists):
+		if not dist:
+			base = [a for a in INFLECTIONS[1:] if n < len(patterns)
+				and patterns[n].endswith(a)
+				and patterns[n][:-len(a)] in patterns]
+			if base:
+				base = max(base, key=len)
+				dists[n] = dist = dict(dists[patterns.index(
+					patterns[n][:-len(base)])])
+			if not dist: dists[n] = dist = dict(alltags)
+		total = float(sum(dist.values()))
+		for tag, count in dist.items():
+			if count / total < threshold and len(dist) > 1: del dist[tag]
+	return dists
+
+def ambiguity(tokens, tagsof, maxfreq=1):
+	""" average number of candidate tags for the tokens of rare words, and
+	the percentage of those tokens whose tag is among the candidates.
+	tagsof is a function mapping a word to its candidate tags. """
+	freq = {}
+	for word, tag in tokens: freq[word] = freq.get(word, 0) + 1
+	rare = [(word, tag) for word, tag in tokens if freq[word] <= maxfreq]
+	if not rare: return 0.0, 0.0
+	candidates = [tagsof(word) for word, tag in rare]
+	return (float(sum(len(a) for a in candidates)) / len(rare),
+		100.0 * sum(1 for (word, tag), a in zip(rare, candidates)
+			if tag in a) / len(rare))
+
+def writedfsa(delta, classes, filename):
+	""" write the automaton in the format of bitpar (cf. pos.dfsa) """
+	out = open(filename, "w")
+	for state, transitions in enumerate(delta):
+		for char in sorted(transitions):
+			out.write("%d\t%s\t%d\n" % (state, char, transitions[char]))
+	for state, wordclass in enumerate(classes):
+		out.write("%d\twordclass\t%d\n" % (state, wordclass))
+	out.close()
+
+def writeopenclass(dists, filename):
+	""" write the tags of each word class, one class per line """
+	open(filename, "w").writelines("%s\n" % "\t".join("%s %d" % a
+		for a in sorted(dist.items())) for dist in dists)
+
+def readtokens(treebank):
+	""" the (word, tag) pairs of a treebank, with the same normalization as
+	the training data of morph.monato() """
+	from nltk import Tree
+	from transform import transform
+	return [x for a in open(treebank) for x in transform(Tree(a.lower()),
+		stripfunc=True, forcepos=True, inplace=True).pos()]
+
+def wordclasses(treebank, dfsa, openclass, maxfreq=1, threshold=0.01):
+	""" estimate the word classes of a treebank and write the automaton
+	and the open class file for bitpar's -w and -u options (used by the
+	wordclass stage of pipeline.py). Returns the tokens of the treebank,
+	the automaton and the tag distributions. """
+	tokens = readtokens(treebank)
+	patterns = suffixpatterns()
+	alphabet = set(char for word, tag in tokens for char in word)
+	delta, classes = suffixautomaton(patterns, alphabet)
+	dists = estimate(tokens, delta, classes, patterns, maxfreq, threshold)
+	writedfsa(delta, classes, dfsa)
+	writeopenclass(dists, openclass)
+	return tokens, (delta, classes), dists
+
+def main():
+	opts, args = getopt(argv[1:], "f:t:c:")
+	opts = dict(opts)
+	if len(args) != 3:
+		print __doc__
+		return
+	treebank, dfsa, openclass = args
+	maxfreq = int(opts.get('-f', 1))
+	tokens, (delta, classes), dists = wordclasses(treebank, dfsa, openclass,
+		maxfreq, float(opts.get('-t', 0.01)))
+	stderr.write("%d states, %d word classes\n" % (len(delta), len(dists)))
+	flat = set(line.split()[0] for line in open(opts.get('-c',
+		'unknownwordsm')) if line.strip())
+	for name, tagsof in (("flat", lambda word: flat),
+			("word classes", lambda word:
+			dists[classify(word, delta, classes) - 1])):
+		tags, coverage = ambiguity(tokens, tagsof, maxfreq)
+		stderr.write("%s: %.2f tags per rare word, correct tag among them "
+			"for %.1f%%\n" % (name, tags, coverage))
+
+if __name__ == '__main__':
+	import doctest
+	# do doctests, but don't be pedantic about whitespace (I suspect it is the
+	# militant anti-tab faction who are behind this obnoxious default)
+	fail, attempted = doctest.testmod(verbose=False,
+		optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
+	if attempted and not fail:
+		stderr.write("%d doctests succeeded!\n" % attempted)
+	main()